@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import Tag, Article, Comment
+from .models import Tag, Article, Comment, PersistedQuery
 
 admin.site.register(Tag)
 admin.site.register(Article)
 admin.site.register(Comment)
+admin.site.register(PersistedQuery)
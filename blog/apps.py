@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class BlogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'blog'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        # リレーションの変換を graphql_auth の UserNode などの定義より前に
+        # 差し替える
+        from . import fields  # noqa: F401
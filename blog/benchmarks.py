@@ -0,0 +1,460 @@
+import asyncio
+import json
+import tracemalloc
+from contextlib import ExitStack
+from itertools import cycle, islice
+from queue import Queue
+from threading import Thread
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import close_old_connections, connections, transaction
+from django.test import AsyncRequestFactory, RequestFactory
+from graphene_django.settings import graphene_settings
+from graphene_django.views import instantiate_middleware
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.shortcuts import get_token
+from graphql_relay import to_global_id
+
+from .models import Article
+
+DEFAULT_ITERATIONS = 30
+DEFAULT_WARMUP = 3
+# 基準値からこの割合を超えて p95 が悪化した場合を退行とみなす
+DEFAULT_TOLERANCE = 0.2
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class Benchmark:
+    """実行するドキュメントと、データセットから変数を作る関数の組"""
+
+    def __init__(self, name, query, variables=None):
+        self.name = name
+        self.query = query
+        self.variables = variables
+
+    def get_variables(self, fixture):
+        return self.variables(fixture) if self.variables else None
+
+
+CATALOGUE = [
+    Benchmark('all_tags', '''
+        query AllTags {
+          allTags(first: 50) { edges { node { id name } } }
+        }
+    '''),
+    Benchmark('all_articles', '''
+        query AllArticles {
+          allArticles(first: 20, isRelease: true) {
+            totalCount
+            edges {
+              node {
+                id title likeCount commentCount createdAt
+                userArticle { username }
+                tags { edges { node { name } } }
+              }
+            }
+          }
+        }
+    '''),
+    Benchmark('all_articles_popular', '''
+        query PopularArticles {
+          allArticles(first: 20, orderByLikeCount: "-like_count") {
+            edges { node { id title likeCount } }
+          }
+        }
+    '''),
+    Benchmark('all_articles_nested', '''
+        query ArticleDetails {
+          allArticles(first: 10) {
+            edges {
+              node {
+                id title content
+                liked(first: 10) { edges { node { username } } }
+                articleComment(first: 10) {
+                  edges { node { text userComment { username } } }
+                }
+              }
+            }
+          }
+        }
+    '''),
+    Benchmark('all_articles_keyset', '''
+        query ArticlesKeyset {
+          allArticlesKeyset(first: 20, orderByCreatedAt: "-created_at") {
+            edges { cursor node { id title } }
+            pageInfo { hasNextPage endCursor }
+          }
+        }
+    '''),
+    Benchmark('all_comments', '''
+        query AllComments {
+          allComments(first: 50) {
+            edges {
+              node {
+                text
+                userComment { username }
+                articleComment { title }
+              }
+            }
+          }
+        }
+    '''),
+    Benchmark('search_articles', '''
+        query SearchArticles {
+          searchArticles(query: "graphql cache", first: 20) {
+            edges { rank node { id title } }
+          }
+        }
+    '''),
+    Benchmark('me', '''
+        query Me { me { username email verified } }
+    '''),
+    Benchmark('create_comment', '''
+        mutation CreateComment($article: ID!) {
+          createComment(input: {text: "benchmark", articleComment: $article}) {
+            comment { id text }
+          }
+        }
+    ''', lambda fixture: {'article': fixture['article']}),
+    Benchmark('update_article', '''
+        mutation UpdateArticle($id: ID!) {
+          updateArticle(input: {
+            id: $id, title: "benchmark", content: "benchmark", isRelease: true
+          }) {
+            article { id title updatedAt }
+          }
+        }
+    ''', lambda fixture: {'id': fixture['own_article']}),
+]
+
+# 同時実行ベンチマークの混合負荷 (匿名の読み取りクエリ)
+PAGE_LOAD = Benchmark('page_load', '''
+    query PageLoad {
+      allTags(first: 20) { edges { node { name } } }
+      allArticles(first: 10) {
+        edges { node { id title userArticle { username } } }
+      }
+      allComments(first: 10) { edges { node { text } } }
+    }
+''')
+CONCURRENCY_MIX = (
+    'all_tags', 'all_articles', 'all_articles_nested', 'all_comments',
+    'search_articles', 'page_load',
+)
+
+# 認証ミドルウェアのフィールドあたりのコストを測る、フィールド数の多いクエリ
+AUTH_FIELDS = Benchmark('auth_fields', '''
+    query AuthFields {
+      allArticles(first: 100) {
+        edges {
+          node {
+            id title likeCount commentCount createdAt
+            userArticle { username }
+          }
+        }
+      }
+    }
+''')
+
+
+def get_fixture(username=None):
+    """ベンチマークを実行するユーザーと、変数に使う記事を選ぶ"""
+    User = get_user_model()
+    users = User.objects.filter(is_staff=True, status__verified=True)
+    if username:
+        users = User.objects.filter(username=username)
+    user = users.order_by('pk').first()
+    if user is None:
+        raise BenchmarkError(
+            'No verified staff user found; run "manage.py seed_blog" first.')
+    own_article = Article.objects.filter(user_article=user).order_by(
+        'pk').first()
+    article = Article.objects.order_by('pk').first()
+    if article is None or own_article is None:
+        raise BenchmarkError('The benchmark user has no articles.')
+    return {
+        'user': user,
+        'article': to_global_id('ArticleNode', article.pk),
+        'own_article': to_global_id('ArticleNode', own_article.pk),
+    }
+
+
+def percentile(values, fraction):
+    """最近傍順位法によるパーセンタイル"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1,
+                       int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def execute(schema, backend, benchmark, fixture, middleware):
+    """1 回実行し、(経過秒, SQL 回数) を返す。書き込みはロールバックする"""
+    request = RequestFactory().post('/graphql')
+    request.user = fixture['user']
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(counter))
+        with transaction.atomic():
+            start = perf_counter()
+            result = schema.execute(
+                benchmark.query,
+                variable_values=benchmark.get_variables(fixture),
+                context_value=request,
+                middleware=middleware,
+                backend=backend,
+            )
+            elapsed = perf_counter() - start
+            transaction.set_rollback(True)
+    if result.errors:
+        raise BenchmarkError('%s: %s' % (benchmark.name, result.errors[0]))
+    return elapsed, counter.count
+
+
+def run(schema, backend, benchmarks=None, iterations=DEFAULT_ITERATIONS,
+        warmup=DEFAULT_WARMUP, username=None):
+    """カタログのドキュメントをプロセス内で実行し、ベンチマークごとの結果を返す"""
+    fixture = get_fixture(username)
+    middleware = list(instantiate_middleware(graphene_settings.MIDDLEWARE))
+    results = {}
+    for benchmark in benchmarks or CATALOGUE:
+        for _ in range(warmup):
+            execute(schema, backend, benchmark, fixture, middleware)
+        timings, queries = [], []
+        for _ in range(iterations):
+            elapsed, count = execute(
+                schema, backend, benchmark, fixture, middleware)
+            timings.append(elapsed)
+            queries.append(count)
+
+        tracemalloc.start()
+        try:
+            execute(schema, backend, benchmark, fixture, middleware)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        results[benchmark.name] = {
+            'p50_ms': percentile(timings, 0.5) * 1000,
+            'p95_ms': percentile(timings, 0.95) * 1000,
+            'queries': max(queries),
+            'peak_kib': peak / 1024,
+        }
+    return results
+
+
+class FieldCounter:
+    """解決したフィールド数を数えるミドルウェア"""
+
+    def __init__(self):
+        self.count = 0
+
+    def resolve(self, next, root, info, **args):
+        self.count += 1
+        return next(root, info, **args)
+
+
+def run_auth(schema, backend, variants, iterations=DEFAULT_ITERATIONS,
+             warmup=DEFAULT_WARMUP, username=None):
+    """トークン付きのリクエストで、認証ミドルウェアごとの実行時間を比べる
+
+    variants は名前と JWT ミドルウェアのクラス (None は認証済みのユーザーを
+    直接設定する基準) の対応。基準との p50 の差を解決したフィールド数で
+    割ったものをフィールドあたりの認証コストとする。
+    """
+    fixture = get_fixture(username)
+    header = '%s %s' % (
+        jwt_settings.JWT_AUTH_HEADER_PREFIX, get_token(fixture['user']))
+    results = {}
+    for name, middleware_class in variants.items():
+        # graphene-django と同様にミドルウェアはビューごとに 1 つ作る
+        middleware = [middleware_class()] if middleware_class else []
+        counter = FieldCounter()
+        timings, queries = [], []
+        for i in range(warmup + iterations):
+            request = RequestFactory().post(
+                '/graphql', HTTP_AUTHORIZATION=header)
+            request.user = (
+                AnonymousUser() if middleware_class else fixture['user'])
+            counter.count = 0
+            sql = QueryCounter()
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(sql))
+                start = perf_counter()
+                result = schema.execute(
+                    AUTH_FIELDS.query,
+                    context_value=request,
+                    middleware=middleware + [counter],
+                    backend=backend,
+                )
+                elapsed = perf_counter() - start
+            if result.errors:
+                raise BenchmarkError('%s: %s' % (name, result.errors[0]))
+            if i >= warmup:
+                timings.append(elapsed)
+                queries.append(sql.count)
+        results[name] = {
+            'p50_ms': percentile(timings, 0.5) * 1000,
+            'p95_ms': percentile(timings, 0.95) * 1000,
+            'queries': max(queries),
+            'fields': counter.count,
+        }
+
+    base = next(iter(results.values()))
+    for result in results.values():
+        result['us_per_field'] = max(
+            0.0, (result['p50_ms'] - base['p50_ms']) * 1000 / result['fields'])
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """基準値と比べ、ベンチマークごとに (名前, 結果, 基準値, 退行の有無) を返す"""
+    rows = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        regressed = base is not None and (
+            result['p95_ms'] > base['p95_ms'] * (1 + tolerance)
+            or result['queries'] > base['queries'])
+        rows.append((name, result, base, regressed))
+    return rows
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def save_baseline(path, results, metadata):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'metadata': metadata, 'results': results}, f,
+                  indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def concurrency_workload(requests):
+    catalogue = {benchmark.name: benchmark for benchmark in CATALOGUE}
+    catalogue[PAGE_LOAD.name] = PAGE_LOAD
+    mix = [catalogue[name] for name in CONCURRENCY_MIX]
+    return list(islice(cycle(mix), requests))
+
+
+def _graphql_request(factory, benchmark):
+    request = factory.post(
+        '/graphql', json.dumps({'query': benchmark.query}),
+        content_type='application/json')
+    request.user = AnonymousUser()
+    return request
+
+
+def _check(benchmark, response):
+    if response.status_code != 200 or b'"errors"' in response.content:
+        raise BenchmarkError('%s: %s' % (
+            benchmark.name, response.content[:200].decode()))
+
+
+def run_sync_workers(view, workload, concurrency, workers=1):
+    """同期 (WSGI) ワーカー workers 個の 1 プロセスに concurrency 個の
+    クライアントが同時にリクエストを送る場合を模擬する (先着順で処理する)"""
+    requests = Queue()
+    timings = []
+
+    def worker():
+        close_old_connections()
+        try:
+            while True:
+                item = requests.get()
+                if item is None:
+                    return
+                request, reply = item
+                try:
+                    reply.put(view(request))
+                except Exception as e:
+                    reply.put(e)
+        finally:
+            close_old_connections()
+
+    def client(benchmarks):
+        reply = Queue()
+        for benchmark in benchmarks:
+            start = perf_counter()
+            requests.put(
+                (_graphql_request(RequestFactory(), benchmark), reply))
+            response = reply.get()
+            timings.append((benchmark.name, perf_counter() - start))
+            if isinstance(response, Exception):
+                raise response
+            _check(benchmark, response)
+
+    servers = [Thread(target=worker) for _ in range(workers)]
+    clients = [
+        Thread(target=client, args=(workload[i::concurrency],))
+        for i in range(concurrency)
+    ]
+    start = perf_counter()
+    for thread in servers + clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = perf_counter() - start
+    for _ in servers:
+        requests.put(None)
+    for thread in servers:
+        thread.join()
+    if len(timings) != len(workload):
+        raise BenchmarkError('Some requests failed; see the output above.')
+    return elapsed, timings
+
+
+def run_async_view(view, workload, concurrency):
+    """非同期 (ASGI) ビューに concurrency 個のクライアントが同時にリクエストを送る"""
+    timings = []
+
+    async def client(benchmarks):
+        for benchmark in benchmarks:
+            start = perf_counter()
+            response = await view(
+                _graphql_request(AsyncRequestFactory(), benchmark))
+            timings.append((benchmark.name, perf_counter() - start))
+            _check(benchmark, response)
+
+    async def main():
+        await asyncio.gather(*[
+            client(workload[i::concurrency]) for i in range(concurrency)])
+
+    start = perf_counter()
+    asyncio.run(main())
+    return perf_counter() - start, timings
+
+
+def summarize(elapsed, timings):
+    latencies = [seconds for name, seconds in timings]
+    by_name = {}
+    for name, seconds in timings:
+        by_name.setdefault(name, []).append(seconds)
+    return {
+        'requests': len(timings),
+        'elapsed_s': elapsed,
+        'throughput_rps': len(timings) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p95_ms_by_query': {
+            name: percentile(values, 0.95) * 1000
+            for name, values in sorted(by_name.items())
+        },
+    }
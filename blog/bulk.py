@@ -0,0 +1,112 @@
+from django.db import connection
+from django.db.models.functions import Lower
+from django.utils import timezone
+from graphql_relay import from_global_id
+
+from .counts import bump_count_version, rebuild_counters
+from .feeds import articles_changed
+from .models import Article, Tag
+from .search import index_articles
+from .versions import bump_versions
+
+
+class BulkErrors:
+    """一括処理の各要素に対するエラーを集める"""
+
+    def __init__(self):
+        self.items = []
+        self.indexes = set()
+
+    def add(self, index, message, id=None):
+        self.indexes.add(index)
+        self.items.append({'index': index, 'id': id, 'message': message})
+
+    def __contains__(self, index):
+        return index in self.indexes
+
+
+def resolve_global_ids(global_ids, node_names, model):
+    """グローバル ID をまとめて検証し、1 回の id__in クエリでオブジェクトを取得する"""
+    pks = {}
+    for global_id in set(global_ids):
+        try:
+            type_name, pk = from_global_id(global_id)
+            if type_name in node_names:
+                pks[global_id] = int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            pass
+    objects = model.objects.in_bulk(list(pks.values()))
+    return {
+        global_id: objects[pk]
+        for global_id, pk in pks.items() if pk in objects
+    }
+
+
+def bulk_create_with_pks(model, objects):
+    """bulk_create し、主キーが設定されたオブジェクトを返す"""
+    if not objects:
+        return []
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objects)
+    # 主キーを返せない DB (Django 3.2 の SQLite) ではトランザクション内で
+    # 採番された範囲を読み直す
+    last_pk = model.objects.order_by('-pk').values_list(
+        'pk', flat=True).first() or 0
+    model.objects.bulk_create(objects)
+    return list(model.objects.filter(pk__gt=last_pk).order_by('pk'))
+
+
+def set_article_relations(field, relations):
+    """記事ごとの多対多を中間テーブルへの一括 DELETE / INSERT で置き換える"""
+    if not relations:
+        return
+    through = field.remote_field.through
+    source = field.m2m_field_name() + '_id'
+    target = field.m2m_reverse_field_name() + '_id'
+    through.objects.filter(**{source + '__in': list(relations)}).delete()
+    through.objects.bulk_create([
+        through(**{source: article_id, target: related_id})
+        for article_id, related_ids in relations.items()
+        for related_id in dict.fromkeys(related_ids)
+    ])
+
+
+def tags_by_name(names):
+    """大文字・小文字を区別せずに既存のタグを取得し、小文字の名前で引ける辞書を返す
+
+    LOWER(name) の一意インデックスで検索する。
+    """
+    keys = {name.lower() for name in names}
+    if not keys:
+        return {}
+    return {
+        tag.name_lower: tag for tag in Tag.objects.annotate(
+            name_lower=Lower('name')).filter(name_lower__in=keys)
+    }
+
+
+def tags_written():
+    """bulk_create は post_save を送らないため、シグナル相当の後処理を行う"""
+    bump_versions(Tag._meta.label)
+    bump_count_version()
+
+
+def articles_written(article_ids, likes_changed=False, tag_ids=()):
+    """bulk_update は post_save を送らないため、シグナル相当の後処理を行う
+
+    tag_ids には付け替えで外れた可能性のあるタグを渡す (フィードの再生成用)。
+    """
+    if likes_changed:
+        rebuild_counters(
+            Article.objects.filter(pk__in=article_ids), comments=False)
+    index_articles(article_ids)
+    bump_versions(Article._meta.label)
+    bump_count_version()
+    articles_changed(article_ids, tag_ids)
+
+
+def touch(articles):
+    """bulk_update では auto_now が働かないため更新日時を設定する"""
+    now = timezone.now()
+    for article in articles:
+        article.updated_at = now
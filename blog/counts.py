@@ -0,0 +1,154 @@
+import hashlib
+import json
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import local
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from graphql_api import routers
+
+VERSION_KEY = 'blog:count-version'
+CACHED_MODELS = ('blog.Article', 'blog.Comment', 'blog.Tag')
+# シグナル・いいねの処理が F 式で増減する記事の列
+COUNTER_FIELDS = ('like_count', 'comment_count')
+
+_pending = local()
+
+
+def bump_count_version():
+    """記事・コメント・タグの書き込み時にキャッシュ済みの件数を無効化する"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def estimate_count(queryset):
+    """Postgres のプランナ統計から件数を見積もる (他の DB では None)
+
+    SQL にする前に空と分かる条件では 0 を返す。
+    """
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        # pk__in=[] など、結果が空と分かっている条件
+        return 0
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def total_count(queryset):
+    """設定に応じて見積もり・キャッシュ済み・実際の件数のいずれかを返す"""
+    options = settings.GRAPHQL_API
+    if options['TOTAL_COUNT_MODE'] == 'estimated':
+        estimate = estimate_count(queryset)
+        if (estimate is not None
+                and estimate >= options['TOTAL_COUNT_ESTIMATE_THRESHOLD']):
+            return estimate
+
+    timeout = options['TOTAL_COUNT_CACHE_TIMEOUT']
+    if not timeout or queryset.model._meta.label not in CACHED_MODELS:
+        return queryset.count()
+    # レプリカの件数は遅延で書き込み前のことがあるため、バージョン (書き込み
+    # 時に進む) に結び付けて保存しない
+    if routers.current_alias() is not None:
+        return queryset.count()
+
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    version = cache.get_or_set(VERSION_KEY, 1, None)
+    digest = hashlib.sha1(repr((sql, params)).encode('utf-8')).hexdigest()
+    key = 'blog:count:%s:%s' % (version, digest)
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+def _apply_counters(article_ids, field, delta):
+    from .models import Article
+
+    Article.objects.filter(pk__in=article_ids).update(
+        **{field: F(field) + delta})
+
+
+def add_to_counter(article_ids, field, delta):
+    """記事の like_count / comment_count を F 式で増減する"""
+    pending = getattr(_pending, 'deltas', None)
+    if pending is None:
+        _apply_counters(article_ids, field, delta)
+        return
+    for article_id in article_ids:
+        pending[field, article_id] += delta
+
+
+@contextmanager
+def batch_counter_updates():
+    """ブロック内のカウンタ増減をまとめ、増減量ごとに 1 回の UPDATE で反映する"""
+    if getattr(_pending, 'deltas', None) is not None:
+        yield
+        return
+    _pending.deltas = defaultdict(int)
+    try:
+        yield
+        grouped = defaultdict(list)
+        for (field, article_id), delta in _pending.deltas.items():
+            if delta:
+                grouped[field, delta].append(article_id)
+    finally:
+        _pending.deltas = None
+    for (field, delta), article_ids in grouped.items():
+        _apply_counters(article_ids, field, delta)
+
+
+def save_without_counters(article):
+    """カウンタ以外の列を保存し、カウンタはデータベースの値を読み直す
+
+    インスタンスが読み込み後に中間テーブル・コメントの変更で古くなった
+    カウンタを書き戻さないようにする。
+    """
+    article.save(update_fields=[
+        field.name for field in article._meta.concrete_fields
+        if not field.primary_key and field.name not in COUNTER_FIELDS
+    ])
+    article.refresh_from_db(fields=COUNTER_FIELDS)
+
+
+def _count_subquery(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by().values(field)
+        .annotate(count=Count('*')).values('count'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+def rebuild_counters(queryset=None, likes=True, comments=True):
+    """中間テーブルとコメントから like_count / comment_count を再計算する"""
+    from .models import Article, Comment
+
+    if queryset is None:
+        queryset = Article.objects.all()
+    values = {}
+    if likes:
+        values['like_count'] = _count_subquery(
+            Article.liked.through.objects.all(), 'article')
+    if comments:
+        values['comment_count'] = _count_subquery(
+            Comment.objects.all(), 'article_comment')
+    return queryset.update(**values)
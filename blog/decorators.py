@@ -1,14 +1,53 @@
 from graphql_jwt import exceptions
 from functools import wraps
 
+from django.conf import settings
+from django.core.cache import cache
+from graphql_auth.models import UserStatus
+
+VERIFIED_KEY = 'blog:verified:%s'
+
+
+def verified_cache_key(user_id):
+    return VERIFIED_KEY % user_id
+
+
+def invalidate_verified(user_id):
+    cache.delete(verified_cache_key(user_id))
+
+
+def is_verified(user):
+    """ユーザーがメール認証済みかを返す
+
+    結果はユーザーのインスタンス (リクエスト内) と、VERIFIED_CACHE_TIMEOUT
+    秒のキャッシュに保持し、UserStatus の取得を省く。キャッシュは
+    UserStatus・ユーザーの保存と削除で無効化される。
+    """
+    if not user.is_authenticated:
+        return False
+    verified = getattr(user, '_verified', None)
+    if verified is not None:
+        return verified
+
+    if type(user).status.is_cached(user):
+        verified = user.status.verified
+    else:
+        timeout = settings.GRAPHQL_API['VERIFIED_CACHE_TIMEOUT']
+        key = verified_cache_key(user.pk)
+        verified = cache.get(key) if timeout else None
+        if verified is None:
+            verified = UserStatus.objects.filter(
+                user_id=user.pk, verified=True).exists()
+            if timeout:
+                cache.set(key, verified, timeout)
+    user._verified = verified
+    return verified
+
 
 def verification_required(fn):
     @wraps(fn)
     def wrapper(root, info, **input):
-        try:
-            if not info.context.user.status.verified:
-                raise exceptions.PermissionDenied()
-        except:
+        if not is_verified(info.context.user):
             raise exceptions.PermissionDenied()
 
         return fn(root, info, **input)
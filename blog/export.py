@@ -0,0 +1,95 @@
+from collections import defaultdict
+from datetime import datetime, time
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Article, Comment, Tag
+
+EXPORT_TYPES = ('tags', 'articles', 'comments')
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def parse_updated_since(value):
+    """ISO 8601 の日時 (または日付) を解釈する (タイムゾーンがなければ
+    現在のタイムゾーン)"""
+    updated_since = parse_datetime(value)
+    if updated_since is None and parse_date(value) is not None:
+        updated_since = datetime.combine(parse_date(value), time.min)
+    if updated_since is None:
+        raise ValueError('updated_since must be an ISO 8601 datetime.')
+    if timezone.is_naive(updated_since):
+        updated_since = timezone.make_aware(updated_since)
+    return updated_since
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_tags(updated_since=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    # タグには更新日時がないため、差分でも常にすべて出力する
+    for tag in Tag.objects.order_by('pk').values(
+            'id', 'name').iterator(chunk_size=chunk_size):
+        yield dict(type='tag', **tag)
+
+
+def export_articles(updated_since=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    queryset = Article.objects.order_by('pk').values(
+        'id', 'title', 'content', 'excerpt', 'content_length', 'is_release',
+        'like_count', 'comment_count', 'created_at', 'updated_at',
+        author=F('user_article__username'),
+    )
+    if updated_since is not None:
+        queryset = queryset.filter(updated_at__gte=updated_since)
+    through = Article.tags.through
+    # iterator() では prefetch_related が使えないため、タグ名はチャンクごとに
+    # 中間テーブルから 1 回で取得する
+    for chunk in chunked(queryset.iterator(chunk_size=chunk_size), chunk_size):
+        tags = defaultdict(list)
+        for article_id, name in through.objects.filter(
+                article_id__in=[article['id'] for article in chunk]
+        ).order_by('id').values_list('article_id', 'tag__name'):
+            tags[article_id].append(name)
+        for article in chunk:
+            yield dict(type='article', tags=tags[article['id']], **article)
+
+
+def export_comments(updated_since=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    queryset = Comment.objects.order_by('pk').values(
+        'id', 'text', 'created_at', 'updated_at',
+        article_id=F('article_comment_id'),
+        author=F('user_comment__username'),
+    )
+    if updated_since is not None:
+        queryset = queryset.filter(updated_at__gte=updated_since)
+    for comment in queryset.iterator(chunk_size=chunk_size):
+        yield dict(type='comment', **comment)
+
+
+EXPORTERS = {
+    'tags': export_tags,
+    'articles': export_articles,
+    'comments': export_comments,
+}
+
+
+def export_lines(types=EXPORT_TYPES, updated_since=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+    """タグ・記事・コメントを 1 行 1 件の JSON (NDJSON) で順に返す
+
+    各クエリは iterator() で chunk_size 件ずつ読み込むため、メモリ使用量は
+    件数によらず一定になる。
+    """
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for name in types:
+        for record in EXPORTERS[name](updated_since, chunk_size):
+            yield encoder.encode(record) + '\n'
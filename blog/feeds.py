@@ -0,0 +1,250 @@
+import hashlib
+import time
+from io import StringIO
+from threading import local
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import F, Max, Prefetch
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from .models import Article, Tag
+
+FEED_FORMATS = {
+    'rss': Rss201rev2Feed,
+    'atom': Atom1Feed,
+}
+SITEMAP_CONTENT_TYPE = 'application/xml; charset=utf-8'
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+KEY_PREFIX = 'blog:feed:'
+
+_state = local()
+
+
+# ドキュメント名: "rss" / "atom" (全体)、"rss:tag:<id>" / "atom:tag:<id>"
+# (タグ別)、"sitemap" (インデックス)、"sitemap:<ページ>"
+
+def feed_names(tag_ids=(), include_all=True):
+    names = set()
+    for fmt in FEED_FORMATS:
+        if include_all:
+            names.add(fmt)
+        names.update('%s:tag:%d' % (fmt, tag_id) for tag_id in tag_ids)
+    return names
+
+
+def sitemap_page(article_id):
+    return (article_id - 1) // settings.GRAPHQL_API['SITEMAP_PAGE_SIZE'] + 1
+
+
+def sitemap_names(article_ids):
+    return {'sitemap'} | {
+        'sitemap:%d' % sitemap_page(pk) for pk in article_ids}
+
+
+def article_url(article_id):
+    return settings.GRAPHQL_API['FEED_SITE_URL'].rstrip('/') + (
+        settings.GRAPHQL_API['FEED_ARTICLE_PATH'].format(id=article_id))
+
+
+def api_url(path):
+    return settings.GRAPHQL_API['FEED_API_URL'].rstrip('/') + path
+
+
+def released_articles():
+    return Article.objects.filter(is_release=True)
+
+
+def build_feed(fmt, tag_id=None):
+    """公開記事の新着 FEED_SIZE 件のフィードを生成する (タグがなければ None)
+
+    投稿者は select_related、タグは prefetch_related でまとめて読み込み、
+    本文の代わりに保存済みの抜粋を使う。
+    """
+    title = settings.GRAPHQL_API['FEED_TITLE']
+    articles = released_articles()
+    path = '/feeds/articles.%s' % fmt
+    if tag_id is not None:
+        tag = Tag.objects.filter(pk=tag_id).first()
+        if tag is None:
+            return None
+        title = '%s: %s' % (title, tag.name)
+        articles = articles.filter(tags=tag_id)
+        path = '/feeds/tags/%d.%s' % (tag_id, fmt)
+    articles = articles.select_related('user_article').only(
+        'id', 'title', 'excerpt', 'created_at', 'updated_at',
+        'user_article__username',
+    ).prefetch_related(
+        Prefetch('tags', queryset=Tag.objects.only('id', 'name')),
+    ).order_by('-created_at', '-id')[:settings.GRAPHQL_API['FEED_SIZE']]
+
+    feed = FEED_FORMATS[fmt](
+        title=title,
+        link=settings.GRAPHQL_API['FEED_SITE_URL'],
+        description=title,
+        feed_url=api_url(path),
+    )
+    for article in articles:
+        feed.add_item(
+            title=article.title,
+            link=article_url(article.pk),
+            description=article.excerpt,
+            unique_id=article_url(article.pk),
+            pubdate=article.created_at,
+            updateddate=article.updated_at,
+            author_name=article.user_article.username,
+            categories=[tag.name for tag in article.tags.all()],
+        )
+    return feed.writeString('utf-8').encode('utf-8'), feed.content_type
+
+
+def _write_sitemap(root, entries):
+    out = StringIO()
+    handler = SimplerXMLGenerator(out, 'utf-8')
+    handler.startDocument()
+    handler.startElement(root, {'xmlns': SITEMAP_NS})
+    child = 'sitemap' if root == 'sitemapindex' else 'url'
+    for loc, lastmod in entries:
+        handler.startElement(child, {})
+        handler.addQuickElement('loc', loc)
+        handler.addQuickElement('lastmod', lastmod.isoformat())
+        handler.endElement(child)
+    handler.endElement(root)
+    return out.getvalue().encode('utf-8'), SITEMAP_CONTENT_TYPE
+
+
+def build_sitemap_page(page):
+    """主キーの範囲で区切った 1 ページ分のサイトマップ (空なら None)"""
+    size = settings.GRAPHQL_API['SITEMAP_PAGE_SIZE']
+    rows = released_articles().filter(
+        pk__gt=(page - 1) * size, pk__lte=page * size,
+    ).order_by('pk').values_list('pk', 'updated_at')
+    entries = [(article_url(pk), updated_at) for pk, updated_at in rows]
+    if not entries:
+        return None
+    return _write_sitemap('urlset', entries)
+
+
+def build_sitemap_index():
+    """公開記事のあるページと各ページの最終更新日時を 1 回の集計で求める"""
+    size = settings.GRAPHQL_API['SITEMAP_PAGE_SIZE']
+    pages = released_articles().annotate(
+        page=(F('id') - 1) / size + 1,
+    ).values('page').annotate(lastmod=Max('updated_at')).order_by('page')
+    return _write_sitemap('sitemapindex', [
+        (api_url('/sitemap-%d.xml' % row['page']), row['lastmod'])
+        for row in pages
+    ])
+
+
+def build(name):
+    """ドキュメント名から (本文, Content-Type) を生成する (存在しなければ None)"""
+    parts = name.split(':')
+    if parts[0] in FEED_FORMATS:
+        return build_feed(parts[0], int(parts[2]) if len(parts) == 3 else None)
+    if parts == ['sitemap']:
+        return build_sitemap_index()
+    return build_sitemap_page(int(parts[1]))
+
+
+def is_shared_cache():
+    """フィードを保存するキャッシュをすべてのプロセスで共有しているか"""
+    return not isinstance(
+        caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+def refresh(name):
+    """ドキュメントを生成し直し、FEED_CACHE_TIMEOUT 秒キャッシュに保存する
+
+    ETag は本文のハッシュ、Last-Modified は本文が変わった時刻とする (記事の
+    削除も反映されるよう、更新日時ではなく生成時に比較する)。
+    """
+    key = KEY_PREFIX + name
+    built = build(name)
+    if built is None:
+        cache.delete(key)
+        return None
+    body, content_type = built
+    etag = '"%s"' % hashlib.sha256(body).hexdigest()
+    previous = cache.get(key)
+    if previous is not None and previous['etag'] == etag:
+        last_modified = previous['last_modified']
+    else:
+        last_modified = int(time.time())
+    document = {
+        'body': body,
+        'content_type': content_type,
+        'etag': etag,
+        'last_modified': last_modified,
+    }
+    cache.set(key, document, settings.GRAPHQL_API['FEED_CACHE_TIMEOUT'])
+    return document
+
+
+def get_document(name):
+    """生成済みのドキュメントを返す (キャッシュから消えていれば生成する)"""
+    return cache.get(KEY_PREFIX + name) or refresh(name)
+
+
+def _refresh_pending():
+    names, _state.pending = getattr(_state, 'pending', set()), set()
+    for name in sorted(names):
+        refresh(name)
+
+
+def refresh_later(names):
+    """コミット後に names のドキュメントを生成し直す
+
+    同じトランザクション内の変更はまとめ、最初のコールバックで 1 回だけ
+    生成する。
+    """
+    if not names:
+        return
+    if not hasattr(_state, 'pending'):
+        _state.pending = set()
+    _state.pending.update(names)
+    transaction.on_commit(_refresh_pending)
+
+
+def tag_ids_for(article_ids):
+    through = Article.tags.through
+    return set(through.objects.filter(
+        article_id__in=list(article_ids)).values_list('tag_id', flat=True))
+
+
+def articles_changed(article_ids, tag_ids=()):
+    """記事の作成・更新・削除で影響するフィードとサイトマップを生成し直す
+
+    tag_ids には変更前に付いていたタグ (削除・付け替えで外れたもの) を渡す。
+    """
+    article_ids = list(article_ids)
+    if not article_ids:
+        return
+    tag_ids = set(tag_ids) | tag_ids_for(article_ids)
+    refresh_later(feed_names(tag_ids) | sitemap_names(article_ids))
+
+
+def invalidate_all():
+    """すべてのドキュメントを削除し、次のリクエストで生成させる
+
+    プロセスごとのキャッシュでは、他のプロセスの分は FEED_CACHE_TIMEOUT
+    秒後に生成し直される。
+    """
+    last_pk = Article.objects.order_by('-pk').values_list(
+        'pk', flat=True).first() or 0
+    names = feed_names(Tag.objects.values_list('pk', flat=True)) | {
+        'sitemap'} | {
+        'sitemap:%d' % page for page in range(1, sitemap_page(last_pk) + 1)}
+    cache.delete_many([KEY_PREFIX + name for name in names])
+
+
+def all_names():
+    """公開記事のあるタグ・サイトマップのページを含むすべてのドキュメント名"""
+    tag_ids = Tag.objects.filter(
+        tag_article__is_release=True).values_list('pk', flat=True).distinct()
+    article_ids = released_articles().values_list('pk', flat=True)
+    return feed_names(tag_ids) | sitemap_names(article_ids)
@@ -0,0 +1,305 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import models
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.utils.dateparse import parse_datetime
+from graphene import Dynamic
+from graphene.relay import PageInfo
+from graphene.utils.str_converters import to_snake_case
+from graphene_django.converter import (
+    convert_django_field,
+    convert_field_to_list_or_connection,
+)
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+from graphql import GraphQLError
+from graphql_relay.connection.arrayconnection import (
+    cursor_to_offset,
+    offset_to_cursor,
+)
+from graphql_relay.utils import base64, unbase64
+from promise import Promise
+
+from .loaders import get_loaders
+
+
+class CountOnDemandConnectionField(DjangoFilterConnectionField):
+    """totalCount が選択された場合のみ COUNT を発行するコネクション"""
+
+    @staticmethod
+    def apply_page_size(info, args, max_limit):
+        """first / last の上限を検査し、どちらも無ければ既定のページサイズを使う"""
+        for arg in ('first', 'last'):
+            value = args.get(arg)
+            if max_limit and value is not None and value > max_limit:
+                raise GraphQLError(
+                    'Requesting %d records on the `%s` connection exceeds '
+                    'the `%s` limit of %d records.' % (
+                        value, info.field_name, arg, max_limit))
+        if args.get('first') is None and args.get('last') is None:
+            page_size = settings.GRAPHQL_API['DEFAULT_PAGE_SIZE']
+            if max_limit:
+                page_size = min(page_size, max_limit)
+            args['first'] = page_size
+
+    @classmethod
+    def connection_resolver(
+        cls,
+        resolver,
+        connection,
+        default_manager,
+        queryset_resolver,
+        max_limit,
+        enforce_first_or_last,
+        root,
+        info,
+        **args
+    ):
+        cls.apply_page_size(info, args, max_limit)
+        return super(CountOnDemandConnectionField, cls).connection_resolver(
+            resolver, connection, default_manager, queryset_resolver,
+            max_limit, enforce_first_or_last, root, info, **args)
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        iterable = maybe_queryset(iterable)
+        first = args.get('first')
+        if max_limit:
+            first = min(first, max_limit) if first else max_limit
+        if (not isinstance(iterable, QuerySet) or first is None
+                or args.get('last') is not None or args.get('before')):
+            return super(CountOnDemandConnectionField, cls).resolve_connection(
+                connection, args, iterable, max_limit=max_limit)
+
+        start = 0
+        if args.get('after'):
+            offset = cursor_to_offset(args['after'])
+            if offset is None or offset < 0:
+                raise GraphQLError('Invalid cursor `after`.')
+            start = offset + 1
+        if args.get('offset'):
+            if args['offset'] < 0:
+                raise GraphQLError('`offset` must not be negative.')
+            start += args['offset']
+        nodes = list(iterable[start:start + first + 1])
+        edges = [
+            connection.Edge(node=node, cursor=offset_to_cursor(start + i))
+            for i, node in enumerate(nodes[:first])
+        ]
+        result = connection(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=False,
+                has_next_page=len(nodes) > first,
+            ),
+        )
+        result.iterable = iterable
+        return result
+
+
+class SearchConnectionField(CountOnDemandConnectionField):
+    """ノード既定のものとは別のコネクション型 (全文検索用) を返すコネクション"""
+
+    def __init__(self, type, connection, *args, **kwargs):
+        self.search_connection = connection
+        super(SearchConnectionField, self).__init__(type, *args, **kwargs)
+
+    @property
+    def type(self):
+        return self.search_connection
+
+
+class BatchedFilterConnectionField(CountOnDemandConnectionField):
+    """フィルタ指定が無い場合は DataLoader で一括取得するリレーション用コネクション"""
+
+    def __init__(self, type, loader, *args, **kwargs):
+        self.loader = loader
+        super(BatchedFilterConnectionField, self).__init__(
+            type, *args, **kwargs)
+
+    @classmethod
+    def batched_resolver(cls, loader, filtering_args, parent_resolver,
+                         root, info, **args):
+        if any(arg in filtering_args for arg in args):
+            return parent_resolver(root, info, **args)
+        prefetched = getattr(root, '_prefetched_objects_cache', {})
+        name = to_snake_case(info.field_name)
+        if name in prefetched:
+            return list(prefetched[name])
+        return getattr(get_loaders(info), loader).load(root.pk)
+
+    @classmethod
+    def resolve_queryset(
+        cls, connection, iterable, info, args, filtering_args, filterset_class
+    ):
+        if Promise.is_thenable(iterable) or isinstance(iterable, list):
+            return iterable
+        return super(BatchedFilterConnectionField, cls).resolve_queryset(
+            connection, iterable, info, args, filtering_args, filterset_class
+        )
+
+    def get_resolver(self, parent_resolver):
+        resolver = partial(
+            self.batched_resolver,
+            self.loader,
+            self.filtering_args,
+            parent_resolver,
+        )
+        return super(BatchedFilterConnectionField, self).get_resolver(resolver)
+
+
+class KeysetConnectionField(CountOnDemandConnectionField):
+    """(作成日時 or 更新日時, id) をカーソルとするシーク方式のコネクション"""
+
+    ordering_args = (
+        ('order_by_updated_at', 'updated_at'),
+        ('order_by_created_at', 'created_at'),
+    )
+    # カーソルの生成に必要なため、選択されていなくても読み込む列
+    cursor_fields = tuple(key for arg, key in ordering_args)
+
+    @classmethod
+    def ordering_key(cls, args):
+        for arg, key in cls.ordering_args:
+            value = args.get(arg)
+            if value:
+                return key, value.strip().startswith('-')
+        return 'created_at', False
+
+    @staticmethod
+    def encode_cursor(key, node):
+        return base64('%s|%s|%s' % (
+            key, getattr(node, key).isoformat(), node.pk))
+
+    @staticmethod
+    def decode_cursor(key, cursor):
+        try:
+            cursor_key, value, pk = unbase64(cursor).split('|')
+            value = parse_datetime(value)
+            pk = int(pk)
+        except ValueError:
+            value = None
+        if value is None or cursor_key != key:
+            raise GraphQLError('Invalid cursor for this ordering.')
+        return value, pk
+
+    @classmethod
+    def seek(cls, key, descending, cursor, forward):
+        value, pk = cls.decode_cursor(key, cursor)
+        op = 'gt' if descending != forward else 'lt'
+        return (
+            Q(**{'%s__%s' % (key, op): value})
+            | Q(**{key: value, 'pk__%s' % op: pk})
+        )
+
+    @classmethod
+    def resolve_keyset(cls, connection, queryset, args, max_limit):
+        first = args.get('first')
+        last = args.get('last')
+        after = args.get('after')
+        before = args.get('before')
+        key, descending = cls.ordering_key(args)
+
+        prefix = '-' if descending else ''
+        iterable = queryset
+        queryset = queryset.order_by(prefix + key, prefix + 'pk')
+        if after:
+            queryset = queryset.filter(cls.seek(key, descending, after, True))
+        if before:
+            queryset = queryset.filter(
+                cls.seek(key, descending, before, False))
+
+        if last is not None and first is None:
+            nodes = list(queryset.reverse()[:last + 1])
+            has_previous_page = len(nodes) > last
+            nodes = nodes[:last][::-1]
+            has_next_page = bool(before)
+        else:
+            first = min(first, max_limit) if max_limit and first else (
+                first or max_limit)
+            if first is None:
+                nodes = list(queryset)
+            else:
+                nodes = list(queryset[:first + 1])
+            has_next_page = first is not None and len(nodes) > first
+            nodes = nodes[:first]
+            has_previous_page = bool(after)
+            if last is not None and len(nodes) > last:
+                nodes = nodes[-last:]
+                has_previous_page = True
+
+        edges = [
+            connection.Edge(node=node, cursor=cls.encode_cursor(key, node))
+            for node in nodes
+        ]
+        result = connection(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_previous_page,
+                has_next_page=has_next_page,
+            ),
+        )
+        result.iterable = iterable
+        return result
+
+    @classmethod
+    def connection_resolver(
+        cls,
+        resolver,
+        connection,
+        default_manager,
+        queryset_resolver,
+        max_limit,
+        enforce_first_or_last,
+        root,
+        info,
+        **args
+    ):
+        if args.get('offset') is not None:
+            raise GraphQLError(
+                'Keyset connections do not support `offset`; '
+                'use `after` / `before` cursors instead.')
+        cls.apply_page_size(info, args, max_limit)
+        if enforce_first_or_last:
+            assert args.get('first') or args.get('last'), (
+                "You must provide a `first` or `last` value to properly "
+                "paginate the `{}` connection."
+            ).format(info.field_name)
+
+        iterable = resolver(root, info, **args)
+        if iterable is None:
+            iterable = default_manager
+        queryset = queryset_resolver(connection, iterable, info, args)
+        return cls.resolve_keyset(connection, queryset, args, max_limit)
+
+
+@convert_django_field.register(models.ManyToManyField)
+@convert_django_field.register(models.ManyToManyRel)
+@convert_django_field.register(models.ManyToOneRel)
+def convert_field_to_connection(field, registry=None):
+    """フィルタ付きのノードへのリレーションを CountOnDemandConnectionField にする
+
+    graphene-django が自動生成する DjangoFilterConnectionField (TagNode.
+    tagArticle など) にも既定のページサイズを適用するため。ノードの定義より
+    前に登録する必要があるので、BlogConfig.ready で読み込む。
+    """
+    converted = convert_field_to_list_or_connection(field, registry)
+
+    def dynamic_type():
+        _type = registry.get_type_for_model(field.related_model)
+        if not _type or not _type._meta.connection or not (
+                _type._meta.filter_fields or _type._meta.filterset_class):
+            return converted.get_type()
+        description = (
+            field.help_text if isinstance(field, models.ManyToManyField)
+            else field.field.help_text)
+        return CountOnDemandConnectionField(
+            _type, required=True, description=description)
+
+    return Dynamic(dynamic_type)
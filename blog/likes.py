@@ -0,0 +1,49 @@
+from django.db import IntegrityError, transaction
+
+from .counts import add_to_counter, bump_count_version
+from .models import Article
+from .versions import bump_versions
+
+liked_field = Article._meta.get_field('liked')
+Like = liked_field.remote_field.through
+
+
+def _like_row(article_id, user_id):
+    return {
+        liked_field.m2m_field_name() + '_id': article_id,
+        liked_field.m2m_reverse_field_name() + '_id': user_id,
+    }
+
+
+def _likes_changed(article_id, delta):
+    # 中間テーブルへの直接の書き込みは m2m_changed を送らないため、
+    # シグナル相当の後処理を行う
+    add_to_counter([article_id], 'like_count', delta)
+    bump_versions(Article._meta.label)
+    bump_count_version()
+
+
+def like_article(article_id, user_id):
+    """中間テーブルへの 1 行の INSERT でいいねし、追加した場合は True を返す
+
+    いいね済みなら一意制約で INSERT が失敗するため、同時に押されても
+    いいね数は 1 回分しか増えない。
+    """
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                Like.objects.create(**_like_row(article_id, user_id))
+        except IntegrityError:
+            return False
+        _likes_changed(article_id, 1)
+    return True
+
+
+def unlike_article(article_id, user_id):
+    """中間テーブルの 1 行を DELETE し、削除した場合は True を返す"""
+    with transaction.atomic():
+        deleted, _ = Like.objects.filter(
+            **_like_row(article_id, user_id)).delete()
+        if deleted:
+            _likes_changed(article_id, -1)
+    return bool(deleted)
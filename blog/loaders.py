@@ -0,0 +1,87 @@
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from .models import Article, Comment
+
+
+class ModelByIdLoader(DataLoader):
+    """主キーでモデルをまとめて取得するローダー"""
+    model = None
+
+    def batch_load_fn(self, keys):
+        objects = self.model.objects.in_bulk(keys)
+        return Promise.resolve([objects.get(key) for key in keys])
+
+
+class UserByIdLoader(ModelByIdLoader):
+    model = get_user_model()
+
+
+class ArticleByIdLoader(ModelByIdLoader):
+    model = Article
+
+
+class ManyToManyByArticleLoader(DataLoader):
+    """記事の多対多リレーションを中間テーブル経由でまとめて取得するローダー"""
+    field = None
+
+    def batch_load_fn(self, keys):
+        through = self.field.remote_field.through
+        source = self.field.m2m_field_name()
+        target = self.field.m2m_reverse_field_name()
+        rows = through.objects.filter(
+            **{source + '_id__in': keys}
+        ).select_related(target).order_by('id')
+
+        related = defaultdict(list)
+        for row in rows:
+            related[getattr(row, source + '_id')].append(getattr(row, target))
+        return Promise.resolve([related[key] for key in keys])
+
+
+class TagsByArticleLoader(ManyToManyByArticleLoader):
+    field = Article._meta.get_field('tags')
+
+
+class LikersByArticleLoader(ManyToManyByArticleLoader):
+    field = Article._meta.get_field('liked')
+
+
+class CommentsByArticleLoader(DataLoader):
+    def batch_load_fn(self, keys):
+        comments = defaultdict(list)
+        for comment in Comment.objects.filter(
+                article_comment_id__in=keys).order_by('id'):
+            comments[comment.article_comment_id].append(comment)
+        return Promise.resolve([comments[key] for key in keys])
+
+
+class Loaders:
+    """リクエスト単位で共有するローダーの集合"""
+
+    def __init__(self):
+        self.user_by_id = UserByIdLoader()
+        self.article_by_id = ArticleByIdLoader()
+        self.tags_by_article = TagsByArticleLoader()
+        self.likers_by_article = LikersByArticleLoader()
+        self.comments_by_article = CommentsByArticleLoader()
+
+
+def get_loaders(info):
+    """info.context にローダーを保持し、同一リクエスト内で使い回す"""
+    context = info.context
+    loaders = getattr(context, 'loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        if context is not None:
+            context.loaders = loaders
+    return loaders
+
+
+def clear_loaders(context):
+    """書き込み後に古いキャッシュを参照しないようローダーを破棄する"""
+    if getattr(context, 'loaders', None) is not None:
+        context.loaders = None
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from blog.feeds import all_names, is_shared_cache, refresh
+
+
+class Command(BaseCommand):
+    help = 'RSS / Atom フィード (全体・タグ別) とサイトマップを生成してキャッシュします'
+
+    def handle(self, *args, **options):
+        if not is_shared_cache():
+            self.stderr.write(self.style.WARNING(
+                'キャッシュがプロセスごとのため、実行中のサーバーには反映されません '
+                '(CACHE_BACKEND に共有のキャッシュを設定してください)'))
+        names = sorted(all_names())
+        for name in names:
+            refresh(name)
+        self.stdout.write(self.style.SUCCESS(
+            '%d 件のフィード・サイトマップを生成しました' % len(names)))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.export import (
+    DEFAULT_CHUNK_SIZE, EXPORT_TYPES, export_lines, parse_updated_since)
+
+
+class Command(BaseCommand):
+    help = 'タグ・記事・コメントを NDJSON (1 行 1 件の JSON) で書き出します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', '-o', help='出力先のファイル (省略時は標準出力)')
+        parser.add_argument(
+            '--types', default=','.join(EXPORT_TYPES),
+            help='書き出す種類 (カンマ区切り: %s)' % ', '.join(EXPORT_TYPES))
+        parser.add_argument(
+            '--updated-since',
+            help='この日時 (ISO 8601) 以降に更新された記事・コメントのみ書き出す')
+        parser.add_argument(
+            '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+            help='1 回に読み込む件数')
+
+    def handle(self, *args, **options):
+        types = [t for t in options['types'].split(',') if t]
+        unknown = set(types) - set(EXPORT_TYPES)
+        if unknown:
+            raise CommandError('未知の種類: %s' % ', '.join(sorted(unknown)))
+        updated_since = None
+        if options['updated_since']:
+            try:
+                updated_since = parse_updated_since(options['updated_since'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        lines = export_lines(types, updated_since, options['chunk_size'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        count = 0
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line)
+                count += 1
+        self.stderr.write(self.style.SUCCESS(
+            '%d 件を %s に書き出しました' % (count, options['output'])))
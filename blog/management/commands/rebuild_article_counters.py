@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from blog.counts import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = '記事のいいね数・コメント数を再計算します'
+
+    def handle(self, *args, **options):
+        updated = rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(
+            '%d 件の記事を更新しました' % updated))
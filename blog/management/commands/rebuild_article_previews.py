@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Article
+
+
+class Command(BaseCommand):
+    help = '既存の記事の抜粋 (excerpt) と本文の文字数 (content_length) を計算します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='1 回に読み込み・更新する記事の件数')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        last_pk = 0
+        while True:
+            # 主キー順に区切り、本文は 1 バッチ分だけ読み込む
+            articles = list(
+                Article.objects.filter(pk__gt=last_pk).order_by('pk').only(
+                    'pk', 'content', 'excerpt', 'content_length'
+                )[:batch_size])
+            if not articles:
+                break
+            changed = []
+            for article in articles:
+                excerpt, length = article.excerpt, article.content_length
+                article.update_preview()
+                if (article.excerpt, article.content_length) != (
+                        excerpt, length):
+                    changed.append(article)
+            Article.objects.bulk_update(
+                changed, ['excerpt', 'content_length'])
+            updated += len(changed)
+            last_pk = articles[-1].pk
+        self.stdout.write(self.style.SUCCESS(
+            '%d 件の記事を更新しました' % updated))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from blog.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = '記事の全文検索インデックスを再構築します'
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(
+            '%d 件の記事をインデックスしました' % count))
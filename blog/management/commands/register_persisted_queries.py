@@ -0,0 +1,44 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from graphql import parse
+from graphql.error import GraphQLSyntaxError
+
+from graphql_api.backend import document_hash
+from graphql_api.persisted import get_query_store
+
+
+class Command(BaseCommand):
+    help = '.graphql ファイルを永続化クエリとして登録します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='+',
+            help='.graphql ファイルまたはそれを含むディレクトリ')
+        parser.add_argument(
+            '--store', choices=['database', 'file'],
+            help='保存先 (省略時は GRAPHQL_API["PERSISTED_QUERIES_STORE"])')
+
+    def handle(self, *args, **options):
+        store = get_query_store(options['store'])
+        files = []
+        for path in map(Path, options['paths']):
+            if path.is_dir():
+                files += sorted(path.rglob('*.graphql'))
+            elif path.is_file():
+                files.append(path)
+            else:
+                raise CommandError('%s が見つかりません' % path)
+
+        for path in files:
+            query = path.read_text(encoding='utf-8')
+            try:
+                parse(query)
+            except GraphQLSyntaxError as e:
+                raise CommandError('%s: %s' % (path, e))
+            sha256_hash = document_hash(query)
+            store.set(sha256_hash, query)
+            self.stdout.write('%s  %s' % (sha256_hash, path))
+
+        self.stdout.write(self.style.SUCCESS(
+            '%d 件のクエリを登録しました' % len(files)))
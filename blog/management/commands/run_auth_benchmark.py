@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from graphql_jwt.middleware import JSONWebTokenMiddleware
+
+from blog import benchmarks
+from graphql_api import authentication
+from graphql_api.backend import document_backend
+from graphql_api.schema import schema
+
+
+class Command(BaseCommand):
+    help = (
+        'トークン付きのリクエストでフィールド数の多いクエリを実行し、'
+        'JWT 認証ミドルウェアのフィールドあたりのコストを比較します'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=benchmarks.DEFAULT_ITERATIONS)
+        parser.add_argument(
+            '--warmup', type=int, default=benchmarks.DEFAULT_WARMUP)
+        parser.add_argument(
+            '--user', help='実行ユーザー名 (省略時は最初の認証済みスタッフ)')
+        parser.add_argument(
+            '--json', action='store_true', help='結果を JSON で出力する')
+
+    def handle(self, *args, **options):
+        variants = {
+            'none': None,
+            'graphql_jwt': JSONWebTokenMiddleware,
+            'request_scoped': authentication.JSONWebTokenMiddleware,
+        }
+        try:
+            results = benchmarks.run_auth(
+                schema, document_backend, variants,
+                iterations=options['iterations'], warmup=options['warmup'],
+                username=options['user'])
+        except benchmarks.BenchmarkError as e:
+            raise CommandError(str(e))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+            return
+
+        self.stdout.write('%-16s %9s %9s %8s %7s %12s' % (
+            'middleware', 'p50 ms', 'p95 ms', 'queries', 'fields',
+            'us/field'))
+        for name, result in results.items():
+            self.stdout.write('%-16s %9.2f %9.2f %8d %7d %12.2f' % (
+                name, result['p50_ms'], result['p95_ms'], result['queries'],
+                result['fields'], result['us_per_field']))
+        self.stdout.write('token cache: %s' % (
+            authentication.token_cache.cache_info(),))
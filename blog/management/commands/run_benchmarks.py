@@ -0,0 +1,97 @@
+import os
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from blog import benchmarks
+from blog.models import Article, Comment
+from graphql_api.backend import document_backend
+from graphql_api.schema import schema
+
+
+class Command(BaseCommand):
+    help = (
+        '代表的なクエリ・ミューテーションをプロセス内で実行し、'
+        'p50/p95 レイテンシ・SQL 回数・ピークメモリを基準値と比較します'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*', help='実行するベンチマーク名 (省略時はすべて)')
+        parser.add_argument(
+            '--iterations', type=int, default=benchmarks.DEFAULT_ITERATIONS)
+        parser.add_argument(
+            '--warmup', type=int, default=benchmarks.DEFAULT_WARMUP)
+        parser.add_argument(
+            '--user', help='実行ユーザー名 (省略時は最初の認証済みスタッフ)')
+        parser.add_argument(
+            '--baseline', default='benchmarks/baseline.json',
+            help='基準値の JSON ファイル')
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='今回の結果を基準値として保存する')
+        parser.add_argument(
+            '--tolerance', type=float, default=benchmarks.DEFAULT_TOLERANCE,
+            help='p95 の悪化を許容する割合')
+        parser.add_argument(
+            '--fail-on-regression', action='store_true',
+            help='退行があれば終了コード 1 で終了する')
+
+    def handle(self, *args, **options):
+        catalogue = {b.name: b for b in benchmarks.CATALOGUE}
+        unknown = set(options['names']) - set(catalogue)
+        if unknown:
+            raise CommandError('未知のベンチマーク: %s (候補: %s)' % (
+                ', '.join(sorted(unknown)), ', '.join(catalogue)))
+        selected = [catalogue[name] for name in options['names']] or None
+
+        try:
+            results = benchmarks.run(
+                schema, document_backend, selected,
+                iterations=options['iterations'], warmup=options['warmup'],
+                username=options['user'])
+        except benchmarks.BenchmarkError as e:
+            raise CommandError(str(e))
+
+        path = options['baseline']
+        baseline = {}
+        if os.path.exists(path) and not options['save_baseline']:
+            baseline = benchmarks.load_baseline(path)
+
+        rows = benchmarks.compare(results, baseline, options['tolerance'])
+        self.stdout.write('%-22s %9s %9s %8s %10s %9s' % (
+            'benchmark', 'p50 ms', 'p95 ms', 'queries', 'peak KiB',
+            'vs base'))
+        for name, result, base, regressed in rows:
+            delta = ''
+            if base is not None:
+                delta = '%+.0f%%' % (
+                    (result['p95_ms'] / base['p95_ms'] - 1) * 100
+                    if base['p95_ms'] else 0)
+            line = '%-22s %9.2f %9.2f %8d %10.1f %9s' % (
+                name, result['p50_ms'], result['p95_ms'], result['queries'],
+                result['peak_kib'], delta)
+            self.stdout.write(
+                self.style.ERROR(line) if regressed else line)
+
+        if options['save_baseline']:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            benchmarks.save_baseline(path, results, {
+                'iterations': options['iterations'],
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'articles': Article.objects.count(),
+                'comments': Comment.objects.count(),
+            })
+            self.stdout.write(self.style.SUCCESS(
+                '基準値を %s に保存しました' % path))
+
+        regressions = [row[0] for row in rows if row[3]]
+        if regressions:
+            message = '退行: %s' % ', '.join(regressions)
+            if options['fail_on_regression']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
@@ -0,0 +1,82 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+
+from blog import benchmarks
+from graphql_api.backend import document_backend
+from graphql_api.views import AsyncBlogGraphQLView, BlogGraphQLView
+
+
+class Command(BaseCommand):
+    help = (
+        '読み取りクエリの混合負荷を同時に送り、同期 (WSGI) ワーカーと'
+        '非同期 (ASGI) ビューのスループット・レイテンシを 1 プロセスで比較します'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=120, help='リクエスト総数')
+        parser.add_argument(
+            '--concurrency', type=int, default=8, help='同時に送るクライアント数')
+        parser.add_argument(
+            '--sync-workers', type=int, default=1,
+            help='模擬する同期ワーカー数 (gunicorn の sync ワーカー 1 つが既定)')
+        parser.add_argument(
+            '--sql-latency', type=float, default=0,
+            help='ネットワーク越しの DB を模擬して SQL ごとに加える待ち時間 (ミリ秒)')
+        parser.add_argument(
+            '--json', action='store_true', help='結果を JSON で出力する')
+
+    def handle(self, *args, **options):
+        workload = benchmarks.concurrency_workload(options['requests'])
+        concurrency = options['concurrency']
+        sync_view = BlogGraphQLView.as_view(backend=document_backend)
+        async_view = AsyncBlogGraphQLView.as_view(backend=document_backend)
+        if options['sql_latency']:
+            self.add_sql_latency(options['sql_latency'] / 1000)
+
+        try:
+            # ドキュメントキャッシュなどを温めておく
+            benchmarks.run_sync_workers(sync_view, workload[:6], 1)
+            results = {
+                'wsgi': benchmarks.summarize(*benchmarks.run_sync_workers(
+                    sync_view, workload, concurrency,
+                    options['sync_workers'])),
+                'asgi': benchmarks.summarize(*benchmarks.run_async_view(
+                    async_view, workload, concurrency)),
+            }
+        except benchmarks.BenchmarkError as e:
+            raise CommandError(str(e))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+            return
+
+        self.stdout.write('%d requests, %d concurrent clients' % (
+            len(workload), concurrency))
+        self.stdout.write('%-6s %10s %9s %9s %9s' % (
+            'path', 'req/s', 'p50 ms', 'p95 ms', 'elapsed'))
+        for path, result in results.items():
+            self.stdout.write('%-6s %10.1f %9.2f %9.2f %8.2fs' % (
+                path, result['throughput_rps'], result['p50_ms'],
+                result['p95_ms'], result['elapsed_s']))
+        self.stdout.write('\np95 ms by query')
+        for name in sorted(results['wsgi']['p95_ms_by_query']):
+            self.stdout.write('  %-22s wsgi %9.2f  asgi %9.2f' % (
+                name, results['wsgi']['p95_ms_by_query'][name],
+                results['asgi']['p95_ms_by_query'][name]))
+
+    def add_sql_latency(self, seconds):
+        def delay(execute, sql, params, many, context):
+            time.sleep(seconds)
+            return execute(sql, params, many, context)
+
+        # 接続はスレッドごとに作られるため、作成時に待ち時間を差し込む。
+        # execute_wrapper() は末尾に積んで取り除くので先頭に入れる
+        def on_connection_created(sender, connection, **kwargs):
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.insert(0, delay)
+
+        connection_created.connect(on_connection_created, weak=False)
@@ -0,0 +1,204 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from graphql_auth.models import UserStatus
+
+from blog.counts import bump_count_version
+from blog.feeds import invalidate_all
+from blog.models import Article, Comment, Tag
+from blog.search import rebuild_index
+from blog.versions import bump_versions
+
+# 記事数ごとのプリセット (ユーザー数, タグ数, 記事数)
+SIZES = {
+    '1k': (100, 50, 1000),
+    '100k': (5000, 500, 100000),
+    '1m': (50000, 2000, 1000000),
+}
+USERNAME_PREFIX = 'seed'
+TAG_PREFIX = 'seed-tag-'
+PASSWORD = 'password'
+WORDS = (
+    'django graphql relay query schema resolver cache index article comment '
+    'tag user like python database sqlite postgres batch loader cursor page '
+    'filter order search token signal model field view request response'
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        'ベンチマーク用のユーザー・タグ・記事・いいね・コメントを決定的に生成します '
+        '(ユーザーのパスワードはすべて "%s")' % PASSWORD
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', choices=sorted(SIZES), default='1k',
+            help='データ量のプリセット (記事数)')
+        parser.add_argument('--users', type=int, help='ユーザー数')
+        parser.add_argument('--tags', type=int, help='タグ数')
+        parser.add_argument('--articles', type=int, help='記事数')
+        parser.add_argument(
+            '--likes', type=int, default=5, help='記事あたりの平均いいね数')
+        parser.add_argument(
+            '--comments', type=int, default=3, help='記事あたりの平均コメント数')
+        parser.add_argument('--seed', type=int, default=0, help='乱数シード')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000, help='一括 INSERT の件数')
+        parser.add_argument(
+            '--flush', action='store_true',
+            help='以前に生成したデータを削除してから生成する')
+        parser.add_argument(
+            '--skip-search-index', action='store_true',
+            help='全文検索インデックスを再構築しない')
+
+    def handle(self, *args, **options):
+        users, tags, articles = SIZES[options['size']]
+        self.user_count = options['users'] or users
+        self.tag_count = options['tags'] or tags
+        self.article_count = options['articles'] or articles
+        self.batch_size = options['batch_size']
+        self.rng = random.Random(options['seed'])
+        User = get_user_model()
+
+        if options['flush']:
+            self.flush()
+        elif User.objects.filter(
+                username__startswith=USERNAME_PREFIX).exists():
+            raise CommandError(
+                '生成済みのデータがあります。--flush で削除してから実行してください')
+
+        with transaction.atomic():
+            user_ids = self.create_users()
+            tag_ids = self.create_tags()
+            self.create_articles(
+                user_ids, tag_ids, options['likes'], options['comments'])
+            self.reset_sequences()
+
+        # bulk_create はシグナルを送らないため、キャッシュの世代をまとめて進める
+        bump_versions(
+            User._meta.label, Tag._meta.label, Article._meta.label,
+            Comment._meta.label)
+        bump_count_version()
+        invalidate_all()
+        if not options['skip_search_index']:
+            rebuild_index()
+
+        self.stdout.write(self.style.SUCCESS(
+            'ユーザー %d 人、タグ %d 件、記事 %d 件を生成しました' % (
+                self.user_count, self.tag_count, self.article_count)))
+
+    def flush(self):
+        User = get_user_model()
+        Tag.objects.filter(name__startswith=TAG_PREFIX).delete()
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def next_id(self, model):
+        last = model.objects.order_by('-pk').values_list(
+            'pk', flat=True).first()
+        return (last or 0) + 1
+
+    def reset_sequences(self):
+        """主キーを指定して INSERT したため、シーケンス (Postgres) を最大値に合わせる
+
+        合わせないと、次の通常の INSERT が生成済みの主キーと衝突する。
+        """
+        models = [
+            get_user_model(), UserStatus, Tag, Article, Comment,
+            Article.tags.through, Article.liked.through,
+        ]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+    def bulk_create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_users(self):
+        User = get_user_model()
+        start = self.next_id(User)
+        password = make_password(PASSWORD)
+        ids = list(range(start, start + self.user_count))
+        for offset in range(0, len(ids), self.batch_size):
+            chunk = ids[offset:offset + self.batch_size]
+            self.bulk_create(User, [
+                User(
+                    pk=pk,
+                    username='%s%d' % (USERNAME_PREFIX, pk - start),
+                    email='%s%d@example.com' % (USERNAME_PREFIX, pk - start),
+                    password=password,
+                    # 先頭のユーザーはタグ・記事の一括操作を行えるスタッフ
+                    is_staff=pk == start,
+                ) for pk in chunk
+            ])
+            self.bulk_create(UserStatus, [
+                UserStatus(user_id=pk, verified=True) for pk in chunk
+            ])
+        return ids
+
+    def create_tags(self):
+        start = self.next_id(Tag)
+        ids = list(range(start, start + self.tag_count))
+        self.bulk_create(Tag, [
+            Tag(pk=pk, name='%s%d' % (TAG_PREFIX, pk - start)) for pk in ids
+        ])
+        return ids
+
+    def text(self, low, high):
+        return ' '.join(
+            self.rng.choice(WORDS) for _ in range(self.rng.randint(low, high)))
+
+    def create_articles(self, user_ids, tag_ids, likes, comments):
+        rng = self.rng
+        article_id = self.next_id(Article)
+        comment_id = self.next_id(Comment)
+        TagThrough = Article.tags.through
+        LikeThrough = Article.liked.through
+
+        remaining = self.article_count
+        while remaining > 0:
+            size = min(self.batch_size, remaining)
+            remaining -= size
+            articles, tag_rows, like_rows, comment_rows = [], [], [], []
+            for pk in range(article_id, article_id + size):
+                likers = rng.sample(
+                    user_ids, min(len(user_ids), rng.randint(0, likes * 2)))
+                comment_total = rng.randint(0, comments * 2)
+                article = Article(
+                    pk=pk,
+                    user_article_id=rng.choice(user_ids),
+                    title=self.text(2, 8)[:100],
+                    content=self.text(30, 300),
+                    is_release=rng.random() < 0.8,
+                    like_count=len(likers),
+                    comment_count=comment_total,
+                )
+                article.update_preview()
+                articles.append(article)
+                tag_rows.extend(
+                    TagThrough(article_id=pk, tag_id=tag_id)
+                    for tag_id in rng.sample(
+                        tag_ids, min(len(tag_ids), rng.randint(0, 4))))
+                like_rows.extend(
+                    LikeThrough(article_id=pk, customuser_id=user_id)
+                    for user_id in likers)
+                for _ in range(comment_total):
+                    comment_rows.append(Comment(
+                        pk=comment_id,
+                        text=self.text(3, 40),
+                        user_comment_id=rng.choice(user_ids),
+                        article_comment_id=pk,
+                    ))
+                    comment_id += 1
+            article_id += size
+
+            self.bulk_create(Article, articles)
+            self.bulk_create(TagThrough, tag_rows)
+            self.bulk_create(LikeThrough, like_rows)
+            self.bulk_create(Comment, comment_rows)
+            self.stdout.write('記事 %d / %d 件' % (
+                self.article_count - remaining, self.article_count))
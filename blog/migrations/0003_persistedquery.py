@@ -0,0 +1,22 @@
+# Generated by Django 3.2.5 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0002_auto_20210802_2215'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersistedQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256_hash', models.CharField(max_length=64, unique=True)),
+                ('query', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.5 on 2026-10-18 07:47
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by().values(field)
+        .annotate(count=Count('*')).values('count'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Article = apps.get_model('blog', 'Article')
+    Comment = apps.get_model('blog', 'Comment')
+    Article.objects.update(
+        like_count=count_of(Article.liked.through.objects.all(), 'article'),
+        comment_count=count_of(Comment.objects.all(), 'article_comment'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_persistedquery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='コメント数'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='いいね数'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
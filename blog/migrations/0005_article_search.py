@@ -0,0 +1,57 @@
+import sqlite3
+
+from django.conf import settings
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE blog_article_search ("
+            "article_id bigint PRIMARY KEY "
+            "REFERENCES blog_article (id) ON DELETE CASCADE "
+            "DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX blog_article_search_document_gin "
+            "ON blog_article_search USING gin (document)"
+        )
+        # 検索時と同じテキスト検索設定で作成する (blog.search を参照)
+        config = settings.GRAPHQL_API['SEARCH_CONFIG']
+        schema_editor.execute(
+            "INSERT INTO blog_article_search (article_id, document) "
+            "SELECT id, "
+            "setweight(to_tsvector(%s, title), 'A') || "
+            "setweight(to_tsvector(%s, coalesce(content, '')), 'B') "
+            "FROM blog_article", [config, config]
+        )
+    elif vendor == 'sqlite':
+        # trigram トークナイザは SQLite 3.34 以降 (日本語の部分一致に対応)
+        tokenizer = 'trigram' if sqlite3.sqlite_version_info >= (
+            3, 34) else 'unicode61'
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE blog_article_search "
+            "USING fts5(title, content, tokenize='%s')" % tokenizer
+        )
+        schema_editor.execute(
+            "INSERT INTO blog_article_search (rowid, title, content) "
+            "SELECT id, title, coalesce(content, '') FROM blog_article"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute("DROP TABLE IF EXISTS blog_article_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_article_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_article_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='content_length',
+            field=models.PositiveIntegerField(default=0, verbose_name='本文の文字数'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='excerpt',
+            field=models.CharField(blank=True, default='', max_length=200, verbose_name='抜粋'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:14
+
+from django.db import migrations, models
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    """名前を正規化し、大文字・小文字だけが異なるタグを最も古いものにまとめる"""
+    Tag = apps.get_model('blog', 'Tag')
+    TagThrough = apps.get_model('blog', 'Article').tags.through
+    keep = {}
+    for tag in Tag.objects.order_by('pk'):
+        name = ' '.join(tag.name.split())
+        if name != tag.name:
+            tag.name = name
+            tag.save(update_fields=['name'])
+        survivor = keep.setdefault(name.lower(), tag.pk)
+        if survivor == tag.pk:
+            continue
+        tagged = set(TagThrough.objects.filter(
+            tag_id=survivor).values_list('article_id', flat=True))
+        moved = TagThrough.objects.filter(tag_id=tag.pk)
+        moved.filter(article_id__in=tagged).delete()
+        moved.update(tag_id=survivor)
+        tag.delete()
+
+
+def create_unique_name_index(apps, schema_editor):
+    # Django 3.2 の UniqueConstraint は式を指定できないため SQL で作成する
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute(
+            "CREATE UNIQUE INDEX blog_tag_name_lower_uniq "
+            "ON blog_tag (LOWER(name))"
+        )
+
+
+def drop_unique_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute("DROP INDEX IF EXISTS blog_tag_name_lower_uniq")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_article_preview'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(condition=models.Q(('is_release', True)), fields=['-created_at', '-id'], name='blog_article_release_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['-created_at', '-id'], name='blog_article_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['-updated_at', '-id'], name='blog_article_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['-like_count', '-id'], name='blog_article_likes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['article_comment', 'created_at', 'id'], name='blog_comment_article_idx'),
+        ),
+        # SQLite の AlterField はテーブルを作り直すため、その後に作成する
+        migrations.RunPython(create_unique_name_index, drop_unique_name_index),
+    ]
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def rebuild_search_documents(apps, schema_editor):
+    """0005 を 'simple' 固定で適用したデータベースの文書を設定で作り直す
+
+    以降に SEARCH_CONFIG を変更した場合は rebuild_search_index を実行する。
+    """
+    config = settings.GRAPHQL_API['SEARCH_CONFIG']
+    if schema_editor.connection.vendor != 'postgresql' or config == 'simple':
+        return
+    schema_editor.execute(
+        "UPDATE blog_article_search AS s SET document = "
+        "setweight(to_tsvector(%s, a.title), 'A') || "
+        "setweight(to_tsvector(%s, coalesce(a.content, '')), 'B') "
+        "FROM blog_article AS a WHERE a.id = s.article_id", [config, config]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            rebuild_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def ensure_unique_name_index(apps, schema_editor):
+    """blog_tag_name_lower_uniq がなければ作成する (何度適用してもよい)
+
+    SQLite でテーブルを作り直すと 0007 で作成したインデックスが消えるため、
+    欠けているデータベースでも作成し直す。
+    """
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS blog_tag_name_lower_uniq "
+            "ON blog_tag (LOWER(name))"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_search_config'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            ensure_unique_name_index, migrations.RunPython.noop),
+    ]
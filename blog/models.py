@@ -1,14 +1,39 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth import get_user_model
 
+# 一覧用に保存する本文の抜粋の文字数
+EXCERPT_LENGTH = 200
+
+
+def make_excerpt(content, length=EXCERPT_LENGTH):
+    """空白を詰めた本文の先頭 length 文字 (超える場合は末尾を … にする)"""
+    text = ' '.join((content or '').split())
+    if len(text) > length:
+        text = text[:length - 1] + '…'
+    return text
+
+
+def normalize_tag_name(name):
+    """前後の空白を除き、連続する空白を 1 つにする"""
+    return ' '.join((name or '').split())
+
 
 class Tag(models.Model):
     """タグモデル"""
-    name = models.CharField(max_length=100)
+    # 大文字・小文字だけが異なるタグを作らないよう、マイグレーション 0007 で
+    # LOWER(name) の一意インデックス (blog_tag_name_lower_uniq) を作成する。
+    # SQLite でテーブルを作り直すマイグレーションの後は 0009 と同じく
+    # CREATE UNIQUE INDEX IF NOT EXISTS で作成し直すこと
+    name = models.CharField(max_length=100, db_index=True)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.name = normalize_tag_name(self.name)
+        super(Tag, self).save(*args, **kwargs)
+
 
 class Article(models.Model):
     """記事モデル"""
@@ -24,10 +49,49 @@ class Article(models.Model):
     updated_at = models.DateTimeField(verbose_name="更新日時", auto_now=True)
     liked = models.ManyToManyField(
         get_user_model(), related_name='like_users', blank=True)
+    like_count = models.PositiveIntegerField(
+        verbose_name="いいね数", default=0)
+    comment_count = models.PositiveIntegerField(
+        verbose_name="コメント数", default=0)
+    excerpt = models.CharField(
+        verbose_name="抜粋", max_length=EXCERPT_LENGTH, blank=True, default='')
+    content_length = models.PositiveIntegerField(
+        verbose_name="本文の文字数", default=0)
+
+    class Meta:
+        indexes = [
+            # 公開記事の新着順 (ArticleFilter の isRelease + orderByCreatedAt)
+            models.Index(
+                fields=['-created_at', '-id'], condition=Q(is_release=True),
+                name='blog_article_release_new_idx'),
+            # 作成日時・更新日時順とキーセットのカーソル (日時, id)
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='blog_article_created_idx'),
+            models.Index(
+                fields=['-updated_at', '-id'],
+                name='blog_article_updated_idx'),
+            models.Index(
+                fields=['-like_count', '-id'], name='blog_article_likes_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def update_preview(self):
+        """本文から抜粋と文字数を計算する"""
+        self.excerpt = make_excerpt(self.content)
+        self.content_length = len(self.content or '')
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            self.update_preview()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {
+                    'excerpt', 'content_length'}
+        super(Article, self).save(*args, **kwargs)
+
 
 class Comment(models.Model):
     """コメントモデル"""
@@ -42,5 +106,23 @@ class Comment(models.Model):
         verbose_name="作成日時", auto_now_add=True)
     updated_at = models.DateTimeField(verbose_name="更新日時", auto_now=True)
 
+    class Meta:
+        indexes = [
+            # 記事のコメントの作成日時順 (CommentFilter)
+            models.Index(
+                fields=['article_comment', 'created_at', 'id'],
+                name='blog_comment_article_idx'),
+        ]
+
     def __str__(self):
         return self.text
+
+
+class PersistedQuery(models.Model):
+    """永続化クエリモデル"""
+    sha256_hash = models.CharField(max_length=64, unique=True)
+    query = models.TextField()
+    created_at = models.DateTimeField(verbose_name="作成日時", auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256_hash
@@ -0,0 +1,120 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from graphene import Dynamic
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import ast
+
+from .fields import BatchedFilterConnectionField
+
+PAGINATION_ARGS = ('first', 'last', 'before', 'after', 'offset')
+
+
+def _selections(selection_set, info):
+    """フラグメントを展開した (フィールド名, AST) を返す"""
+    if selection_set is None:
+        return
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.Field):
+            yield selection.name.value, selection
+        elif isinstance(selection, ast.InlineFragment):
+            yield from _selections(selection.selection_set, info)
+        elif isinstance(selection, ast.FragmentSpread):
+            fragment = info.fragments[selection.name.value]
+            yield from _selections(fragment.selection_set, info)
+
+
+def _child(field_asts, name, info):
+    return [
+        child for field_ast in field_asts
+        for child_name, child in _selections(field_ast.selection_set, info)
+        if child_name == name
+    ]
+
+
+def _connection_nodes(field_asts, info):
+    return _child(_child(field_asts, 'edges', info), 'node', info)
+
+
+def _has_filter_args(field_ast):
+    return any(
+        argument.name.value not in PAGINATION_ARGS
+        for argument in field_ast.arguments or []
+    )
+
+
+def _unwrap(_type):
+    while hasattr(_type, 'of_type'):
+        _type = _type.of_type
+    return _type
+
+
+def _plan(node_type, field_asts, info, prefix=''):
+    """選択セットから only / select_related / prefetch_related の対象を集める"""
+    model = node_type._meta.model
+    only = {prefix + model._meta.pk.name}
+    select_related = []
+    prefetch = []
+
+    for field_ast in field_asts:
+        for name, child in _selections(field_ast.selection_set, info):
+            attname = to_snake_case(name)
+            graphene_field = node_type._meta.fields.get(attname)
+            if isinstance(graphene_field, Dynamic):
+                graphene_field = graphene_field.get_type()
+            try:
+                model_field = model._meta.get_field(attname)
+            except FieldDoesNotExist:
+                continue
+            if graphene_field is None:
+                continue
+
+            if isinstance(graphene_field, BatchedFilterConnectionField):
+                if _has_filter_args(child):
+                    continue
+                child_type = graphene_field.node_type
+                queryset = child_type._meta.model._default_manager.order_by(
+                    'id')
+                required = []
+                if model_field.one_to_many:
+                    required.append(model_field.field.name)
+                prefetch.append(Prefetch(
+                    prefix + attname,
+                    queryset=optimize_nodes(
+                        queryset, child_type, _connection_nodes([child], info),
+                        info, required=required
+                    ),
+                ))
+            elif model_field.many_to_one:
+                only.add(prefix + model_field.name)
+                related = _unwrap(graphene_field.type)
+                if not hasattr(related, '_meta') or not hasattr(
+                        related._meta, 'model'):
+                    continue
+                select_related.append(prefix + model_field.name)
+                related_plan = _plan(
+                    related, [child], info, prefix + model_field.name + '__')
+                only |= related_plan[0]
+                select_related += related_plan[1]
+                prefetch += related_plan[2]
+            elif model_field.concrete and not model_field.many_to_many:
+                only.add(prefix + model_field.name)
+
+    return only, select_related, prefetch
+
+
+def optimize_nodes(queryset, node_type, field_asts, info, required=()):
+    only, select_related, prefetch = _plan(node_type, field_asts, info)
+    only.update(required)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset.only(*only)
+
+
+def optimize_queryset(queryset, info, required=()):
+    """コネクションの選択セットに合わせてクエリセットを最適化する"""
+    node_type = _unwrap(info.return_type).graphene_type._meta.node
+    return optimize_nodes(
+        queryset, node_type, _connection_nodes(info.field_asts, info), info,
+        required=required)
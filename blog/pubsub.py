@@ -0,0 +1,119 @@
+from collections import namedtuple
+from itertools import count
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+from rx import Observable
+from rx.concurrency import ThreadPoolScheduler
+
+COMMENT_CREATED = 'CREATED'
+COMMENT_UPDATED = 'UPDATED'
+COMMENT_DELETED = 'DELETED'
+
+# 購読者に届けるコメントの変更 (削除時の comment は None)
+CommentMessage = namedtuple(
+    'CommentMessage', ['action', 'article_id', 'comment_id', 'comment'])
+
+
+class InMemoryPubSub:
+    """単一ノード・ローカル用のプロセス内 pub/sub
+
+    購読者はチャンネルごとに保持するため、発行のコストはそのチャンネルの
+    購読者数にのみ比例する。
+    """
+
+    def __init__(self):
+        self._channels = {}
+        self._tokens = count(1)
+        self._lock = Lock()
+
+    def subscribe(self, channel, callback):
+        token = next(self._tokens)
+        with self._lock:
+            self._channels.setdefault(channel, {})[token] = callback
+        return channel, token
+
+    def unsubscribe(self, subscription):
+        channel, token = subscription
+        with self._lock:
+            callbacks = self._channels.get(channel)
+            if callbacks is not None:
+                callbacks.pop(token, None)
+                if not callbacks:
+                    del self._channels[channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            callbacks = list(self._channels.get(channel, {}).values())
+        for callback in callbacks:
+            callback(message)
+
+
+_pubsub = None
+_scheduler = None
+
+
+def get_pubsub():
+    """設定 PUBSUB_BACKEND のバックエンドを返す"""
+    global _pubsub
+    if _pubsub is None:
+        _pubsub = import_string(settings.GRAPHQL_API['PUBSUB_BACKEND'])()
+    return _pubsub
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ThreadPoolScheduler(
+            settings.GRAPHQL_API['SUBSCRIPTION_WORKERS'])
+    return _scheduler
+
+
+def deliver(observer, message):
+    """ワーカースレッドで購読者にメッセージを渡す
+
+    購読ごとのクエリはリクエストの外で ORM を使うため、
+    graphql_api.concurrency.call_with_connections と同様に前後で古い接続を
+    閉じる。
+    """
+    close_old_connections()
+    try:
+        observer.on_next(message)
+    finally:
+        close_old_connections()
+
+
+def observe(channel):
+    """チャンネルのメッセージを流す Observable
+
+    発行側のスレッドではスケジューラに積むだけにし、購読ごとの
+    クエリの実行はワーカースレッドで行う。
+    """
+    def subscribe(observer):
+        subscription = get_pubsub().subscribe(channel, observer.on_next)
+        return lambda: get_pubsub().unsubscribe(subscription)
+
+    messages = Observable.create(subscribe).observe_on(get_scheduler())
+    return Observable.create(lambda observer: messages.subscribe(
+        on_next=lambda message: deliver(observer, message),
+        on_error=observer.on_error,
+        on_completed=observer.on_completed,
+    ))
+
+
+def comment_channel(article_id):
+    return 'blog:comments:%s' % article_id
+
+
+def publish_comment(action, comment, comment_id=None):
+    """トランザクションのコミット後に記事のチャンネルへ変更を発行する"""
+    message = CommentMessage(
+        action=action,
+        article_id=comment.article_comment_id,
+        comment_id=comment_id or comment.pk,
+        comment=None if action == COMMENT_DELETED else comment,
+    )
+    transaction.on_commit(lambda: get_pubsub().publish(
+        comment_channel(message.article_id), message))
@@ -3,14 +3,37 @@ from django.contrib.auth import get_user_model
 from django_filters import FilterSet, OrderingFilter
 from graphene import relay,  Int
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from graphql import GraphQLError
 from graphql_jwt import exceptions
 from graphql_jwt.decorators import staff_member_required
-from graphql_relay import from_global_id
+from graphql_relay import from_global_id, to_global_id
 from users.models import CustomUser
 
+from . import likes, pubsub, search
+from .bulk import (
+    BulkErrors,
+    articles_written,
+    bulk_create_with_pks,
+    resolve_global_ids,
+    set_article_relations,
+    tags_by_name,
+    tags_written,
+    touch,
+)
+from .counts import batch_counter_updates, save_without_counters, total_count
 from .decorators import verification_required
-from .models import Article, Comment, Tag
+from .feeds import tag_ids_for
+from .fields import (
+    BatchedFilterConnectionField,
+    CountOnDemandConnectionField,
+    KeysetConnectionField,
+    SearchConnectionField,
+)
+from .loaders import clear_loaders, get_loaders
+from .models import Article, Comment, Tag, normalize_tag_name
+from .optimizer import optimize_queryset
 
 
 class TotalCountConnection(relay.Connection):
@@ -20,9 +43,20 @@ class TotalCountConnection(relay.Connection):
     total_count = Int()
 
     def resolve_total_count(root, info, **kwargs):
+        if not hasattr(root, 'length'):
+            root.length = total_count(root.iterable)
         return root.length
 
 
+class BulkItemError(graphene.ObjectType):
+    index = graphene.Int(required=True)
+    id = graphene.ID()
+    message = graphene.String(required=True)
+
+
+USER_NODE_NAMES = ('MyUserNode', 'UserNode')
+
+
 """User"""
 
 
@@ -49,6 +83,15 @@ class TagNode(DjangoObjectType):
         connection_class = TotalCountConnection
 
 
+def save_tag(tag):
+    """名前が重複する場合は IntegrityError ではなく GraphQLError にする"""
+    try:
+        with transaction.atomic():
+            tag.save()
+    except IntegrityError:
+        raise GraphQLError('Tag "%s" already exists.' % tag.name)
+
+
 class CreateTagMutation(relay.ClientIDMutation):
     class Input:
         name = graphene.String(required=True)
@@ -61,7 +104,7 @@ class CreateTagMutation(relay.ClientIDMutation):
         tag = Tag(
             name=input.get('name'),
         )
-        tag.save()
+        save_tag(tag)
         return CreateTagMutation(tag=tag)
 
 
@@ -80,7 +123,7 @@ class UpdateTagMutation(relay.ClientIDMutation):
 
         )
         tag.name = input.get('name')
-        tag.save()
+        save_tag(tag)
         return UpdateTagMutation(tag=tag)
 
 
@@ -101,6 +144,82 @@ class DeleteTagMutation(relay.ClientIDMutation):
         return DeleteTagMutation(tag=None)
 
 
+def validate_tag_names(names, errors):
+    """名前を正規化して返し、空・長すぎる名前をエラーにする"""
+    max_length = Tag._meta.get_field('name').max_length
+    names = [normalize_tag_name(name) for name in names]
+    for index, name in enumerate(names):
+        if not name:
+            errors.add(index, 'Tag name must not be empty.')
+        elif len(name) > max_length:
+            errors.add(index, 'Tag name must be at most %d characters.' %
+                       max_length)
+    return names
+
+
+class BulkCreateTagsMutation(relay.ClientIDMutation):
+    class Input:
+        names = graphene.List(graphene.NonNull(graphene.String), required=True)
+
+    tags = graphene.List(TagNode)
+    errors = graphene.List(BulkItemError)
+
+    @verification_required
+    @staff_member_required
+    def mutate_and_get_payload(root, info, **input):
+        errors = BulkErrors()
+        names = validate_tag_names(input.get('names'), errors)
+
+        with transaction.atomic():
+            existing = tags_by_name(names)
+            seen = set()
+            for index, name in enumerate(names):
+                if index in errors:
+                    continue
+                if name.lower() in existing or name.lower() in seen:
+                    errors.add(index, 'Tag "%s" already exists.' % name)
+                seen.add(name.lower())
+            tags = bulk_create_with_pks(Tag, [
+                Tag(name=name) for index, name in enumerate(names)
+                if index not in errors
+            ])
+            tags_written()
+        return BulkCreateTagsMutation(tags=tags, errors=errors.items)
+
+
+class BulkUpsertTagsMutation(relay.ClientIDMutation):
+    class Input:
+        names = graphene.List(graphene.NonNull(graphene.String), required=True)
+
+    tags = graphene.List(TagNode)
+    errors = graphene.List(BulkItemError)
+
+    @verification_required
+    @staff_member_required
+    def mutate_and_get_payload(root, info, **input):
+        errors = BulkErrors()
+        names = validate_tag_names(input.get('names'), errors)
+        valid_names = [
+            name for index, name in enumerate(names) if index not in errors
+        ]
+
+        with transaction.atomic():
+            existing = tags_by_name(valid_names)
+            missing = {}
+            for name in valid_names:
+                if name.lower() not in existing:
+                    missing.setdefault(name.lower(), name)
+            for tag in bulk_create_with_pks(
+                    Tag, [Tag(name=name) for name in missing.values()]):
+                existing[tag.name.lower()] = tag
+            if missing:
+                tags_written()
+        return BulkUpsertTagsMutation(
+            tags=[existing[name.lower()] for name in valid_names],
+            errors=errors.items,
+        )
+
+
 """Article"""
 
 
@@ -112,7 +231,9 @@ class ArticleFilter(FilterSet):
             "title": ['icontains'],
             "tags": ["exact"],
             "is_release": ["exact"],
-            "liked": ["exact"]
+            "liked": ["exact"],
+            "like_count": ["exact", "gte", "lte"],
+            "comment_count": ["exact", "gte", "lte"],
         }
     order_by_created_at = OrderingFilter(
         fields=(
@@ -124,6 +245,16 @@ class ArticleFilter(FilterSet):
             ('updated_at'),
         )
     )
+    order_by_like_count = OrderingFilter(
+        fields=(
+            ('like_count'),
+        )
+    )
+    order_by_comment_count = OrderingFilter(
+        fields=(
+            ('comment_count'),
+        )
+    )
 
 
 class ArticleNode(DjangoObjectType):
@@ -133,6 +264,37 @@ class ArticleNode(DjangoObjectType):
         interfaces = (relay.Node,)
         connection_class = TotalCountConnection
 
+    tags = BatchedFilterConnectionField(
+        TagNode, loader='tags_by_article', required=True)
+    liked = BatchedFilterConnectionField(
+        MyUserNode, loader='likers_by_article', required=True)
+    article_comment = BatchedFilterConnectionField(
+        lambda: CommentNode, loader='comments_by_article', required=True)
+
+    def resolve_user_article(root, info, **kwargs):
+        if Article.user_article.is_cached(root):
+            return root.user_article
+        return get_loaders(info).user_by_id.load(root.user_article_id)
+
+
+class ArticleSearchConnection(TotalCountConnection):
+    class Meta:
+        node = ArticleNode
+
+    class Edge:
+        rank = graphene.Float()
+        title_highlight = graphene.String()
+        content_highlight = graphene.String()
+
+        def resolve_rank(root, info, **kwargs):
+            return getattr(root.node, 'search_rank', None)
+
+        def resolve_title_highlight(root, info, **kwargs):
+            return getattr(root.node, 'title_highlight', None)
+
+        def resolve_content_highlight(root, info, **kwargs):
+            return getattr(root.node, 'content_highlight', None)
+
 
 class CreateArticleMutation(relay.ClientIDMutation):
     class Input:
@@ -146,6 +308,7 @@ class CreateArticleMutation(relay.ClientIDMutation):
 
     @verification_required
     @staff_member_required
+    @transaction.atomic
     def mutate_and_get_payload(root, info, **input):
         article = Article(
             user_article_id=info.context.user.id,
@@ -167,9 +330,9 @@ class CreateArticleMutation(relay.ClientIDMutation):
                 like_id = from_global_id(like)[1]
                 like_obj = get_user_model().objects.get(id=like_id)
                 like_set.append(like_obj)
-            article.tags.set(like_set)
+            article.liked.set(like_set)
 
-        article.save()
+        save_without_counters(article)
         return CreateArticleMutation(article=article)
 
 
@@ -186,6 +349,7 @@ class UpdateArticleMutation(relay.ClientIDMutation):
 
     @verification_required
     @staff_member_required
+    @transaction.atomic
     def mutate_and_get_payload(root, info, **input):
         article = Article.objects.get(id=from_global_id(input.get('id'))[1])
 
@@ -213,7 +377,7 @@ class UpdateArticleMutation(relay.ClientIDMutation):
                 like_set.append(like_obj)
             article.liked.set(like_set)
 
-        article.save()
+        save_without_counters(article)
         return UpdateArticleMutation(article=article)
 
 
@@ -235,6 +399,141 @@ class DeleteArticleMutation(relay.ClientIDMutation):
         return DeleteArticleMutation(article=None)
 
 
+class BulkArticleInput(graphene.InputObjectType):
+    id = graphene.ID(required=True)
+    title = graphene.String()
+    tags = graphene.List(graphene.ID)
+    content = graphene.String()
+    is_release = graphene.Boolean()
+    liked = graphene.List(graphene.ID)
+
+
+class BulkUpdateArticlesMutation(relay.ClientIDMutation):
+    class Input:
+        articles = graphene.List(
+            graphene.NonNull(BulkArticleInput), required=True)
+
+    articles = graphene.List(ArticleNode)
+    errors = graphene.List(BulkItemError)
+
+    @verification_required
+    @staff_member_required
+    def mutate_and_get_payload(root, info, **input):
+        items = input.get('articles')
+        errors = BulkErrors()
+        articles = resolve_global_ids(
+            [item.id for item in items], ('ArticleNode',), Article)
+        tags = resolve_global_ids(
+            [tag for item in items for tag in item.tags or []],
+            ('TagNode',), Tag)
+        users = resolve_global_ids(
+            [like for item in items for like in item.liked or []],
+            USER_NODE_NAMES, get_user_model())
+        max_length = Article._meta.get_field('title').max_length
+
+        updated = {}
+        fields = {'updated_at'}
+        tag_relations = {}
+        like_relations = {}
+        for index, item in enumerate(items):
+            article = articles.get(item.id)
+            if article is None:
+                errors.add(index, 'Article not found.', item.id)
+                continue
+            if info.context.user.pk != article.user_article_id:
+                errors.add(index, 'Permission denied.', item.id)
+                continue
+            unknown = [
+                id for id in (item.tags or []) if id not in tags
+            ] + [id for id in (item.liked or []) if id not in users]
+            if unknown:
+                errors.add(index, 'Unknown IDs: %s' % ', '.join(unknown),
+                           item.id)
+                continue
+            if item.title is not None and len(item.title) > max_length:
+                errors.add(index, 'Title must be at most %d characters.' %
+                           max_length, item.id)
+                continue
+
+            for field in ('title', 'content', 'is_release'):
+                if item.get(field) is not None:
+                    setattr(article, field, item.get(field))
+                    fields.add(field)
+            if item.content is not None:
+                article.update_preview()
+                fields.update(('excerpt', 'content_length'))
+            if item.tags is not None:
+                tag_relations[article.pk] = [tags[id].pk for id in item.tags]
+            if item.liked is not None:
+                like_relations[article.pk] = [
+                    users[id].pk for id in item.liked]
+            updated[article.pk] = article
+
+        # 付け替えで外れるタグのフィードも生成し直す
+        previous_tags = tag_ids_for(tag_relations) if tag_relations else ()
+        with transaction.atomic():
+            touch(updated.values())
+            Article.objects.bulk_update(
+                list(updated.values()), sorted(fields), batch_size=500)
+            set_article_relations(Article.tags.field, tag_relations)
+            set_article_relations(Article.liked.field, like_relations)
+            articles_written(
+                list(updated), likes_changed=bool(like_relations),
+                tag_ids=previous_tags)
+        # いいね数はカウンタの再計算後の値を返す
+        saved = Article.objects.in_bulk(list(updated))
+        return BulkUpdateArticlesMutation(
+            articles=[saved[pk] for pk in updated], errors=errors.items)
+
+
+def get_likable_article(info, article_id):
+    """公開済み (または自分の) 記事を返す"""
+    try:
+        type_name, pk = from_global_id(article_id)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        type_name = pk = None
+    user = info.context.user
+    article = None
+    if type_name == 'ArticleNode':
+        article = Article.objects.filter(
+            Q(is_release=True) | Q(user_article_id=user.pk), pk=pk).first()
+    if article is None:
+        raise GraphQLError('Article not found.')
+    return article
+
+
+class LikeArticleMutation(relay.ClientIDMutation):
+    class Input:
+        id = graphene.ID(required=True)
+
+    article = graphene.Field(ArticleNode)
+    like_count = graphene.Int()
+
+    @verification_required
+    def mutate_and_get_payload(root, info, **input):
+        article = get_likable_article(info, input.get('id'))
+        if likes.like_article(article.pk, info.context.user.pk):
+            article.refresh_from_db(fields=['like_count'])
+        return LikeArticleMutation(
+            article=article, like_count=article.like_count)
+
+
+class UnlikeArticleMutation(relay.ClientIDMutation):
+    class Input:
+        id = graphene.ID(required=True)
+
+    article = graphene.Field(ArticleNode)
+    like_count = graphene.Int()
+
+    @verification_required
+    def mutate_and_get_payload(root, info, **input):
+        article = get_likable_article(info, input.get('id'))
+        if likes.unlike_article(article.pk, info.context.user.pk):
+            article.refresh_from_db(fields=['like_count'])
+        return UnlikeArticleMutation(
+            article=article, like_count=article.like_count)
+
+
 """Comment"""
 
 
@@ -261,6 +560,16 @@ class CommentNode(DjangoObjectType):
         interfaces = (relay.Node,)
         connection_class = TotalCountConnection
 
+    def resolve_user_comment(root, info, **kwargs):
+        if Comment.user_comment.is_cached(root):
+            return root.user_comment
+        return get_loaders(info).user_by_id.load(root.user_comment_id)
+
+    def resolve_article_comment(root, info, **kwargs):
+        if Comment.article_comment.is_cached(root):
+            return root.article_comment
+        return get_loaders(info).article_by_id.load(root.article_comment_id)
+
 
 class CreateCommentMutation(relay.ClientIDMutation):
     class Input:
@@ -277,6 +586,7 @@ class CreateCommentMutation(relay.ClientIDMutation):
             article_comment_id=from_global_id(input.get('article_comment'))[1],
         )
         comment.save()
+        pubsub.publish_comment(pubsub.COMMENT_CREATED, comment)
         return CreateCommentMutation(comment=comment)
 
 
@@ -298,6 +608,7 @@ class UpdateCommentMutation(relay.ClientIDMutation):
             comment.text = input.get("text")
 
         comment.save()
+        pubsub.publish_comment(pubsub.COMMENT_UPDATED, comment)
         return UpdateCommentMutation(comment=comment)
 
 
@@ -314,10 +625,44 @@ class DeleteCommentMutation(relay.ClientIDMutation):
         if info.context.user != comment.user_comment:
             raise exceptions.PermissionDenied()
 
+        comment_id = comment.pk
         comment.delete()
+        pubsub.publish_comment(pubsub.COMMENT_DELETED, comment, comment_id)
         return DeleteCommentMutation(comment=None)
 
 
+class BulkDeleteCommentsMutation(relay.ClientIDMutation):
+    class Input:
+        ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    deleted_ids = graphene.List(graphene.ID)
+    errors = graphene.List(BulkItemError)
+
+    @verification_required
+    def mutate_and_get_payload(root, info, **input):
+        ids = input.get('ids')
+        errors = BulkErrors()
+        comments = resolve_global_ids(ids, ('CommentNode',), Comment)
+
+        deleted = {}
+        for index, id in enumerate(ids):
+            comment = comments.get(id)
+            if comment is None:
+                errors.add(index, 'Comment not found.', id)
+            elif info.context.user.pk != comment.user_comment_id:
+                errors.add(index, 'Permission denied.', id)
+            else:
+                deleted[id] = comment.pk
+
+        with transaction.atomic(), batch_counter_updates():
+            Comment.objects.filter(pk__in=list(deleted.values())).delete()
+            for id in deleted:
+                pubsub.publish_comment(
+                    pubsub.COMMENT_DELETED, comments[id], deleted[id])
+        return BulkDeleteCommentsMutation(
+            deleted_ids=list(deleted), errors=errors.items)
+
+
 """---"""
 
 
@@ -325,25 +670,94 @@ class Mutation(graphene.AbstractType):
     create_tag = CreateTagMutation.Field()
     update_tag = UpdateTagMutation.Field()
     delete_tag = DeleteTagMutation.Field()
+    bulk_create_tags = BulkCreateTagsMutation.Field()
+    bulk_upsert_tags = BulkUpsertTagsMutation.Field()
     create_article = CreateArticleMutation.Field()
     update_article = UpdateArticleMutation.Field()
     delete_article = DeleteArticleMutation.Field()
+    bulk_update_articles = BulkUpdateArticlesMutation.Field()
+    like_article = LikeArticleMutation.Field()
+    unlike_article = UnlikeArticleMutation.Field()
     create_comment = CreateCommentMutation.Field()
     update_comment = UpdateCommentMutation.Field()
     delete_comment = DeleteCommentMutation.Field()
+    bulk_delete_comments = BulkDeleteCommentsMutation.Field()
+
+
+class CommentAction(graphene.Enum):
+    CREATED = pubsub.COMMENT_CREATED
+    UPDATED = pubsub.COMMENT_UPDATED
+    DELETED = pubsub.COMMENT_DELETED
+
+
+class CommentEvent(graphene.ObjectType):
+    action = graphene.Field(CommentAction, required=True)
+    comment_id = graphene.ID(required=True)
+    comment = graphene.Field(CommentNode)
+
+    def resolve_comment_id(root, info, **kwargs):
+        return to_global_id('CommentNode', root.comment_id)
+
+
+def comment_messages(info, article_id):
+    """記事へのコメントの変更を流す Observable"""
+    type_name, pk = from_global_id(article_id)
+    if type_name != 'ArticleNode' or not Article.objects.filter(
+            pk=pk).exists():
+        raise GraphQLError('Article not found.')
+
+    def reset_loaders(message):
+        # 購読中はコンテキストを使い回すため、変更ごとにローダーを破棄する
+        clear_loaders(info.context)
+
+    return pubsub.observe(pubsub.comment_channel(pk)).do_action(reset_loaders)
+
+
+class Subscription(graphene.ObjectType):
+    comment_added = graphene.Field(
+        CommentNode, article_id=graphene.ID(required=True))
+    comment_changed = graphene.Field(
+        CommentEvent, article_id=graphene.ID(required=True))
+
+    def resolve_comment_added(root, info, article_id):
+        return comment_messages(info, article_id).filter(
+            lambda message: message.action == pubsub.COMMENT_CREATED
+        ).map(lambda message: message.comment)
+
+    def resolve_comment_changed(root, info, article_id):
+        return comment_messages(info, article_id)
 
 
 class Query(graphene.ObjectType):
-    all_tags = DjangoFilterConnectionField(TagNode)
-    all_articles = DjangoFilterConnectionField(
+    all_tags = CountOnDemandConnectionField(TagNode)
+    all_articles = CountOnDemandConnectionField(
         ArticleNode)
-    all_comments = DjangoFilterConnectionField(CommentNode)
+    all_comments = CountOnDemandConnectionField(CommentNode)
+    all_articles_keyset = KeysetConnectionField(ArticleNode)
+    all_comments_keyset = KeysetConnectionField(CommentNode)
+    search_articles = SearchConnectionField(
+        ArticleNode, connection=ArticleSearchConnection,
+        query=graphene.String(required=True))
 
     def resolve_all_tags(self, info, **kwargs):
-        return Tag.objects.all()
+        return optimize_queryset(Tag.objects.all(), info)
 
     def resolve_all_articles(self, info, **kwargs):
-        return Article.objects.all()
+        return optimize_queryset(Article.objects.all(), info)
 
     def resolve_all_comments(self, info, **kwargs):
-        return Comment.objects.all()
+        return optimize_queryset(Comment.objects.all(), info)
+
+    def resolve_all_articles_keyset(self, info, **kwargs):
+        return optimize_queryset(
+            Article.objects.all(), info,
+            required=KeysetConnectionField.cursor_fields)
+
+    def resolve_all_comments_keyset(self, info, **kwargs):
+        return optimize_queryset(
+            Comment.objects.all(), info,
+            required=KeysetConnectionField.cursor_fields)
+
+    def resolve_search_articles(self, info, query, **kwargs):
+        return optimize_queryset(
+            search.search_articles(Article.objects.all(), query), info)
@@ -0,0 +1,184 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Q, TextField
+from django.db.models.expressions import RawSQL, Value
+
+SEARCH_TABLE = 'blog_article_search'
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_STOP = '</mark>'
+
+
+class PostgresSearchBackend:
+    """tsvector 列と GIN インデックスによる全文検索"""
+
+    document_sql = (
+        "setweight(to_tsvector(%s, title), 'A') || "
+        "setweight(to_tsvector(%s, coalesce(content, '')), 'B')"
+    )
+    headline_options = 'StartSel=%s, StopSel=%s, MaxFragments=2' % (
+        HIGHLIGHT_START, HIGHLIGHT_STOP)
+
+    @property
+    def config(self):
+        return settings.GRAPHQL_API['SEARCH_CONFIG']
+
+    def index(self, cursor, article_ids):
+        cursor.execute(
+            "INSERT INTO " + SEARCH_TABLE + " (article_id, document) "
+            "SELECT id, " + self.document_sql + " FROM blog_article "
+            "WHERE id = ANY(%s) ON CONFLICT (article_id) "
+            "DO UPDATE SET document = EXCLUDED.document",
+            [self.config, self.config, list(article_ids)],
+        )
+
+    def remove(self, cursor, article_ids):
+        cursor.execute(
+            "DELETE FROM " + SEARCH_TABLE + " WHERE article_id = ANY(%s)",
+            [list(article_ids)],
+        )
+
+    def clear(self, cursor):
+        cursor.execute("DELETE FROM " + SEARCH_TABLE)
+
+    def search(self, queryset, query):
+        tsquery = "plainto_tsquery(%s, %s)"
+        params = [self.config, query]
+        return queryset.filter(pk__in=RawSQL(
+            "SELECT article_id FROM " + SEARCH_TABLE
+            + " WHERE document @@ " + tsquery, params,
+        )).annotate(
+            search_rank=RawSQL(
+                "SELECT ts_rank(document, " + tsquery + ") FROM "
+                + SEARCH_TABLE + " WHERE article_id = blog_article.id",
+                params, output_field=FloatField(),
+            ),
+            title_highlight=RawSQL(
+                "ts_headline(%s, blog_article.title, " + tsquery
+                + ", %s)", [self.config] + params + [self.headline_options],
+                output_field=TextField(),
+            ),
+            content_highlight=RawSQL(
+                "ts_headline(%s, coalesce(blog_article.content, ''), "
+                + tsquery + ", %s)",
+                [self.config] + params + [self.headline_options],
+                output_field=TextField(),
+            ),
+        ).order_by('-search_rank', '-pk')
+
+
+class SQLiteSearchBackend:
+    """FTS5 仮想テーブルによる全文検索 (ローカル・開発用)"""
+
+    def index(self, cursor, article_ids):
+        self.remove(cursor, article_ids)
+        placeholders = ', '.join(['%s'] * len(article_ids))
+        cursor.execute(
+            "INSERT INTO " + SEARCH_TABLE + " (rowid, title, content) "
+            "SELECT id, title, coalesce(content, '') FROM blog_article "
+            "WHERE id IN (" + placeholders + ")",
+            list(article_ids),
+        )
+
+    def remove(self, cursor, article_ids):
+        placeholders = ', '.join(['%s'] * len(article_ids))
+        cursor.execute(
+            "DELETE FROM " + SEARCH_TABLE
+            + " WHERE rowid IN (" + placeholders + ")",
+            list(article_ids),
+        )
+
+    def clear(self, cursor):
+        cursor.execute("DELETE FROM " + SEARCH_TABLE)
+
+    @staticmethod
+    def match_expression(query):
+        return ' '.join(
+            '"%s"' % term.replace('"', '""') for term in query.split())
+
+    def search(self, queryset, query):
+        match = self.match_expression(query)
+        if not match:
+            return queryset.none()
+        marks = "'%s', '%s'" % (HIGHLIGHT_START, HIGHLIGHT_STOP)
+        # 相関サブクエリにすると行ごとに MATCH を評価し直すため、
+        # FTS5 テーブルを結合して 1 回の MATCH で順位と強調表示を得る
+        return queryset.extra(
+            tables=[SEARCH_TABLE],
+            where=[
+                SEARCH_TABLE + '.rowid = blog_article.id',
+                SEARCH_TABLE + ' MATCH %s',
+            ],
+            params=[match],
+            select={
+                'search_rank': '-%s.rank' % SEARCH_TABLE,
+                'title_highlight': 'highlight(%s, 0, %s)' % (
+                    SEARCH_TABLE, marks),
+                'content_highlight': "snippet(%s, 1, %s, '…', 32)" % (
+                    SEARCH_TABLE, marks),
+            },
+        ).order_by('-search_rank', '-pk')
+
+
+class FallbackSearchBackend:
+    """全文検索に対応しない DB では icontains で代用する"""
+
+    def index(self, cursor, article_ids):
+        pass
+
+    def remove(self, cursor, article_ids):
+        pass
+
+    def clear(self, cursor):
+        pass
+
+    def search(self, queryset, query):
+        condition = Q()
+        for term in query.split():
+            condition &= Q(title__icontains=term) | Q(content__icontains=term)
+        return queryset.filter(condition).annotate(
+            search_rank=Value(0.0, output_field=FloatField()),
+            title_highlight=Value(None, output_field=TextField()),
+            content_highlight=Value(None, output_field=TextField()),
+        ).order_by('-pk')
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_search_backend():
+    return BACKENDS.get(connection.vendor, FallbackSearchBackend)()
+
+
+def search_articles(queryset, query):
+    """全文検索にマッチする記事をランク順に返す"""
+    return get_search_backend().search(queryset, query)
+
+
+def index_articles(article_ids):
+    article_ids = list(article_ids)
+    if article_ids:
+        with connection.cursor() as cursor:
+            get_search_backend().index(cursor, article_ids)
+
+
+def remove_articles(article_ids):
+    article_ids = list(article_ids)
+    if article_ids:
+        with connection.cursor() as cursor:
+            get_search_backend().remove(cursor, article_ids)
+
+
+def rebuild_index():
+    """全記事の検索インデックスを作り直す"""
+    from .models import Article
+
+    article_ids = list(Article.objects.values_list('pk', flat=True))
+    with connection.cursor() as cursor:
+        backend = get_search_backend()
+        backend.clear(cursor)
+        for start in range(0, len(article_ids), 500):
+            backend.index(cursor, article_ids[start:start + 500])
+    return len(article_ids)
@@ -0,0 +1,174 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+from graphql_auth.models import UserStatus
+
+from .counts import add_to_counter, bump_count_version, rebuild_counters
+from .decorators import invalidate_verified
+from .feeds import articles_changed, feed_names, refresh_later, tag_ids_for
+from .models import Article, Comment, Tag
+from .search import index_articles, remove_articles
+from .versions import bump_versions
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Article)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Tag)
+def invalidate_counts(sender, **kwargs):
+    bump_count_version()
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+@receiver(m2m_changed, sender=Article.liked.through)
+def invalidate_counts_on_m2m(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_count_version()
+
+
+@receiver(post_save, sender=Comment)
+def increment_comment_count(sender, instance, created, **kwargs):
+    if created:
+        add_to_counter([instance.article_comment_id], 'comment_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_count(sender, instance, **kwargs):
+    add_to_counter([instance.article_comment_id], 'comment_count', -1)
+
+
+@receiver(m2m_changed, sender=Article.liked.through)
+def update_like_count(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._cleared_article_ids = list(
+            instance.like_users.values_list('pk', flat=True))
+    elif action == 'post_add':
+        if reverse:
+            add_to_counter(pk_set, 'like_count', 1)
+        else:
+            add_to_counter([instance.pk], 'like_count', len(pk_set))
+    elif action in ('post_remove', 'post_clear'):
+        if not reverse:
+            article_ids = [instance.pk]
+        elif action == 'post_remove':
+            article_ids = pk_set
+        else:
+            article_ids = instance.__dict__.pop('_cleared_article_ids', [])
+        rebuild_counters(
+            Article.objects.filter(pk__in=article_ids), comments=False)
+
+
+@receiver(post_save, sender=Article)
+def index_article(sender, instance, **kwargs):
+    index_articles([instance.pk])
+
+
+@receiver(post_delete, sender=Article)
+def unindex_article(sender, instance, **kwargs):
+    remove_articles([instance.pk])
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=Article)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=get_user_model())
+def bump_model_version(sender, **kwargs):
+    bump_versions(sender._meta.label)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_comment_version(sender, **kwargs):
+    # コメント数は記事側の列に保持している
+    bump_versions(Comment._meta.label, Article._meta.label)
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+@receiver(m2m_changed, sender=Article.liked.through)
+def bump_article_version_on_m2m(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_versions(Article._meta.label)
+
+
+@receiver(post_save, sender=UserStatus)
+@receiver(post_delete, sender=UserStatus)
+def invalidate_user_status(sender, instance, **kwargs):
+    invalidate_verified(instance.user_id)
+    # UserNode の verified / archived などは UserStatus の値
+    bump_versions(settings.AUTH_USER_MODEL)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user_verified(sender, instance, **kwargs):
+    invalidate_verified(instance.pk)
+
+
+# フィードに出力する記事の列 (いいね数などの更新では生成し直さない)
+FEED_FIELDS = {
+    'title', 'content', 'excerpt', 'is_release', 'created_at', 'updated_at',
+    'user_article',
+}
+
+
+@receiver(pre_save, sender=Article)
+def remember_release(sender, instance, update_fields=None, **kwargs):
+    # 非公開にした記事もフィードから外すため、変更前の公開状態を確認する
+    if update_fields is not None and not FEED_FIELDS & set(update_fields):
+        return
+    if instance.pk is not None and not instance.is_release:
+        instance._was_released = Article.objects.filter(
+            pk=instance.pk, is_release=True).exists()
+
+
+@receiver(post_save, sender=Article)
+def refresh_article_feeds(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not FEED_FIELDS & set(update_fields):
+        return
+    if instance.is_release or instance.__dict__.pop('_was_released', False):
+        articles_changed([instance.pk])
+
+
+@receiver(pre_delete, sender=Article)
+def remember_article_tags(sender, instance, **kwargs):
+    # 中間テーブルの行は post_delete より前に削除される
+    if instance.is_release:
+        instance._feed_tag_ids = tag_ids_for([instance.pk])
+
+
+@receiver(post_delete, sender=Article)
+def refresh_deleted_article_feeds(sender, instance, **kwargs):
+    if instance.is_release:
+        articles_changed(
+            [instance.pk], instance.__dict__.pop('_feed_tag_ids', ()))
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def refresh_tag_feeds(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # タグ側からの変更は公開状態を問わずそのタグのフィードを生成し直す
+        if action.startswith('post_'):
+            refresh_later(feed_names([instance.pk]))
+        return
+    if not instance.is_release:
+        return
+    if action == 'pre_clear':
+        instance._feed_tag_ids = tag_ids_for([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        refresh_later(feed_names(pk_set))
+    elif action == 'post_clear':
+        refresh_later(feed_names(instance.__dict__.pop('_feed_tag_ids', ())))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def refresh_renamed_tag_feeds(sender, instance, created=False, **kwargs):
+    # タグ名はタグのフィードのタイトルと全体のフィードのカテゴリに含まれる
+    if not created:
+        refresh_later(feed_names([instance.pk], include_all=True))
@@ -1,3 +1,1071 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.conf import settings
+from django.test import (
+    RequestFactory, TestCase, TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql_jwt.shortcuts import get_token
+from graphql_relay import to_global_id
+
+from . import feeds, likes
+from .counts import estimate_count, save_without_counters, total_count
+from .decorators import is_verified, verified_cache_key
+from .models import EXCERPT_LENGTH, Article, Comment, Tag, make_excerpt
+
+
+def make_user(username, verified=True, staff=False):
+    """テスト用のユーザー (user.status は graphql_auth のシグナルで作成される)"""
+    user = get_user_model().objects.create_user(
+        username=username, email='%s@example.com' % username,
+        password='password', is_staff=staff)
+    user.status.verified = verified
+    user.status.save()
+    return user
+
+
+def run_query(query, user=None, **variables):
+    """スキーマを直接実行して ExecutionResult を返す"""
+    from graphql_api.schema import schema
+
+    request = RequestFactory().post('/graphql')
+    request.user = user if user is not None else AnonymousUser()
+    return schema.execute(query, context=request, variables=variables)
+
+
+def execute(query, user=None, **variables):
+    """スキーマを直接実行し、エラーがあれば AssertionError にする"""
+    result = run_query(query, user, **variables)
+    assert not result.errors, result.errors
+    return result.data
+
+
+def error_messages(result):
+    return [str(error) for error in result.errors or []]
+
+
+def global_id(obj):
+    return to_global_id('%sNode' % type(obj).__name__, obj.pk)
+
+
+def hot_queries():
+    """頻繁に実行される絞り込み・並べ替え (名前, クエリセット, 並べ替えの有無)"""
+    now = timezone.now()
+    return [
+        ('released_articles_newest',
+         Article.objects.filter(is_release=True).order_by('-created_at')[:20],
+         True),
+        ('articles_recently_updated',
+         Article.objects.order_by('-updated_at')[:20], True),
+        ('articles_popular',
+         Article.objects.order_by('-like_count')[:20], True),
+        ('articles_keyset_after',
+         Article.objects.filter(
+             Q(created_at__lt=now) | Q(created_at=now, pk__lt=100)
+         ).order_by('-created_at', '-pk')[:21],
+         True),
+        ('article_comments_oldest',
+         Comment.objects.filter(
+             article_comment_id=1).order_by('created_at')[:20],
+         True),
+        ('tag_by_name', Tag.objects.filter(name='seed-tag-1'), False),
+        ('tags_by_normalized_name',
+         Tag.objects.annotate(name_lower=Lower('name')).filter(
+             name_lower__in=['seed-tag-1', 'seed-tag-2']),
+         False),
+    ]
+
+
+@skipUnless(connection.vendor == 'sqlite',
+            'EXPLAIN QUERY PLAN の出力は SQLite のもの')
+class QueryPlanTests(TestCase):
+    """ホットなクエリがテーブル全体の走査や並べ替えに戻らないことを確認する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'seed_blog', users=10, tags=20, articles=200,
+            skip_search_index=True, stdout=StringIO())
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset, ordered in hot_queries():
+            with self.subTest(name):
+                plan = queryset.explain()
+                full_scans = [
+                    line for line in plan.splitlines()
+                    if ' SCAN ' in line and ' USING ' not in line
+                ]
+                self.assertEqual(full_scans, [], plan)
+                if ordered:
+                    self.assertNotIn('TEMP B-TREE', plan)
+
+
+CREATE_ARTICLE = """
+mutation($liked: [ID]) {
+  createArticle(input: {title: "t", content: "c", isRelease: true,
+                        liked: $liked}) {
+    article { id likeCount commentCount tags { edges { node { id } } } }
+  }
+}
+"""
+
+UPDATE_ARTICLE = """
+mutation($id: ID!, $liked: [ID]) {
+  updateArticle(input: {id: $id, title: "t2", content: "c2",
+                        isRelease: true, liked: $liked}) {
+    article { likeCount commentCount }
+  }
+}
+"""
+
+CREATE_COMMENT = """
+mutation($article: ID!) {
+  createComment(input: {text: "hi", articleComment: $article}) {
+    comment { id }
+  }
+}
+"""
+
+DELETE_COMMENT = """
+mutation($id: ID!) {
+  deleteComment(input: {id: $id}) { clientMutationId }
+}
+"""
+
+BULK_DELETE_COMMENTS = """
+mutation($ids: [ID!]!) {
+  bulkDeleteComments(input: {ids: $ids}) { deletedIds }
+}
+"""
+
+
+class CounterTests(TestCase):
+    """like_count / comment_count がミューテーションの後も正しいことを確認する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = make_user('staff', staff=True)
+        cls.readers = [make_user('reader%d' % i) for i in range(3)]
+
+    def setUp(self):
+        # 主キーはテストごとに再利用されるため、前のテストのキャッシュを消す
+        cache.clear()
+
+    def liked_ids(self, users):
+        return [global_id(user) for user in users]
+
+    def test_create_article_counts_likes(self):
+        data = execute(CREATE_ARTICLE, self.staff,
+                       liked=self.liked_ids(self.readers[:2]))
+        article = data['createArticle']['article']
+        self.assertEqual(article['likeCount'], 2)
+        self.assertEqual(article['tags']['edges'], [])
+        stored = Article.objects.get()
+        self.assertEqual(stored.like_count, 2)
+        self.assertEqual(stored.liked.count(), 2)
+
+    def test_update_article_keeps_counters(self):
+        article = Article.objects.create(
+            user_article=self.staff, title='t', is_release=True)
+        article_id = global_id(article)
+
+        data = execute(UPDATE_ARTICLE, self.staff, id=article_id,
+                       liked=self.liked_ids(self.readers[:2]))
+        self.assertEqual(data['updateArticle']['article']['likeCount'], 2)
+        article.refresh_from_db()
+        self.assertEqual(article.like_count, 2)
+
+        data = execute(UPDATE_ARTICLE, self.staff, id=article_id,
+                       liked=self.liked_ids(self.readers[:1]))
+        self.assertEqual(data['updateArticle']['article']['likeCount'], 1)
+
+        execute(CREATE_COMMENT, self.readers[0], article=article_id)
+        data = execute(UPDATE_ARTICLE, self.staff, id=article_id, liked=[])
+        self.assertEqual(data['updateArticle']['article'], {
+            'likeCount': 0, 'commentCount': 1})
+        article.refresh_from_db()
+        self.assertEqual((article.like_count, article.comment_count), (0, 1))
+
+    def test_save_does_not_overwrite_concurrent_counts(self):
+        article = Article.objects.create(user_article=self.staff, title='t')
+        stale = Article.objects.get(pk=article.pk)
+        Comment.objects.create(
+            text='x', user_comment=self.readers[0], article_comment=article)
+        article.liked.add(self.readers[0])
+
+        stale.title = 'edited'
+        save_without_counters(stale)
+        self.assertEqual((stale.like_count, stale.comment_count), (1, 1))
+        article.refresh_from_db()
+        self.assertEqual(article.title, 'edited')
+        self.assertEqual((article.like_count, article.comment_count), (1, 1))
+
+    def test_comment_mutations_update_comment_count(self):
+        article = Article.objects.create(
+            user_article=self.staff, title='t', is_release=True)
+        article_id = global_id(article)
+        ids = [
+            execute(CREATE_COMMENT, user, article=article_id)[
+                'createComment']['comment']['id']
+            for user in (self.readers[0], self.readers[0], self.readers[1])
+        ]
+        article.refresh_from_db()
+        self.assertEqual(article.comment_count, 3)
+
+        execute(DELETE_COMMENT, self.readers[1], id=ids[2])
+        article.refresh_from_db()
+        self.assertEqual(article.comment_count, 2)
+
+        execute(BULK_DELETE_COMMENTS, self.readers[0], ids=ids[:2])
+        article.refresh_from_db()
+        self.assertEqual(article.comment_count, 0)
+
+
+class FeedTests(TestCase):
+    """フィード・サイトマップが変更時に生成し直されることを確認する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = make_user('author', staff=True)
+        cls.tag = Tag.objects.create(name='python')
+        cls.other_tag = Tag.objects.create(name='django')
+
+    def setUp(self):
+        cache.clear()
+
+    def create_article(self, title, is_release=True, tags=()):
+        with self.captureOnCommitCallbacks(execute=True):
+            article = Article.objects.create(
+                user_article=self.author, title=title, content='body',
+                is_release=is_release)
+            article.tags.set(tags)
+        return article
+
+    def get(self, path, **headers):
+        return self.client.get(path, **headers)
+
+    def test_feed_contains_released_articles_only(self):
+        self.create_article('published', tags=[self.tag])
+        self.create_article('draft', is_release=False, tags=[self.tag])
+        for path in ('/feeds/articles.rss', '/feeds/articles.atom',
+                     '/feeds/tags/%d.rss' % self.tag.pk):
+            with self.subTest(path):
+                content = self.get(path).content
+                self.assertIn(b'published', content)
+                self.assertNotIn(b'draft', content)
+        other = self.get('/feeds/tags/%d.rss' % self.other_tag.pk)
+        self.assertNotIn(b'published', other.content)
+        self.assertEqual(self.get('/feeds/tags/0.rss').status_code, 404)
+        self.assertEqual(self.get('/feeds/articles.json').status_code, 404)
+
+    def test_conditional_get(self):
+        self.create_article('published')
+        response = self.get('/feeds/articles.rss')
+        self.assertTrue(response.has_header('Last-Modified'))
+        not_modified = self.get(
+            '/feeds/articles.rss', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        not_modified = self.get(
+            '/feeds/articles.rss',
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_article_changes_rebuild_feeds(self):
+        article = self.create_article('before', tags=[self.tag])
+        old = self.get('/feeds/articles.rss')
+        self.get('/feeds/tags/%d.rss' % self.tag.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            article.title = 'after'
+            article.save()
+        response = self.get(
+            '/feeds/articles.rss', HTTP_IF_NONE_MATCH=old['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'after', response.content)
+        self.assertIn(
+            b'after', self.get('/feeds/tags/%d.rss' % self.tag.pk).content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            article.tags.set([self.other_tag])
+        self.assertNotIn(
+            b'after', self.get('/feeds/tags/%d.rss' % self.tag.pk).content)
+        other = self.get('/feeds/tags/%d.rss' % self.other_tag.pk)
+        self.assertIn(b'after', other.content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            article.is_release = False
+            article.save()
+        self.assertNotIn(b'after', self.get('/feeds/articles.rss').content)
+        self.assertNotIn(
+            b'/articles/%d<' % article.pk, self.get('/sitemap-1.xml').content)
+
+    def test_deleted_article_is_removed(self):
+        article = self.create_article('doomed', tags=[self.tag])
+        kept = self.create_article('kept', tags=[self.tag])
+        self.get('/feeds/tags/%d.atom' % self.tag.pk)
+        deleted_pk = article.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            article.delete()
+        content = self.get('/feeds/tags/%d.atom' % self.tag.pk).content
+        self.assertNotIn(b'doomed', content)
+        self.assertIn(b'kept', content)
+        sitemap = self.get('/sitemap-1.xml').content
+        self.assertIn(b'/articles/%d<' % kept.pk, sitemap)
+        self.assertNotIn(b'/articles/%d<' % deleted_pk, sitemap)
+
+    def test_tag_rename_rebuilds_tag_and_global_feeds(self):
+        self.create_article('published', tags=[self.tag])
+        self.get('/feeds/articles.rss')
+        self.get('/feeds/tags/%d.rss' % self.tag.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'renamed'
+            self.tag.save()
+        self.assertIn(b'renamed', self.get('/feeds/articles.rss').content)
+        self.assertIn(
+            b'renamed', self.get('/feeds/tags/%d.rss' % self.tag.pk).content)
+        path = '/feeds/tags/%d.rss' % self.tag.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.delete()
+        self.assertEqual(self.get(path).status_code, 404)
+        self.assertNotIn(b'renamed', self.get('/feeds/articles.rss').content)
+
+    def test_only_affected_documents_are_rebuilt(self):
+        article = self.create_article('published', tags=[self.tag])
+        with self.captureOnCommitCallbacks() as callbacks:
+            article.title = 'edited'
+            article.save()
+        self.assertEqual(feeds._state.pending, feeds.feed_names(
+            [self.tag.pk]) | {'sitemap', 'sitemap:1'})
+        for callback in callbacks:
+            callback()
+        self.assertEqual(feeds._state.pending, set())
+
+        draft = self.create_article('draft', is_release=False)
+        with self.captureOnCommitCallbacks() as callbacks:
+            draft.title = 'still a draft'
+            draft.save()
+            article.like_count = 5
+            article.save(update_fields=['like_count'])
+        self.assertEqual(callbacks, [])
+
+    def test_documents_expire(self):
+        self.create_article('published')
+        feeds.get_document('rss')
+        self.assertIsNotNone(cache.get(feeds.KEY_PREFIX + 'rss'))
+        with override_settings(GRAPHQL_API=dict(
+                settings.GRAPHQL_API, FEED_CACHE_TIMEOUT=-1)):
+            feeds.refresh('rss')
+        self.assertIsNone(cache.get(feeds.KEY_PREFIX + 'rss'))
+
+    def test_sitemap_pages(self):
+        with override_settings(GRAPHQL_API=dict(
+                settings.GRAPHQL_API, SITEMAP_PAGE_SIZE=2)):
+            articles = [self.create_article('a%d' % i) for i in range(5)]
+            index = self.get('/sitemap.xml').content
+            pages = {feeds.sitemap_page(article.pk) for article in articles}
+            for page in pages:
+                self.assertIn(b'/sitemap-%d.xml' % page, index)
+                self.assertEqual(
+                    self.get('/sitemap-%d.xml' % page).status_code, 200)
+            self.assertEqual(index.count(b'<sitemap>'), len(pages))
+            self.assertEqual(
+                self.get('/sitemap-%d.xml' % (max(pages) + 1)).status_code,
+                404)
+
+
+class SeedTests(TestCase):
+    """生成後に通常の INSERT ができることを確認する (Postgres のシーケンス)"""
+
+    def test_inserts_after_seed(self):
+        call_command(
+            'seed_blog', users=3, tags=3, articles=5,
+            skip_search_index=True, stdout=StringIO())
+        user = make_user('after-seed')
+        tag = Tag.objects.create(name='after-seed')
+        article = Article.objects.create(user_article=user, title='t')
+        article.tags.add(tag)
+        article.liked.add(user)
+        Comment.objects.create(
+            text='x', user_comment=user, article_comment=article)
+        self.assertEqual(Article.objects.count(), 6)
+
+
+ARTICLES_PAGE = """
+query($first: Int, $after: String, $offset: Int) {
+  allArticles(first: $first, after: $after, offset: $offset,
+              orderByCreatedAt: "created_at") {
+    totalCount
+    edges { cursor node { title } }
+    pageInfo { hasNextPage endCursor }
+  }
+}
+"""
+
+
+class ConnectionTests(TestCase):
+    """オフセットのコネクションのページングと件数を確認する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = make_user('author')
+        for i in range(5):
+            Article.objects.create(
+                user_article=author, title='a%d' % i, is_release=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def titles(self, data):
+        return [edge['node']['title']
+                for edge in data['allArticles']['edges']]
+
+    def test_pages_follow_cursors(self):
+        data = execute(ARTICLES_PAGE, first=2)
+        self.assertEqual(self.titles(data), ['a0', 'a1'])
+        self.assertEqual(data['allArticles']['totalCount'], 5)
+        self.assertTrue(data['allArticles']['pageInfo']['hasNextPage'])
+        data = execute(ARTICLES_PAGE, first=2,
+                       after=data['allArticles']['pageInfo']['endCursor'])
+        self.assertEqual(self.titles(data), ['a2', 'a3'])
+        data = execute(ARTICLES_PAGE, first=2, offset=3)
+        self.assertEqual(self.titles(data), ['a3', 'a4'])
+        self.assertFalse(data['allArticles']['pageInfo']['hasNextPage'])
+
+    def test_invalid_cursor_is_a_graphql_error(self):
+        for after in ('not-a-cursor', 'YXJyYXljb25uZWN0aW9uOi01'):
+            with self.subTest(after):
+                result = run_query(ARTICLES_PAGE, first=2, after=after)
+                self.assertEqual(
+                    error_messages(result), ['Invalid cursor `after`.'])
+        result = run_query(ARTICLES_PAGE, first=2, offset=-1)
+        self.assertEqual(
+            error_messages(result), ['`offset` must not be negative.'])
+
+    def test_empty_filters_count_zero(self):
+        empty = Article.objects.filter(pk__in=[])
+        self.assertEqual(estimate_count(empty), 0)
+        with override_settings(GRAPHQL_API=dict(
+                settings.GRAPHQL_API, TOTAL_COUNT_MODE='estimated')):
+            self.assertEqual(total_count(empty), 0)
+
+
+class SearchTests(TestCase):
+    """全文検索と、検索用の文書を作るマイグレーションの設定を確認する"""
+
+    def test_search_articles(self):
+        author = make_user('author')
+        with self.captureOnCommitCallbacks(execute=True):
+            Article.objects.create(
+                user_article=author, title='GraphQL caching',
+                content='etag and versions', is_release=True)
+            Article.objects.create(
+                user_article=author, title='unrelated', content='nothing')
+        data = execute("""
+        { searchArticles(query: "caching") {
+            edges { node { title } } } }
+        """)
+        titles = [edge['node']['title']
+                  for edge in data['searchArticles']['edges']]
+        self.assertEqual(titles, ['GraphQL caching'])
+
+    def run_migration(self, module, function):
+        schema_editor = mock.Mock()
+        schema_editor.connection.vendor = 'postgresql'
+        getattr(import_module('blog.migrations.' + module), function)(
+            None, schema_editor)
+        return [call.args for call in schema_editor.execute.call_args_list]
+
+    def test_migrations_use_search_config(self):
+        with override_settings(GRAPHQL_API=dict(
+                settings.GRAPHQL_API, SEARCH_CONFIG='english')):
+            for module, function in (
+                    ('0005_article_search', 'create_search_index'),
+                    ('0008_search_config', 'rebuild_search_documents')):
+                with self.subTest(module):
+                    statements = self.run_migration(module, function)
+                    sql, params = statements[-1]
+                    self.assertIn('to_tsvector(%s, ', sql)
+                    self.assertNotIn("'simple'", sql)
+                    self.assertEqual(params, ['english', 'english'])
+        self.assertEqual(self.run_migration(
+            '0008_search_config', 'rebuild_search_documents'), [])
+
+
+LIKE_ARTICLE = """
+mutation($id: ID!) {
+  likeArticle(input: {id: $id}) { likeCount article { likeCount } }
+}
+"""
+
+UNLIKE_ARTICLE = """
+mutation($id: ID!) {
+  unlikeArticle(input: {id: $id}) { likeCount article { likeCount } }
+}
+"""
+
+
+class LikeTests(TestCase):
+    """likeArticle / unlikeArticle の冪等性といいね数を確認する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = make_user('author')
+        cls.reader = make_user('reader')
+        cls.article = Article.objects.create(
+            user_article=cls.author, title='t', is_release=True)
+        cls.draft = Article.objects.create(
+            user_article=cls.author, title='d', is_release=False)
+
+    def setUp(self):
+        cache.clear()
+
+    def like(self, mutation, user, article=None):
+        data = execute(mutation, user, id=global_id(article or self.article))
+        return next(iter(data.values()))['likeCount']
+
+    def stored_count(self, article=None):
+        article = article or self.article
+        article.refresh_from_db()
+        self.assertEqual(article.like_count, article.liked.count())
+        return article.like_count
+
+    def test_like_is_idempotent(self):
+        self.assertEqual(self.like(LIKE_ARTICLE, self.reader), 1)
+        self.assertEqual(self.like(LIKE_ARTICLE, self.reader), 1)
+        self.assertEqual(self.stored_count(), 1)
+        self.assertEqual(self.like(LIKE_ARTICLE, self.author), 2)
+        self.assertEqual(self.stored_count(), 2)
+        self.assertFalse(likes.like_article(self.article.pk, self.reader.pk))
+
+    def test_unlike(self):
+        self.assertEqual(self.like(UNLIKE_ARTICLE, self.reader), 0)
+        self.assertEqual(self.stored_count(), 0)
+        self.like(LIKE_ARTICLE, self.reader)
+        self.assertEqual(self.like(UNLIKE_ARTICLE, self.reader), 0)
+        self.assertEqual(self.like(UNLIKE_ARTICLE, self.reader), 0)
+        self.assertEqual(self.stored_count(), 0)
+        self.assertFalse(
+            likes.unlike_article(self.article.pk, self.reader.pk))
+
+    def test_drafts_are_likable_only_by_their_author(self):
+        result = run_query(
+            LIKE_ARTICLE, self.reader, id=global_id(self.draft))
+        self.assertEqual(error_messages(result), ['Article not found.'])
+        self.assertEqual(self.like(LIKE_ARTICLE, self.author, self.draft), 1)
+        self.assertEqual(self.stored_count(self.draft), 1)
+        for bad_id in (global_id(self.reader), 'not-an-id'):
+            with self.subTest(bad_id):
+                result = run_query(LIKE_ARTICLE, self.reader, id=bad_id)
+                self.assertEqual(
+                    error_messages(result), ['Article not found.'])
+
+    def test_requires_verified_user(self):
+        unverified = make_user('unverified', verified=False)
+        result = run_query(
+            LIKE_ARTICLE, unverified, id=global_id(self.article))
+        self.assertTrue(result.errors)
+        self.assertEqual(self.stored_count(), 0)
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'SQLite は書き込みを直列化するため同時実行にならない')
+class ConcurrentLikeTests(TransactionTestCase):
+    """同時にいいねしても like_count が中間テーブルの件数と一致する"""
+
+    def test_concurrent_likes(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        author = make_user('author')
+        users = [make_user('user%d' % i) for i in range(20)]
+        article = Article.objects.create(
+            user_article=author, title='t', is_release=True)
+
+        def like(user):
+            try:
+                return likes.like_article(article.pk, user.pk)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            results = list(pool.map(like, users + users))
+        self.assertEqual(results.count(True), len(users))
+        article.refresh_from_db()
+        self.assertEqual(article.like_count, len(users))
+        self.assertEqual(article.liked.count(), len(users))
+
+
+class ExportTests(TestCase):
+    """/export.ndjson の権限・出力順・絞り込みを確認する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = make_user('staff', staff=True)
+        cls.author = make_user('author')
+        cls.tags = [Tag.objects.create(name=name) for name in ('b', 'a')]
+        cls.articles = [
+            Article.objects.create(user_article=cls.author, title=title)
+            for title in ('first', 'second')]
+        cls.articles[1].tags.set(cls.tags)
+        cls.comments = [
+            Comment.objects.create(
+                user_comment=cls.author, article_comment=article, text=text)
+            for article, text in zip(cls.articles[::-1], ('x', 'y'))]
+        cls.old = timezone.now() - timedelta(days=30)
+        Article.objects.filter(pk=cls.articles[0].pk).update(
+            updated_at=cls.old)
+        Comment.objects.filter(pk=cls.comments[1].pk).update(
+            updated_at=cls.old)
+
+    def export(self, user=None, **params):
+        if user is not None:
+            self.client.force_login(
+                user, backend='django.contrib.auth.backends.ModelBackend')
+        return self.client.get('/export.ndjson', params)
+
+    def records(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode('utf-8')
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_requires_staff(self):
+        self.assertEqual(self.export().status_code, 403)
+        self.assertEqual(self.export(self.author).status_code, 403)
+
+    def test_jwt_staff(self):
+        response = self.client.get(
+            '/export.ndjson', {'types': 'tags'},
+            HTTP_AUTHORIZATION='JWT %s' % get_token(self.staff))
+        self.assertEqual(
+            [r['name'] for r in self.records(response)], ['b', 'a'])
+
+    def test_order(self):
+        records = self.records(self.export(self.staff))
+        self.assertEqual(
+            [(r['type'], r['id']) for r in records],
+            [('tag', tag.pk) for tag in self.tags]
+            + [('article', a.pk) for a in self.articles]
+            + [('comment', c.pk) for c in self.comments])
+        article = records[3]
+        self.assertCountEqual(article['tags'], ['a', 'b'])
+        self.assertEqual(article['author'], 'author')
+        self.assertEqual(records[-1]['article_id'], self.articles[0].pk)
+
+    def test_types_and_updated_since(self):
+        since = (self.old + timedelta(days=1)).isoformat()
+        records = self.records(self.export(
+            self.staff, types='comments,articles', updated_since=since))
+        # タグは更新日時がないため対象外、指定順に出力する
+        self.assertEqual(
+            [(r['type'], r['id']) for r in records],
+            [('comment', self.comments[0].pk),
+             ('article', self.articles[1].pk)])
+        date_only = self.records(self.export(
+            self.staff, types='articles',
+            updated_since=(self.old + timedelta(days=1)).date().isoformat()))
+        self.assertEqual(
+            [r['id'] for r in date_only], [self.articles[1].pk])
+
+    def test_bad_parameters(self):
+        for params in ({'types': 'users'}, {'updated_since': 'yesterday'}):
+            with self.subTest(params):
+                response = self.export(self.staff, **params)
+                self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(connection.vendor in ('postgresql', 'sqlite'),
+            'LOWER(name) のインデックスは PostgreSQL と SQLite のみ')
+class TagNameIndexTests(TestCase):
+    """blog_tag_name_lower_uniq が大文字・小文字違いのタグを拒否する"""
+
+    def constraints(self):
+        with connection.cursor() as cursor:
+            return connection.introspection.get_constraints(
+                cursor, Tag._meta.db_table)
+
+    def test_index_exists(self):
+        index = self.constraints().get('blog_tag_name_lower_uniq')
+        self.assertIsNotNone(index)
+        self.assertTrue(index['unique'])
+
+    def test_rejects_names_differing_in_case(self):
+        Tag.objects.create(name='GraphQL')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Tag.objects.create(name='graphql')
+        self.assertEqual(Tag.objects.count(), 1)
+
+    def test_migration_can_be_reapplied(self):
+        migration = import_module('blog.migrations.0009_tag_name_lower_index')
+        # SQLite の schema_editor はトランザクション内で使えないため、
+        # カーソルで直接実行する
+        with connection.cursor() as cursor:
+            schema_editor = mock.Mock(
+                connection=connection, execute=cursor.execute)
+            migration.ensure_unique_name_index(None, schema_editor)
+        self.assertIn('blog_tag_name_lower_uniq', self.constraints())
+
+
+ARTICLES_KEYSET = """
+query($first: Int, $after: String, $last: Int, $before: String,
+      $order: String) {
+  allArticlesKeyset(first: $first, after: $after, last: $last,
+                    before: $before, orderByCreatedAt: $order) {
+    edges { node { title } }
+    pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+  }
+}
+"""
+
+
+class KeysetConnectionTests(TestCase):
+    """(作成日時, id) のカーソルでページングできることを確認する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = make_user('author')
+        base = timezone.now() - timedelta(days=1)
+        # a1 と a2 は作成日時が同じで、id の順に並ぶ
+        for i, minutes in enumerate((0, 1, 1, 2, 3)):
+            article = Article.objects.create(
+                user_article=author, title='a%d' % i, is_release=True)
+            Article.objects.filter(pk=article.pk).update(
+                created_at=base + timedelta(minutes=minutes))
+
+    def setUp(self):
+        cache.clear()
+
+    def page(self, **variables):
+        data = execute(ARTICLES_KEYSET, **variables)['allArticlesKeyset']
+        return [edge['node']['title'] for edge in data['edges']], (
+            data['pageInfo'])
+
+    def collect(self, order):
+        titles, after = [], None
+        while True:
+            page, info = self.page(first=2, after=after, order=order)
+            titles += page
+            if not info['hasNextPage']:
+                return titles
+            after = info['endCursor']
+
+    def test_forward(self):
+        self.assertEqual(
+            self.collect('created_at'), ['a0', 'a1', 'a2', 'a3', 'a4'])
+        self.assertEqual(
+            self.collect('-created_at'), ['a4', 'a3', 'a2', 'a1', 'a0'])
+
+    def test_backward(self):
+        titles, info = self.page(first=3, order='created_at')
+        self.assertEqual(titles, ['a0', 'a1', 'a2'])
+        titles, info = self.page(
+            last=2, before=info['endCursor'], order='created_at')
+        self.assertEqual(titles, ['a0', 'a1'])
+        self.assertFalse(info['hasPreviousPage'])
+        self.assertTrue(info['hasNextPage'])
+
+    def test_cursor_must_match_ordering(self):
+        _, info = self.page(first=1, order='created_at')
+        result = run_query(ARTICLES_KEYSET, first=1, after=info['endCursor'],
+                           order='-updated_at')
+        self.assertTrue(result.errors)
+        result = run_query(ARTICLES_KEYSET, first=1, after='bogus')
+        self.assertEqual(
+            error_messages(result), ['Invalid cursor for this ordering.'])
+
+    def test_rejects_offset(self):
+        result = run_query(
+            '{ allArticlesKeyset(first: 1, offset: 1) { edges { cursor } } }')
+        self.assertEqual(len(result.errors), 1)
+        self.assertIn('do not support `offset`', error_messages(result)[0])
+
+
+BULK_CREATE_TAGS = """
+mutation($names: [String!]!) {
+  bulkCreateTags(input: {names: $names}) {
+    tags { name } errors { index message }
+  }
+}
+"""
+
+BULK_UPSERT_TAGS = """
+mutation($names: [String!]!) {
+  bulkUpsertTags(input: {names: $names}) {
+    tags { id name } errors { index message }
+  }
+}
+"""
+
+BULK_UPDATE_ARTICLES = """
+mutation($articles: [BulkArticleInput!]!) {
+  bulkUpdateArticles(input: {articles: $articles}) {
+    articles { title likeCount tags { edges { node { name } } } }
+    errors { index id message }
+  }
+}
+"""
+
+
+class BulkMutationTests(TestCase):
+    """一括ミューテーションの部分的な失敗と保存結果を確認する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = make_user('staff', staff=True)
+        cls.member = make_user('member')
+        cls.existing = Tag.objects.create(name='Existing')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bulk_create_tags(self):
+        data = execute(BULK_CREATE_TAGS, self.staff, names=[
+            ' Go  lang ', 'go LANG', '', 'Python', 'existing', 'x' * 101,
+        ])['bulkCreateTags']
+        self.assertEqual(
+            [tag['name'] for tag in data['tags']], ['Go lang', 'Python'])
+        self.assertEqual(
+            sorted(error['index'] for error in data['errors']), [1, 2, 4, 5])
+        self.assertEqual(Tag.objects.count(), 3)
+
+    def test_bulk_mutations_require_staff(self):
+        result = run_query(BULK_CREATE_TAGS, self.member, names=['Go'])
+        self.assertTrue(result.errors)
+        self.assertEqual(Tag.objects.count(), 1)
+
+    def test_bulk_upsert_tags(self):
+        data = execute(BULK_UPSERT_TAGS, self.staff, names=[
+            'EXISTING', 'new', ' New ', '',
+        ])['bulkUpsertTags']
+        tags = data['tags']
+        self.assertEqual(
+            [tag['name'] for tag in tags], ['Existing', 'new', 'new'])
+        self.assertEqual(tags[0]['id'], global_id(self.existing))
+        self.assertEqual(tags[1]['id'], tags[2]['id'])
+        self.assertEqual(
+            [error['index'] for error in data['errors']], [3])
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_bulk_update_articles(self):
+        own = Article.objects.create(user_article=self.staff, title='own')
+        other = Article.objects.create(user_article=self.member, title='m')
+        missing = to_global_id('ArticleNode', other.pk + 100)
+        data = execute(BULK_UPDATE_ARTICLES, self.staff, articles=[
+            {'id': global_id(own), 'title': 'renamed', 'content': 'body',
+             'tags': [global_id(self.existing)],
+             'liked': [to_global_id('UserNode', user.pk)
+                       for user in (self.staff, self.member)]},
+            {'id': global_id(other), 'title': 'stolen'},
+            {'id': missing, 'title': 'ghost'},
+            {'id': global_id(own), 'tags': ['bogus']},
+        ])['bulkUpdateArticles']
+        self.assertEqual(data['articles'], [{
+            'title': 'renamed', 'likeCount': 2,
+            'tags': {'edges': [{'node': {'name': 'Existing'}}]},
+        }])
+        self.assertEqual(
+            [(error['index'], error['message']) for error in data['errors']],
+            [(1, 'Permission denied.'), (2, 'Article not found.'),
+             (3, 'Unknown IDs: bogus')])
+
+        own.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((own.title, own.like_count), ('renamed', 2))
+        self.assertEqual(own.excerpt, 'body')
+        self.assertEqual(other.title, 'm')
+
+
+class VerifiedCacheTests(TestCase):
+    """verification_required が使う認証済みフラグのキャッシュと無効化"""
+
+    def setUp(self):
+        cache.clear()
+
+    def fresh(self, user):
+        # user.status を読み込んでいない、リクエストごとのインスタンス
+        return get_user_model().objects.get(pk=user.pk)
+
+    def cached(self, user):
+        return cache.get(verified_cache_key(user.pk))
+
+    def test_memo_and_shared_cache(self):
+        user = self.fresh(make_user('member'))
+        with self.assertNumQueries(1):
+            self.assertTrue(is_verified(user))
+        # 同じリクエスト内は UserStatus を読まない
+        with self.assertNumQueries(0):
+            self.assertTrue(is_verified(user))
+        # 他のリクエストはキャッシュから読む
+        other = self.fresh(user)
+        with self.assertNumQueries(0):
+            self.assertTrue(is_verified(other))
+        self.assertFalse(is_verified(AnonymousUser()))
+
+    def test_verify_account_invalidates(self):
+        from graphql_auth.constants import TokenAction
+        from graphql_auth.utils import get_token as get_action_token
+
+        user = make_user('member', verified=False)
+        self.assertFalse(is_verified(self.fresh(user)))
+        self.assertIs(self.cached(user), False)
+        execute("""
+        mutation($token: String!) {
+          verifyAccount(input: {token: $token}) { success }
+        }
+        """, token=get_action_token(user, TokenAction.ACTIVATION))
+        self.assertIsNone(self.cached(user))
+        self.assertTrue(is_verified(self.fresh(user)))
+
+    def test_archive_and_delete_account_invalidate(self):
+        for mutation in ('archiveAccount', 'deleteAccount'):
+            with self.subTest(mutation):
+                user = make_user(mutation)
+                self.assertTrue(is_verified(self.fresh(user)))
+                self.assertIs(self.cached(user), True)
+                data = execute("""
+                mutation { %s(input: {password: "password"}) { success } }
+                """ % mutation, self.fresh(user))
+                self.assertEqual(data[mutation], {'success': True})
+                self.assertIsNone(self.cached(user))
+
+
+BULK_UPDATE_RELATIONS = """
+mutation($articles: [BulkArticleInput!]!) {
+  bulkUpdateArticles(input: {articles: $articles}) {
+    articles {
+      title
+      %s
+    }
+  }
+}
+"""
+
+ARTICLE_RELATIONS = """
+userArticle { username }
+tags { edges { node { name } } }
+liked { edges { node { username } } }
+articleComment { edges { node { text } } }
+"""
+
+
+class LoaderTests(TestCase):
+    """記事・コメントのリレーションを DataLoader でまとめて取得する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = make_user('author', staff=True)
+        cls.reader = make_user('reader')
+        cls.tags = [Tag.objects.create(name=name) for name in ('a', 'b')]
+        cls.articles = []
+        for i in range(3):
+            article = Article.objects.create(
+                user_article=cls.author, title='t%d' % i)
+            article.tags.set(cls.tags[:i])
+            article.liked.set([cls.reader])
+            Comment.objects.create(
+                user_comment=cls.reader, article_comment=article,
+                text='c%d' % i)
+            cls.articles.append(article)
+
+    def test_relations_do_not_scale_with_articles(self):
+        variables = [{'id': global_id(article)} for article in self.articles]
+
+        def count(fields):
+            with CaptureQueriesContext(connection) as queries:
+                execute(BULK_UPDATE_RELATIONS % fields, self.author,
+                        articles=variables)
+            return len(queries)
+
+        # 投稿者・タグ・いいね・コメントで 1 回ずつ
+        self.assertEqual(count(ARTICLE_RELATIONS) - count(''), 4)
+
+
+class OptimizerTests(TestCase):
+    """選択セットに合わせた only / select_related / prefetch_related"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = make_user('author')
+        tags = [Tag.objects.create(name=name) for name in ('a', 'b')]
+        for i in range(3):
+            Article.objects.create(
+                user_article=author, title='t%d' % i, content='body',
+                is_release=True).tags.set(tags)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_selected_columns_and_relations(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = execute("""
+            { allArticles { edges { node {
+                title userArticle { username } tags { edges { node { name } } }
+            } } } }
+            """)
+        edges = data['allArticles']['edges']
+        self.assertEqual(len(edges), 3)
+        self.assertEqual(edges[0]['node']['userArticle'], {
+            'username': 'author'})
+        self.assertEqual(len(edges[0]['node']['tags']['edges']), 2)
+
+        # 記事と投稿者は 1 回の JOIN、タグは 1 回の prefetch
+        articles, tags = [query['sql'] for query in queries]
+        self.assertIn('JOIN "users_customuser"', articles)
+        self.assertIn('"users_customuser"."username"', articles)
+        for column in ('content', 'excerpt', 'like_count'):
+            self.assertNotIn('"blog_article"."%s"' % column, articles)
+        self.assertNotIn('"users_customuser"."password"', articles)
+        self.assertIn('"blog_article_tags"', tags)
+
+
+class ArticlePreviewTests(TestCase):
+    """作成・更新のたびに抜粋と文字数を計算し直す"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = make_user('staff', staff=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_create_and_update_set_preview(self):
+        content = '  first\n\nline  ' + 'x' * 300
+        data = execute("""
+        mutation($content: String) {
+          createArticle(input: {title: "t", content: $content,
+                                isRelease: true}) {
+            article { id excerpt contentLength }
+          }
+        }
+        """, self.staff, content=content)
+        article = data['createArticle']['article']
+        excerpt = make_excerpt(content)
+        self.assertEqual(len(excerpt), EXCERPT_LENGTH)
+        self.assertTrue(excerpt.startswith('first line x'))
+        self.assertTrue(excerpt.endswith('…'))
+        self.assertEqual(article['excerpt'], excerpt)
+        self.assertEqual(article['contentLength'], len(content))
+
+        data = execute("""
+        mutation($id: ID!) {
+          updateArticle(input: {id: $id, title: "t", content: "short",
+                                isRelease: true}) {
+            article { excerpt contentLength }
+          }
+        }
+        """, self.staff, id=article['id'])
+        self.assertEqual(data['updateArticle']['article'], {
+            'excerpt': 'short', 'contentLength': 5})
+        stored = Article.objects.get()
+        self.assertEqual((stored.excerpt, stored.content_length), ('short', 5))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.cache import cache
+
+KEY_PREFIX = 'blog:model-version:'
+
+
+def _key(label):
+    return KEY_PREFIX + label
+
+
+def bump_versions(*labels):
+    """モデルごとのバージョンを進め、それに依存するキャッシュを無効化する"""
+    for label in labels:
+        try:
+            cache.incr(_key(label))
+        except ValueError:
+            # 退避後に古いバージョン番号へ戻らないよう時刻で初期化する
+            cache.add(_key(label), time.time_ns(), None)
+
+
+def get_versions(labels):
+    """モデルラベルと現在のバージョンの辞書を返す
+
+    キャッシュにないバージョンは時刻で初期化する。固定値で始めると、
+    再起動や退避の後に以前と同じバージョン (と ETag) に戻り、変更後の
+    データに 304 を返してしまう。
+    """
+    labels = sorted(set(labels))
+    stored = cache.get_many([_key(label) for label in labels])
+    missing = [label for label in labels if _key(label) not in stored]
+    seed = time.time_ns()
+    if missing:
+        for label in missing:
+            cache.add(_key(label), seed, None)
+        # 同時に初期化したプロセスがあればその値を使う
+        stored.update(cache.get_many([_key(label) for label in missing]))
+    # 保存できないキャッシュ (DummyCache) では毎回異なる値になる
+    return {label: stored.get(_key(label), seed) for label in labels}
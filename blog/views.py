@@ -1,3 +1,75 @@
-from django.shortcuts import render
+from django.contrib.auth import authenticate
+from django.conf import settings
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden,
+    StreamingHttpResponse)
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
 
-# Create your views here.
+from .export import EXPORT_TYPES, export_lines, parse_updated_since
+from .feeds import FEED_FORMATS, get_document
+
+
+def export_view(request):
+    """タグ・記事・コメントを NDJSON でストリーミングする (スタッフのみ)
+
+    ?types=articles,comments で種類を、?updated_since=<ISO 8601> で
+    その日時以降に更新されたものに絞り込む。
+    """
+    user = request.user
+    if not user.is_authenticated:
+        # Authorization ヘッダの JWT でも認証する
+        user = authenticate(request=request) or user
+    if not user.is_staff:
+        return HttpResponseForbidden()
+
+    types = [t for t in request.GET.get('types', '').split(',') if t]
+    if any(t not in EXPORT_TYPES for t in types):
+        return HttpResponseBadRequest(
+            'types must be a subset of: %s' % ', '.join(EXPORT_TYPES))
+    updated_since = None
+    if request.GET.get('updated_since'):
+        try:
+            updated_since = parse_updated_since(request.GET['updated_since'])
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+
+    response = StreamingHttpResponse(
+        export_lines(types or EXPORT_TYPES, updated_since),
+        content_type='application/x-ndjson; charset=utf-8')
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def document_response(request, name):
+    """生成済みのフィード・サイトマップを ETag / Last-Modified 付きで返す"""
+    document = get_document(name)
+    if document is None:
+        raise Http404
+    response = HttpResponse(
+        document['body'], content_type=document['content_type'])
+    response['ETag'] = document['etag']
+    response['Last-Modified'] = http_date(document['last_modified'])
+    response['Cache-Control'] = settings.GRAPHQL_API['PUBLIC_CACHE_CONTROL']
+    return get_conditional_response(
+        request, etag=document['etag'],
+        last_modified=document['last_modified'], response=response)
+
+
+@require_safe
+def feed_view(request, fmt, tag_id=None):
+    """公開記事の RSS / Atom フィード (全体またはタグ別)"""
+    if fmt not in FEED_FORMATS:
+        raise Http404
+    if tag_id is None:
+        return document_response(request, fmt)
+    return document_response(request, '%s:tag:%d' % (fmt, tag_id))
+
+
+@require_safe
+def sitemap_view(request, page=None):
+    """サイトマップのインデックス、または 1 ページ分のサイトマップ"""
+    if page is None:
+        return document_response(request, 'sitemap')
+    return document_response(request, 'sitemap:%d' % page)
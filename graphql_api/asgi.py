@@ -9,8 +9,72 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'graphql_api.settings')
 
-application = get_asgi_application()
+
+class StreamingASGIHandler(ASGIHandler):
+    """ストリーミングレスポンスのイテレータをスレッドで進める ASGIHandler
+
+    Django 3.2 はイベントループ上でイテレータを回すため、ORM を使う
+    ジェネレータ (/export.ndjson) が SynchronousOnlyOperation になる。
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super(StreamingASGIHandler, self).send_response(
+                response, send)
+
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            response_headers.append((bytes(header), bytes(value)))
+        for c in response.cookies.values():
+            response_headers.append(
+                (b'Set-Cookie', c.output(header='').encode('ascii').strip()))
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers,
+        })
+
+        # ビューと同じスレッドで 1 要素ずつ取り出す
+        next_part = sync_to_async(next, thread_sensitive=True)
+        iterator = iter(response)
+        done = object()
+        while True:
+            part = await next_part(iterator, done)
+            if part is done:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                })
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+django.setup(set_prefix=False)
+django_application = StreamingASGIHandler()
+
+from .websocket import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """HTTP は Django、/graphql の WebSocket はサブスクリプションに振り分ける"""
+    if scope['type'] == 'websocket':
+        if scope['path'] == '/graphql':
+            await websocket_application(scope, receive, send)
+        else:
+            await receive()
+            await send({'type': 'websocket.close', 'code': 1000})
+        return
+    await django_application(scope, receive, send)
@@ -0,0 +1,111 @@
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from graphql_jwt import middleware, utils
+from graphql_jwt.settings import jwt_settings
+
+
+def token_hash(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class TokenCache:
+    """署名・有効期限を検証済みのトークンのペイロードを LRU キャッシュする
+
+    キーはトークンのハッシュで、エントリはトークンの有効期限までのみ使う。
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def cache_info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'maxsize': self.maxsize,
+            'currsize': len(self._cache),
+        }
+
+    def cache_clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                payload, expires_at = entry
+                if expires_at is None or time.time() < expires_at:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._cache[key]
+            self.misses += 1
+        return None
+
+    def set(self, key, payload, expires_at):
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._cache[key] = (payload, expires_at)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+
+token_cache = TokenCache(maxsize=settings.GRAPHQL_API['TOKEN_CACHE_SIZE'])
+
+
+def _expires_at(payload):
+    if not jwt_settings.JWT_VERIFY_EXPIRATION or 'exp' not in payload:
+        return None
+    leeway = jwt_settings.JWT_LEEWAY
+    if isinstance(leeway, timedelta):
+        leeway = leeway.total_seconds()
+    return payload['exp'] + leeway
+
+
+def jwt_decode(token, context=None):
+    """JWT_DECODE_HANDLER: 検証済みのトークンはデコードを省く
+
+    期限切れ・不正なトークンはキャッシュせず、毎回 jwt_decode で検証して
+    同じ例外を送出する。
+    """
+    key = token_hash(token)
+    payload = token_cache.get(key)
+    if payload is None:
+        payload = utils.jwt_decode(token, context)
+        token_cache.set(key, payload, _expires_at(payload))
+    return dict(payload)
+
+
+def authenticate_request(request):
+    """ヘッダ (または Cookie) のトークンでリクエストのユーザーを認証する"""
+    if middleware._authenticate(request):
+        user = authenticate(request=request)
+        if user is not None:
+            request.user = user
+
+
+class JSONWebTokenMiddleware(middleware.JSONWebTokenMiddleware):
+    """トークンの認証をトップレベルのフィールドでのみ行う
+
+    認証したユーザーはリクエストに保持されるため、2 つ目以降のトップレベルの
+    フィールドは判定のみで済み、ネストしたフィールドでは何もしない。
+    """
+
+    def resolve(self, next, root, info, **kwargs):
+        if len(info.path) > 1 and not jwt_settings.JWT_ALLOW_ARGUMENT:
+            return next(root, info, **kwargs)
+        return super(JSONWebTokenMiddleware, self).resolve(
+            next, root, info, **kwargs)
@@ -0,0 +1,89 @@
+import hashlib
+from collections import OrderedDict
+from functools import partial
+from threading import Lock
+
+from django.conf import settings
+from graphql.backend.base import GraphQLDocument
+from graphql.backend.core import GraphQLCoreBackend
+from graphql.execution import ExecutionResult, execute
+from graphql.language.base import parse
+from graphql.validation import validate
+
+from .validation import validation_rules
+
+
+def document_hash(document_string):
+    return hashlib.sha256(document_string.encode('utf-8')).hexdigest()
+
+
+def _invalid(errors, *args, **kwargs):
+    return ExecutionResult(errors=errors, invalid=True)
+
+
+class LRUCachedBackend(GraphQLCoreBackend):
+    """パース・検証済みのドキュメントをクエリ文字列のハッシュで LRU キャッシュする"""
+
+    def __init__(self, maxsize=256, executor=None):
+        super(LRUCachedBackend, self).__init__(executor=executor)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def cache_info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'maxsize': self.maxsize,
+            'currsize': len(self._cache),
+        }
+
+    def cache_clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = 0
+
+    def build_document(self, schema, document_string):
+        document_ast = parse(document_string)
+        errors = validate(schema, document_ast, validation_rules)
+        if errors:
+            run = partial(_invalid, errors)
+        else:
+            run = partial(
+                execute, schema, document_ast, **self.execute_params)
+        document = GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=run,
+        )
+        document.errors = errors
+        return document
+
+    def document_from_string(self, schema, document_string):
+        if not isinstance(document_string, str):
+            return super(LRUCachedBackend, self).document_from_string(
+                schema, document_string)
+
+        key = (id(schema), document_hash(document_string))
+        with self._lock:
+            document = self._cache.get(key)
+            if document is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return document
+            self.misses += 1
+
+        document = self.build_document(schema, document_string)
+        with self._lock:
+            self._cache[key] = document
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return document
+
+
+document_backend = LRUCachedBackend(
+    maxsize=settings.GRAPHQL_API['DOCUMENT_CACHE_SIZE'])
@@ -0,0 +1,84 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections
+from graphql.language import ast
+
+_pools = {}
+_lock = Lock()
+
+
+def get_pool(name):
+    """設定 ASYNC_<NAME>_WORKERS の大きさのスレッドプールを返す"""
+    with _lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = ThreadPoolExecutor(
+                max_workers=settings.GRAPHQL_API[
+                    'ASYNC_%s_WORKERS' % name.upper()],
+                thread_name_prefix='graphql-%s' % name)
+        return pool
+
+
+def call_with_connections(fn, *args, **kwargs):
+    """ワーカースレッドで ORM を使う処理を、リクエストと同様に接続を管理して呼び出す
+
+    DB 接続はスレッドごとに作られるため、処理の前後で古い接続を閉じる。
+    """
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def run_in_pool(name, fn, *args, **kwargs):
+    """イベントループを塞がないよう、同期処理をスレッドプールで実行する"""
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(
+        get_pool(name), partial(call_with_connections, fn, *args, **kwargs))
+
+
+def submit(name, fn, *args, **kwargs):
+    return get_pool(name).submit(call_with_connections, fn, *args, **kwargs)
+
+
+def split_root_fields(document_ast, operation_name):
+    """クエリのトップレベルのフィールドごとにドキュメントを分割する
+
+    分割できない (ミューテーション・フィールドが 1 つ・トップレベルに
+    フラグメントがある) 場合は None を返す。
+    """
+    operations = [
+        definition for definition in document_ast.definitions
+        if isinstance(definition, ast.OperationDefinition)
+    ]
+    fragments = [
+        definition for definition in document_ast.definitions
+        if isinstance(definition, ast.FragmentDefinition)
+    ]
+    if operation_name:
+        operations = [
+            operation for operation in operations
+            if operation.name and operation.name.value == operation_name
+        ]
+    if len(operations) != 1:
+        return None
+    operation = operations[0]
+    selections = operation.selection_set.selections
+    if (operation.operation != 'query' or len(selections) < 2
+            or not all(isinstance(s, ast.Field) for s in selections)):
+        return None
+    return [
+        ast.Document(definitions=[ast.OperationDefinition(
+            operation=operation.operation,
+            name=operation.name,
+            variable_definitions=operation.variable_definitions,
+            directives=operation.directives,
+            selection_set=ast.SelectionSet(selections=[selection]),
+        )] + fragments)
+        for selection in selections
+    ]
@@ -0,0 +1,164 @@
+import random
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+
+class ResolverRecord:
+    __slots__ = (
+        'path', 'parent_type', 'field_name', 'return_type', 'start',
+        'duration', 'sql_count', 'sql_time',
+    )
+
+    def __init__(self, info, start):
+        self.path = list(info.path)
+        self.parent_type = str(info.parent_type)
+        self.field_name = info.field_name
+        self.return_type = str(info.return_type)
+        self.start = start
+        self.duration = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+
+
+class OperationTrace:
+    """1 オペレーションの実行時間と SQL の発行回数・時間を記録する
+
+    リゾルバ単位の計測はサンプリングされたオペレーションのみ行う。
+    Promise を返すリゾルバは同期部分のみを計測し、DataLoader の一括取得で
+    発行された SQL はオペレーション全体にのみ計上される。
+    """
+
+    def __init__(self, operation_name, resolvers=False, tracing=False):
+        self.operation = operation_name or 'anonymous'
+        self.resolvers = resolvers or tracing
+        self.tracing = tracing
+        self.started_at = datetime.now(timezone.utc)
+        self.start = perf_counter()
+        self.duration = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.current = None
+        self.records = []
+        # 非同期ビューではトップレベルのフィールドが別スレッドで SQL を発行する
+        self._lock = Lock()
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = perf_counter() - start
+            with self._lock:
+                self.sql_count += 1
+                self.sql_time += elapsed
+            if self.current is not None:
+                self.current.sql_count += 1
+                self.current.sql_time += elapsed
+
+    def resolve(self, next, root, info, args):
+        start = perf_counter()
+        record = ResolverRecord(info, start - self.start)
+        previous, self.current = self.current, record
+        try:
+            return next(root, info, **args)
+        finally:
+            record.duration = perf_counter() - start
+            self.current = previous
+            self.records.append(record)
+
+    def finish(self):
+        self.duration = perf_counter() - self.start
+        labels = (self.operation,)
+        with metrics.registry.lock:
+            metrics.operation_duration.observe(labels, self.duration)
+            metrics.operation_sql_queries.observe(labels, self.sql_count)
+            metrics.operation_sql_duration.observe(labels, self.sql_time)
+            for record in self.records:
+                labels = ('%s.%s' % (record.parent_type, record.field_name),)
+                metrics.resolver_duration.observe(labels, record.duration)
+                metrics.resolver_sql_queries.observe(labels, record.sql_count)
+                metrics.resolver_sql_duration.observe(labels, record.sql_time)
+
+    def as_tracing(self):
+        """Apollo Tracing 形式 (と SQL の集計) を返す"""
+        def ns(seconds):
+            return int(seconds * 1e9)
+
+        ended_at = self.started_at + timedelta(seconds=self.duration)
+        return {
+            'version': 1,
+            'startTime': self.started_at.isoformat(),
+            'endTime': ended_at.isoformat(),
+            'duration': ns(self.duration),
+            'sql': {
+                'count': self.sql_count,
+                'duration': ns(self.sql_time),
+            },
+            'execution': {
+                'resolvers': [{
+                    'path': record.path,
+                    'parentType': record.parent_type,
+                    'fieldName': record.field_name,
+                    'returnType': record.return_type,
+                    'startOffset': ns(record.start),
+                    'duration': ns(record.duration),
+                    'sqlQueries': record.sql_count,
+                    'sqlDuration': ns(record.sql_time),
+                } for record in self.records],
+            },
+        }
+
+
+def start_trace(request, operation_name):
+    options = settings.GRAPHQL_API
+    if not options['METRICS_ENABLED']:
+        return None
+    tracing = options['TRACING_ENABLED'] and bool(
+        request.META.get('HTTP_X_GRAPHQL_TRACING'))
+    sample_rate = options['RESOLVER_SAMPLE_RATE']
+    resolvers = sample_rate >= 1 or random.random() < sample_rate
+    return OperationTrace(operation_name, resolvers=resolvers, tracing=tracing)
+
+
+@contextmanager
+def track_sql(trace):
+    """現在のスレッドの全 DB 接続で発行された SQL を trace に計上する"""
+    with ExitStack() as stack:
+        if trace is not None:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(trace.execute_wrapper))
+        yield trace
+
+
+@contextmanager
+def instrument(request, operation_name):
+    """オペレーションの実行中、全 DB 接続の SQL を計測する"""
+    trace = start_trace(request, operation_name)
+    if trace is None:
+        yield None
+        return
+    request.graphql_trace = trace
+    try:
+        with track_sql(trace):
+            yield trace
+    finally:
+        request.graphql_trace = None
+        trace.finish()
+
+
+class InstrumentationMiddleware:
+    """サンプリングされたオペレーションのリゾルバごとの時間と SQL を記録する"""
+
+    def resolve(self, next, root, info, **args):
+        trace = getattr(info.context, 'graphql_trace', None)
+        if trace is None or not trace.resolvers:
+            return next(root, info, **args)
+        return trace.resolve(next, root, info, args)
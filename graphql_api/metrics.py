@@ -0,0 +1,128 @@
+from bisect import bisect_left
+from threading import Lock
+
+# 秒単位のヒストグラムのバケット境界
+DURATION_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0,
+)
+# SQL 発行回数のバケット境界
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+# ラベル値の種類がこの数を超えたら以降は "other" にまとめる
+MAX_LABEL_VALUES = 500
+OTHER = 'other'
+
+
+class Histogram:
+    """ラベルごとに累積バケット・合計・件数を保持するヒストグラム"""
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def _get_series(self, labels):
+        series = self._series.get(labels)
+        if series is None:
+            if len(self._series) >= MAX_LABEL_VALUES:
+                labels = (OTHER,) * len(self.labelnames)
+                series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {
+                    'buckets': [0] * len(self.buckets),
+                    'sum': 0.0,
+                    'count': 0,
+                }
+        return series
+
+    def observe(self, labels, value):
+        """呼び出し側で registry.lock を取得していること"""
+        series = self._get_series(tuple(labels))
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series['buckets'][index] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s histogram' % self.name,
+        ]
+        for labels, series in sorted(self._series.items()):
+            pairs = ['%s="%s"' % (name, _escape(value))
+                     for name, value in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['buckets']):
+                cumulative += count
+                lines.append('%s_bucket{%s} %d' % (
+                    self.name, ','.join(pairs + ['le="%s"' % bound]),
+                    cumulative))
+            lines.append('%s_bucket{%s} %d' % (
+                self.name, ','.join(pairs + ['le="+Inf"']), series['count']))
+            lines.append('%s_sum{%s} %r' % (
+                self.name, ','.join(pairs), series['sum']))
+            lines.append('%s_count{%s} %d' % (
+                self.name, ','.join(pairs), series['count']))
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace(
+        '"', '\\"')
+
+
+class Registry:
+    """プロセス内で集計し、Prometheus のテキスト形式で出力する"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms = []
+
+    def histogram(self, name, documentation, labelnames, buckets):
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for histogram in self.histograms:
+                lines.extend(histogram.render())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            for histogram in self.histograms:
+                histogram._series.clear()
+
+
+registry = Registry()
+
+operation_duration = registry.histogram(
+    'graphql_operation_duration_seconds',
+    'Wall time of GraphQL operations.',
+    ['operation'], DURATION_BUCKETS)
+operation_sql_queries = registry.histogram(
+    'graphql_operation_sql_queries',
+    'Number of SQL queries per GraphQL operation.',
+    ['operation'], COUNT_BUCKETS)
+operation_sql_duration = registry.histogram(
+    'graphql_operation_sql_duration_seconds',
+    'Time spent in SQL per GraphQL operation.',
+    ['operation'], DURATION_BUCKETS)
+resolver_duration = registry.histogram(
+    'graphql_resolver_duration_seconds',
+    'Wall time of sampled resolvers (synchronous part).',
+    ['field'], DURATION_BUCKETS)
+resolver_sql_queries = registry.histogram(
+    'graphql_resolver_sql_queries',
+    'Number of SQL queries issued inside sampled resolvers.',
+    ['field'], COUNT_BUCKETS)
+resolver_sql_duration = registry.histogram(
+    'graphql_resolver_sql_duration_seconds',
+    'Time spent in SQL inside sampled resolvers.',
+    ['field'], DURATION_BUCKETS)
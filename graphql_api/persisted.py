@@ -0,0 +1,125 @@
+import fcntl
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class DatabaseQueryStore:
+    """blog.PersistedQuery に永続化クエリを保存する
+
+    取得したクエリは PERSISTED_QUERIES_MEMO_SIZE 件まで LRU で保持する。
+    """
+
+    def __init__(self, maxsize=None):
+        if maxsize is None:
+            maxsize = settings.GRAPHQL_API['PERSISTED_QUERIES_MEMO_SIZE']
+        self.maxsize = maxsize
+        self._memo = OrderedDict()
+        self._lock = Lock()
+
+    def _remember(self, sha256_hash, query):
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._memo[sha256_hash] = query
+            self._memo.move_to_end(sha256_hash)
+            while len(self._memo) > self.maxsize:
+                self._memo.popitem(last=False)
+
+    def get(self, sha256_hash):
+        from blog.models import PersistedQuery
+
+        with self._lock:
+            query = self._memo.get(sha256_hash)
+            if query is not None:
+                self._memo.move_to_end(sha256_hash)
+                return query
+        query = PersistedQuery.objects.filter(
+            sha256_hash=sha256_hash).values_list('query', flat=True).first()
+        if query is not None:
+            self._remember(sha256_hash, query)
+        return query
+
+    def set(self, sha256_hash, query):
+        from blog.models import PersistedQuery
+
+        PersistedQuery.objects.get_or_create(
+            sha256_hash=sha256_hash, defaults={'query': query})
+        self._remember(sha256_hash, query)
+
+
+class FileQueryStore:
+    """ハッシュとクエリの対応を JSON ファイルに保存する
+
+    他のプロセスや register_persisted_queries による更新を反映するため、
+    ファイルが変わっていれば読み直す。書き込みはファイルロックの下で
+    最新の内容に追加する。
+    """
+
+    def __init__(self, path=None):
+        self.path = str(path or settings.GRAPHQL_API['PERSISTED_QUERIES_FILE'])
+        self._queries = {}
+        self._signature = None
+        self._lock = Lock()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        signature = self._stat()
+        if signature == self._signature:
+            return self._queries
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                queries = json.load(f)
+        except FileNotFoundError:
+            queries = {}
+        self._queries, self._signature = queries, signature
+        return queries
+
+    def get(self, sha256_hash):
+        with self._lock:
+            return self._load().get(sha256_hash)
+
+    def set(self, sha256_hash, query):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with self._lock, open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            queries = dict(self._load())
+            if queries.get(sha256_hash) == query:
+                return
+            queries[sha256_hash] = query
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=directory, delete=False, encoding='utf-8') as f:
+                json.dump(queries, f, ensure_ascii=False, indent=2)
+            os.replace(f.name, self.path)
+            self._queries, self._signature = queries, self._stat()
+
+
+STORES = {
+    'database': DatabaseQueryStore,
+    'file': FileQueryStore,
+}
+
+_store = None
+
+
+def get_query_store(name=None):
+    """設定 PERSISTED_QUERIES_STORE に応じたストアを返す"""
+    global _store
+    if name is not None:
+        store_class = STORES.get(name) or import_string(name)
+        return store_class()
+    if _store is None:
+        _store = get_query_store(
+            settings.GRAPHQL_API['PERSISTED_QUERIES_STORE'])
+    return _store
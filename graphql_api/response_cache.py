@@ -0,0 +1,118 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from graphql import GraphQLObjectType
+from graphql.language import ast
+from graphql.language.printer import print_ast
+
+from blog.versions import get_versions
+
+# 書き込み時にバージョンが進むモデル (blog.signals を参照)
+TRACKED_MODELS = {
+    'blog.Article',
+    'blog.Comment',
+    'blog.Tag',
+    settings.AUTH_USER_MODEL,
+}
+
+
+def _unwrap(_type):
+    while hasattr(_type, 'of_type'):
+        _type = _type.of_type
+    return _type
+
+
+def _model_label(_type):
+    meta = getattr(getattr(_type, 'graphene_type', None), '_meta', None)
+    model = getattr(meta, 'model', None)
+    return model._meta.label if model is not None else None
+
+
+def document_dependencies(document):
+    """クエリが参照するモデルのラベルを返す (追跡できない型を含む場合は None)"""
+    if hasattr(document, 'dependencies'):
+        return document.dependencies
+
+    schema = document.schema
+    fragments = {
+        definition.name.value: definition
+        for definition in document.document_ast.definitions
+        if isinstance(definition, ast.FragmentDefinition)
+    }
+    labels = set()
+
+    def visit(parent_type, selection_set):
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                if selection.name.value.startswith('__'):
+                    continue
+                field_type = _unwrap(
+                    parent_type.fields[selection.name.value].type)
+                if selection.selection_set is None:
+                    continue
+                if not isinstance(field_type, GraphQLObjectType):
+                    return False
+                label = _model_label(field_type)
+                if label is not None:
+                    labels.add(label)
+                if visit(field_type, selection.selection_set) is False:
+                    return False
+            else:
+                if isinstance(selection, ast.FragmentSpread):
+                    selection = fragments[selection.name.value]
+                type_condition = selection.type_condition
+                fragment_type = parent_type
+                if type_condition:
+                    fragment_type = schema.get_type(type_condition.name.value)
+                if visit(fragment_type, selection.selection_set) is False:
+                    return False
+
+    dependencies = labels
+    for definition in document.document_ast.definitions:
+        if isinstance(definition, ast.OperationDefinition):
+            if definition.operation != 'query' or visit(
+                    schema.get_query_type(),
+                    definition.selection_set) is False:
+                dependencies = None
+                break
+    if dependencies is not None and not dependencies <= TRACKED_MODELS:
+        dependencies = None
+    document.dependencies = dependencies
+    return dependencies
+
+
+def cache_key(document, variables, operation_name, scope):
+    """正規化したドキュメント・変数・認証スコープからキーを作る"""
+    if not hasattr(document, 'normalized'):
+        document.normalized = print_ast(document.document_ast)
+    payload = json.dumps(
+        [document.normalized, variables or {}, operation_name, scope],
+        sort_keys=True, default=str,
+    )
+    return 'graphql:response:' + hashlib.sha256(
+        payload.encode('utf-8')).hexdigest()
+
+
+def _cache():
+    return caches[settings.GRAPHQL_API['RESPONSE_CACHE_ALIAS']]
+
+
+def get_response(key):
+    """依存モデルが更新されていなければキャッシュ済みの (本文, ステータス) を返す"""
+    entry = _cache().get(key)
+    if entry is None:
+        return None
+    if get_versions(entry['versions']) != entry['versions']:
+        return None
+    return entry['body'], entry['status']
+
+
+def set_response(key, versions, body, status):
+    """versions は実行前に get_versions で取得した依存モデルのバージョン"""
+    _cache().set(key, {
+        'versions': versions,
+        'body': body,
+        'status': status,
+    }, settings.GRAPHQL_API['RESPONSE_CACHE_TIMEOUT'])
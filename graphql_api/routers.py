@@ -0,0 +1,155 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from threading import Lock, local
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'graphql_primary'
+PIN_KEY = 'graphql:primary-pin:%s'
+
+_state = local()
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+def check_replica(alias):
+    """レプリカに接続でき、遅延が REPLICA_MAX_LAG 以内かを確認する"""
+    connection = connections[alias]
+    max_lag = settings.GRAPHQL_API['REPLICA_MAX_LAG']
+    try:
+        with connection.cursor() as cursor:
+            # 空の SQLite ファイルも不健全とみなすため、テーブルを読む
+            cursor.execute('SELECT 1 FROM django_migrations LIMIT 1')
+            cursor.fetchone()
+            if max_lag and connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT EXTRACT(EPOCH FROM '
+                    'now() - pg_last_xact_replay_timestamp())')
+                lag = cursor.fetchone()[0]
+                if lag is not None and lag > max_lag:
+                    logger.warning(
+                        'Replica %s is %.1fs behind; ejecting.', alias, lag)
+                    return False
+    except DatabaseError as e:
+        logger.warning('Replica %s is unavailable: %s', alias, e)
+        connection.close()
+        return False
+    return True
+
+
+class ReplicaHealth:
+    """レプリカの死活を REPLICA_HEALTH_CHECK_INTERVAL 秒ごとに確認する
+
+    不健全なレプリカは次の確認で回復するまで振り分けから外す。
+    """
+
+    def __init__(self):
+        self._checked = {}
+        self._lock = Lock()
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        interval = settings.GRAPHQL_API['REPLICA_HEALTH_CHECK_INTERVAL']
+        with self._lock:
+            entry = self._checked.get(alias)
+        if entry is not None and now - entry[0] < interval:
+            return entry[1]
+        healthy = check_replica(alias)
+        with self._lock:
+            self._checked[alias] = (now, healthy)
+        return healthy
+
+    def reset(self):
+        with self._lock:
+            self._checked.clear()
+
+
+health = ReplicaHealth()
+
+
+def choose_replica():
+    """健全なレプリカを 1 つ選ぶ (なければ None)"""
+    healthy = [
+        alias for alias in replica_aliases() if health.is_healthy(alias)]
+    return random.choice(healthy) if healthy else None
+
+
+def current_alias():
+    return getattr(_state, 'alias', None)
+
+
+@contextmanager
+def read_from(alias):
+    """このスレッドの読み取りを alias (None はプライマリ) に振り分ける"""
+    previous = current_alias()
+    _state.alias = alias
+    try:
+        yield alias
+    finally:
+        _state.alias = previous
+
+
+def _pin_key(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return PIN_KEY % user.pk
+    return None
+
+
+def is_pinned(request):
+    """直前に書き込んだクライアントならプライマリから読む"""
+    if getattr(request, 'graphql_pinned', False):
+        return True
+    if request.COOKIES.get(PIN_COOKIE):
+        return True
+    key = _pin_key(request)
+    return key is not None and bool(cache.get(key))
+
+
+def pin_to_primary(request):
+    """書き込み後 REPLICA_PIN_SECONDS 秒、クライアントをプライマリに固定する
+
+    ブラウザは Cookie、トークンで認証するクライアントはユーザーごとの
+    キャッシュで識別する。
+    """
+    request.graphql_pinned = True
+    seconds = settings.GRAPHQL_API['REPLICA_PIN_SECONDS']
+    key = _pin_key(request)
+    if seconds and key is not None:
+        cache.set(key, True, seconds)
+
+
+def set_pin_cookie(request, response):
+    seconds = settings.GRAPHQL_API['REPLICA_PIN_SECONDS']
+    if getattr(request, 'graphql_pinned', False) and seconds:
+        response.set_cookie(
+            PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+
+
+class ReplicaRouter:
+    """GraphQL のクエリの読み取りのみレプリカに振り分けるルーター
+
+    BlogGraphQLView がクエリの実行を read_from(<レプリカ>) で囲んだ範囲
+    以外 (ミューテーション・管理コマンド・サブスクリプションなど) は常に
+    プライマリを使う。
+    """
+
+    def db_for_read(self, model, **hints):
+        return current_alias() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = [DEFAULT_DB_ALIAS] + replica_aliases()
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
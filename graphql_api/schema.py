@@ -11,4 +11,9 @@ class Mutation(users.schema.Mutation, blog.schema.Mutation, graphene.ObjectType)
     pass
 
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+class Subscription(blog.schema.Subscription, graphene.ObjectType):
+    pass
+
+
+schema = graphene.Schema(
+    query=Query, mutation=Mutation, subscription=Subscription)
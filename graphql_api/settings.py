@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 import os
-from decouple import config
+from decouple import Csv, config
 from dj_database_url import parse as dburl
 from datetime import timedelta
 from django.conf import settings as django_settings
@@ -98,6 +98,27 @@ DATABASES = {
     'default': config('DATABASE_URL', default=default_dburl, cast=dburl),
 }
 
+# 読み取り専用のレプリカ (カンマ区切り)。指定した場合、GraphQL のクエリは
+# レプリカから、ミューテーションとそれ以外の処理はプライマリ (default) から読む
+DATABASE_REPLICA_URLS = config('DATABASE_REPLICA_URLS', default='', cast=Csv())
+
+for index, url in enumerate(DATABASE_REPLICA_URLS, 1):
+    DATABASES['replica%d' % index] = dict(dburl(url), TEST={'MIRROR': 'default'})
+
+if DATABASE_REPLICA_URLS:
+    DATABASE_ROUTERS = ['graphql_api.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -145,7 +166,95 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 GRAPHENE = {
     "SCHEMA": "graphql_api.schema.schema",
-    "MIDDLEWARE": ["graphql_jwt.middleware.JSONWebTokenMiddleware"],
+    "MIDDLEWARE": [
+        "graphql_api.authentication.JSONWebTokenMiddleware",
+        "graphql_api.instrumentation.InstrumentationMiddleware",
+    ],
+    # コネクションの first / last の上限
+    "RELAY_CONNECTION_MAX_LIMIT": config('GRAPHQL_MAX_PAGE_SIZE', default=100, cast=int),
+}
+
+GRAPHQL_API = {
+    # パース・検証済みドキュメントの LRU キャッシュ件数
+    "DOCUMENT_CACHE_SIZE": config('GRAPHQL_DOCUMENT_CACHE_SIZE', default=256, cast=int),
+    # 永続化クエリ: True の場合は登録済みハッシュのクエリのみ実行する
+    "PERSISTED_QUERIES_STRICT": config('PERSISTED_QUERIES_STRICT', default=False, cast=bool),
+    # "database" / "file" またはストアクラスのパス
+    "PERSISTED_QUERIES_STORE": config('PERSISTED_QUERIES_STORE', default='database'),
+    "PERSISTED_QUERIES_FILE": config('PERSISTED_QUERIES_FILE', default=str(BASE_DIR / 'persisted_queries.json')),
+    # 非 strict モードで未登録のクエリを自動登録するクライアント
+    # ("all" / "authenticated" / "staff" / "none")。対象外のクライアントの
+    # クエリは実行するが登録しない
+    "PERSISTED_QUERIES_AUTO_REGISTER": config('PERSISTED_QUERIES_AUTO_REGISTER', default='authenticated'),
+    # データベースのストアがプロセス内に保持するクエリの LRU 件数
+    "PERSISTED_QUERIES_MEMO_SIZE": config('PERSISTED_QUERIES_MEMO_SIZE', default=1024, cast=int),
+    # totalCount: "exact" または "estimated" (Postgres のプランナ統計を利用)
+    "TOTAL_COUNT_MODE": config('TOTAL_COUNT_MODE', default='exact'),
+    # 見積もり件数がこの値未満の場合は実際に数える
+    "TOTAL_COUNT_ESTIMATE_THRESHOLD": config('TOTAL_COUNT_ESTIMATE_THRESHOLD', default=10000, cast=int),
+    # フィルタ条件ごとの件数キャッシュの秒数 (0 で無効)
+    "TOTAL_COUNT_CACHE_TIMEOUT": config('TOTAL_COUNT_CACHE_TIMEOUT', default=300, cast=int),
+    # 全文検索 (Postgres) のテキスト検索設定。保存済みの文書もこの設定で
+    # 作成するため、変更した場合は rebuild_search_index を実行する
+    "SEARCH_CONFIG": config('SEARCH_CONFIG', default='simple'),
+    # 匿名ユーザーの読み取りクエリのレスポンスキャッシュの秒数 (0 で無効)
+    "RESPONSE_CACHE_TIMEOUT": config('RESPONSE_CACHE_TIMEOUT', default=0, cast=int),
+    "RESPONSE_CACHE_ALIAS": config('RESPONSE_CACHE_ALIAS', default='default'),
+    # 匿名ユーザーの GET クエリに付与する Cache-Control
+    "PUBLIC_CACHE_CONTROL": config('PUBLIC_CACHE_CONTROL', default='public, max-age=0, must-revalidate'),
+    # JSON 配列で送られたバッチ 1 件あたりのオペレーション数の上限
+    "MAX_BATCH_SIZE": config('GRAPHQL_MAX_BATCH_SIZE', default=10, cast=int),
+    # first / last が指定されていないコネクションのページサイズ
+    "DEFAULT_PAGE_SIZE": config('GRAPHQL_DEFAULT_PAGE_SIZE', default=20, cast=int),
+    # 実行前に拒否するクエリの深さと推定コストの上限 (0 で無効)
+    "MAX_QUERY_DEPTH": config('GRAPHQL_MAX_QUERY_DEPTH', default=12, cast=int),
+    "MAX_QUERY_COST": config('GRAPHQL_MAX_QUERY_COST', default=10000, cast=int),
+    # フィールドごとのコストの重み ("型名.フィールド名": 重み)。
+    # 既定はオブジェクト・コネクションが 1、スカラーが 0
+    "QUERY_COST_WEIGHTS": {
+        "Query.searchArticles": 10,
+    },
+    # オペレーション単位の時間・SQL 回数を /metrics に集計する
+    "METRICS_ENABLED": config('GRAPHQL_METRICS_ENABLED', default=True, cast=bool),
+    # リゾルバ単位の計測を行うオペレーションの割合 (0.0 - 1.0)
+    "RESOLVER_SAMPLE_RATE": config('GRAPHQL_RESOLVER_SAMPLE_RATE', default=0.05, cast=float),
+    # True の場合、X-GraphQL-Tracing ヘッダ付きのリクエストに extensions.tracing を返す
+    "TRACING_ENABLED": config('GRAPHQL_TRACING_ENABLED', default=DEBUG, cast=bool),
+    # 設定した場合、/metrics は "Authorization: Bearer <token>" を要求する
+    # (未設定の場合はスタッフのユーザーのみ)
+    "METRICS_TOKEN": config('METRICS_TOKEN', default=''),
+    # True の場合 /graphql を非同期ビューで提供する (ASGI で起動する場合)
+    "ASYNC_VIEW": config('GRAPHQL_ASYNC_VIEW', default=False, cast=bool),
+    # 非同期ビューでリクエスト・トップレベルのフィールドを実行するスレッド数
+    "ASYNC_REQUEST_WORKERS": config('GRAPHQL_ASYNC_REQUEST_WORKERS', default=8, cast=int),
+    "ASYNC_FIELD_WORKERS": config('GRAPHQL_ASYNC_FIELD_WORKERS', default=8, cast=int),
+    # サブスクリプションの pub/sub バックエンド (単一ノードではプロセス内)
+    "PUBSUB_BACKEND": config('GRAPHQL_PUBSUB_BACKEND', default='blog.pubsub.InMemoryPubSub'),
+    # 発行された変更を購読ごとのクエリとして実行するスレッド数
+    "SUBSCRIPTION_WORKERS": config('GRAPHQL_SUBSCRIPTION_WORKERS', default=4, cast=int),
+    # ミューテーションの認証済み判定をキャッシュする秒数 (0 で無効)
+    "VERIFIED_CACHE_TIMEOUT": config('VERIFIED_CACHE_TIMEOUT', default=300, cast=int),
+    # 検証済み JWT のペイロードの LRU キャッシュ件数 (0 で無効)
+    "TOKEN_CACHE_SIZE": config('JWT_TOKEN_CACHE_SIZE', default=1024, cast=int),
+    # 書き込んだクライアントのクエリをプライマリから読む秒数
+    "REPLICA_PIN_SECONDS": config('REPLICA_PIN_SECONDS', default=5, cast=int),
+    # レプリカの死活 (と遅延) を確認する間隔の秒数
+    "REPLICA_HEALTH_CHECK_INTERVAL": config('REPLICA_HEALTH_CHECK_INTERVAL', default=10, cast=int),
+    # この秒数を超えて遅延したレプリカを外す (Postgres のみ、0 で無効)
+    "REPLICA_MAX_LAG": config('REPLICA_MAX_LAG', default=0, cast=int),
+    # RSS / Atom フィードのタイトルと記事数
+    "FEED_TITLE": config('FEED_TITLE', default='Blog'),
+    "FEED_SIZE": config('FEED_SIZE', default=20, cast=int),
+    # 記事のリンク (フロントエンド) とフィード・サイトマップ自身の URL (API)
+    "FEED_SITE_URL": config('FEED_SITE_URL', default='http://localhost:3000'),
+    "FEED_ARTICLE_PATH": config('FEED_ARTICLE_PATH', default='/articles/{id}'),
+    "FEED_API_URL": config('FEED_API_URL', default='http://localhost:8000'),
+    # サイトマップ 1 ページあたりの記事 ID の範囲 (記事の変更時はそのページのみ生成し直す)
+    "SITEMAP_PAGE_SIZE": config('SITEMAP_PAGE_SIZE', default=1000, cast=int),
+    # 生成済みのフィード・サイトマップを保持する秒数。再生成は書き込んだ
+    # プロセスのキャッシュにのみ反映されるため、プロセスごとのキャッシュ
+    # (既定の LocMemCache) では他のワーカーはこの秒数まで古い内容を返す
+    "FEED_CACHE_TIMEOUT": config('FEED_CACHE_TIMEOUT', default=300, cast=int),
 }
 
 AUTHENTICATION_BACKENDS = [
@@ -156,6 +265,7 @@ AUTHENTICATION_BACKENDS = [
 GRAPHQL_JWT = {
     "JWT_VERIFY_EXPIRATION": True,
     "JWT_LONG_RUNNING_REFRESH_TOKEN": True,
+    "JWT_DECODE_HANDLER": "graphql_api.authentication.jwt_decode",
     "JWT_ALLOW_ANY_CLASSES": [
         "graphql_auth.relay.Register",
         "graphql_auth.relay.VerifyAccount",
@@ -0,0 +1,786 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+import jwt
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core import signals
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection
+from django.test import (
+    RequestFactory, TestCase, TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from graphql import parse
+from graphql.validation import validate
+from graphql_jwt import utils as jwt_utils
+from graphql_jwt.shortcuts import get_token
+from rx.concurrency import immediate_scheduler
+
+from blog import pubsub
+from blog.counts import total_count
+from blog.models import Article, Comment, PersistedQuery, Tag
+from blog.tests import execute, global_id, make_user
+from blog.versions import get_versions
+
+from . import authentication, persisted, response_cache, routers
+from .backend import LRUCachedBackend, document_backend, document_hash
+from .concurrency import submit
+from .schema import schema
+from .validation import validation_rules
+from .views import AsyncBlogGraphQLView
+from .websocket import GraphQLWebSocket, SubscriptionContext
+
+TAGS_QUERY = '{ allTags { edges { node { name } } } }'
+
+
+class ETagTests(TestCase):
+    """GET のクエリの ETag と If-None-Match を確認する"""
+
+    def setUp(self):
+        Tag.objects.create(name='python')
+        cache.clear()
+
+    def get(self, query=TAGS_QUERY, **headers):
+        return self.client.get('/graphql', {'query': query}, **headers)
+
+    def test_not_modified_until_write(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(
+            self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Tag.objects.create(name='django')
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'django', response.content)
+
+    def test_user_status_changes_revalidate(self):
+        user = make_user('member', verified=False)
+        query = '{ users { edges { node { username verified } } } }'
+        response = self.get(query)
+        self.assertIn(b'"verified":false', response.content)
+        etag = response['ETag']
+        self.assertEqual(
+            self.get(query, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        user.status.verified = True
+        user.status.save()
+        response = self.get(query, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'"verified":true', response.content)
+
+    def test_lost_versions_do_not_revalidate(self):
+        etag = self.get()['ETag']
+        tag = Tag.objects.get()
+        tag.name = 'changed'
+        tag.save()
+        # 再起動・退避でバージョンが失われた後も、変更前の ETag に戻らない
+        cache.clear()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'changed', response.content)
+
+    def test_missing_versions_are_seeded_once(self):
+        first = get_versions(['blog.Tag'])
+        self.assertNotEqual(first['blog.Tag'], 0)
+        self.assertEqual(get_versions(['blog.Tag']), first)
+
+
+@override_settings(GRAPHQL_API=dict(
+    settings.GRAPHQL_API, RESPONSE_CACHE_TIMEOUT=60))
+class ReplicaCacheTests(TestCase):
+    """レプリカから読んだ結果をバージョンに結び付けないことを確認する"""
+
+    def setUp(self):
+        Tag.objects.create(name='python')
+        cache.clear()
+
+    def get(self, **headers):
+        return self.client.get('/graphql', {'query': TAGS_QUERY}, **headers)
+
+    def replica(self):
+        # テストのデータベースをレプリカとして扱う
+        return mock.patch.multiple(
+            routers, replica_aliases=mock.Mock(return_value=['replica']),
+            choose_replica=mock.Mock(return_value=DEFAULT_DB_ALIAS))
+
+    def test_replica_reads_are_not_cached(self):
+        with self.replica(), mock.patch.object(
+                response_cache, 'set_response') as set_response:
+            response = self.get()
+        self.assertEqual(response.status_code, 200)
+        set_response.assert_not_called()
+        # 内容のハッシュの ETag で、共有キャッシュには載せない
+        self.assertFalse(response['ETag'].startswith('"v-'))
+        self.assertIn('private', response['Cache-Control'])
+
+        etag = response['ETag']
+        with self.replica():
+            self.assertEqual(
+                self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_replica_counts_are_not_cached(self):
+        with routers.read_from(DEFAULT_DB_ALIAS):
+            self.assertEqual(total_count(Tag.objects.all()), 1)
+        # bulk_create は件数のバージョンを進めない
+        Tag.objects.bulk_create([Tag(name='django')])
+        self.assertEqual(total_count(Tag.objects.all()), 2)
+        Tag.objects.bulk_create([Tag(name='graphql')])
+        self.assertEqual(total_count(Tag.objects.all()), 2)
+
+    def test_primary_reads_are_cached(self):
+        with mock.patch.object(
+                response_cache, 'set_response') as set_response:
+            response = self.get()
+        set_response.assert_called_once()
+        self.assertTrue(response['ETag'].startswith('"v-'))
+
+
+class PersistedQueryTests(TestCase):
+    """永続化クエリの自動登録とメモの上限を確認する"""
+
+    def setUp(self):
+        cache.clear()
+        Tag.objects.create(name='python')
+        persisted._store = None
+
+    def tearDown(self):
+        persisted._store = None
+
+    def login(self, user):
+        # GraphQLAuthBackend はセッションのユーザーを主キーで読めない
+        self.client.force_login(
+            user, backend='django.contrib.auth.backends.ModelBackend')
+
+    def post(self, query=None, sha256_hash=None):
+        payload = {'extensions': {'persistedQuery': {
+            'version': 1, 'sha256Hash': sha256_hash or document_hash(query)}}}
+        if query is not None:
+            payload['query'] = query
+        return self.client.post(
+            '/graphql', payload, content_type='application/json')
+
+    def test_hash_only_then_register(self):
+        response = self.post(sha256_hash=document_hash(TAGS_QUERY))
+        self.assertIn(b'PersistedQueryNotFound', response.content)
+
+        self.login(make_user('member'))
+        response = self.post(TAGS_QUERY)
+        self.assertIn(b'python', response.content)
+        self.assertTrue(PersistedQuery.objects.filter(
+            sha256_hash=document_hash(TAGS_QUERY)).exists())
+
+        self.client.logout()
+        response = self.post(sha256_hash=document_hash(TAGS_QUERY))
+        self.assertIn(b'python', response.content)
+
+    def test_anonymous_queries_are_not_registered(self):
+        response = self.post(TAGS_QUERY)
+        self.assertIn(b'python', response.content)
+        self.assertFalse(PersistedQuery.objects.exists())
+
+    def test_registration_policy(self):
+        member = make_user('member')
+        for policy, registered in (('all', True), ('staff', False),
+                                   ('none', False)):
+            with self.subTest(policy), override_settings(GRAPHQL_API=dict(
+                    settings.GRAPHQL_API,
+                    PERSISTED_QUERIES_AUTO_REGISTER=policy)):
+                PersistedQuery.objects.all().delete()
+                persisted._store = None
+                self.login(member)
+                self.post(TAGS_QUERY)
+                self.assertEqual(
+                    PersistedQuery.objects.exists(), registered)
+
+    def test_memo_is_bounded(self):
+        store = persisted.DatabaseQueryStore(maxsize=2)
+        for i in range(4):
+            query = '{ allTags(first: %d) { totalCount } }' % (i + 1)
+            store.set(document_hash(query), query)
+        self.assertEqual(len(store._memo), 2)
+        # メモから外れたクエリもデータベースから読める
+        query = '{ allTags(first: 1) { totalCount } }'
+        self.assertEqual(store.get(document_hash(query)), query)
+        self.assertEqual(len(store._memo), 2)
+
+
+class FileQueryStoreTests(TestCase):
+    """複数のプロセスが同じファイルのストアを使う場合の読み直しと追記"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'queries.json')
+
+    def test_sees_queries_registered_elsewhere(self):
+        worker = persisted.FileQueryStore(self.path)
+        self.assertIsNone(worker.get('a'))
+        # register_persisted_queries などの別のプロセスで登録する
+        persisted.FileQueryStore(self.path).set('a', '{ a }')
+        self.assertEqual(worker.get('a'), '{ a }')
+
+    def test_concurrent_writers_keep_each_others_queries(self):
+        first = persisted.FileQueryStore(self.path)
+        second = persisted.FileQueryStore(self.path)
+        self.assertIsNone(first.get('a'))
+        self.assertIsNone(second.get('b'))
+        first.set('a', '{ a }')
+        second.set('b', '{ b }')
+        first.set('c', '{ c }')
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(
+                json.load(f), {'a': '{ a }', 'b': '{ b }', 'c': '{ c }'})
+        self.assertEqual(second.get('c'), '{ c }')
+
+
+class MetricsAccessTests(TestCase):
+    """/metrics はトークンまたはスタッフのみが読めることを確認する"""
+
+    def login(self, user):
+        self.client.force_login(
+            user, backend='django.contrib.auth.backends.ModelBackend')
+
+    def test_staff_only_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.login(make_user('member'))
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.login(make_user('staff', staff=True))
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+    @override_settings(GRAPHQL_API=dict(
+        settings.GRAPHQL_API, METRICS_TOKEN='secret'))
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class StreamingExportTests(TestCase):
+    """/export.ndjson を ASGI アプリケーション経由でストリーミングする"""
+
+    def setUp(self):
+        # テスト用のトランザクションを閉じないよう、test.Client と同じく
+        # リクエストの前後でコネクションを閉じない
+        signals.request_started.disconnect(close_old_connections)
+        signals.request_finished.disconnect(close_old_connections)
+        self.addCleanup(
+            signals.request_started.connect, close_old_connections)
+        self.addCleanup(
+            signals.request_finished.connect, close_old_connections)
+
+    def request(self, path, query_string=b'', headers=()):
+        from .asgi import application
+
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode('ascii'),
+            'root_path': '',
+            'query_string': query_string,
+            'headers': [(b'host', b'testserver')] + list(headers),
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 0),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(application)(scope, receive, send)
+        return messages
+
+    def test_export_streams_in_chunks(self):
+        staff = make_user('staff', staff=True)
+        names = ['tag%d' % i for i in range(5)]
+        Tag.objects.bulk_create(Tag(name=name) for name in names)
+        messages = self.request(
+            '/export.ndjson', b'types=tags',
+            [(b'authorization', ('JWT %s' % get_token(staff)).encode())])
+
+        start, *bodies = messages
+        self.assertEqual(start['type'], 'http.response.start')
+        self.assertEqual(start['status'], 200)
+        self.assertIn(
+            (b'Content-Type', b'application/x-ndjson; charset=utf-8'),
+            start['headers'])
+        # 1 行ずつ more_body で送り、最後に空の本文で終える
+        self.assertEqual(len(bodies), len(names) + 1)
+        self.assertTrue(all(m['more_body'] for m in bodies[:-1]))
+        self.assertFalse(bodies[-1].get('more_body', False))
+        lines = b''.join(m.get('body', b'') for m in bodies).splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], names)
+
+    def test_forbidden_is_not_streamed(self):
+        start, body = self.request('/export.ndjson')
+        self.assertEqual(start['status'], 403)
+        self.assertFalse(body.get('more_body', False))
+
+
+class QueryComplexityTests(TestCase):
+    """クエリの深さ・推定コストの上限と既定のページサイズを確認する"""
+
+    def errors(self, query):
+        return [error.message for error in validate(
+            schema, parse(query), validation_rules)]
+
+    def test_depth(self):
+        self.assertEqual(self.errors(TAGS_QUERY), [])
+        with override_settings(GRAPHQL_API=dict(
+                settings.GRAPHQL_API, MAX_QUERY_DEPTH=3)):
+            self.assertEqual(self.errors(TAGS_QUERY), [
+                'Operation "anonymous" has depth 4, which exceeds the '
+                'maximum depth of 3.'])
+
+    def test_cost(self):
+        query = """
+        { allArticles(first: %s) { edges { node {
+            articleComment(first: %s) { edges { node { userComment { id } } } }
+        } } } }
+        """
+        self.assertEqual(self.errors(query % (10, 10)), [])
+        [message] = self.errors(query % (100, 100))
+        self.assertIn('estimated cost of 30301', message)
+        [message] = self.errors(query % (101, 1))
+        self.assertIn('exceeds the `first` limit of 100', message)
+
+    def test_variables_cost_the_maximum_page_size(self):
+        # 変数の既定値は実行時に上書きできるため、コストの計算に使わない
+        query = """
+        query($n: Int = 1) { allArticles(first: $n) { edges { node {
+            articleComment(first: $n) { edges { node { userComment { id } } } }
+        } } } }
+        """
+        [message] = self.errors(query)
+        self.assertIn('estimated cost of 30301', message)
+
+    def test_default_page_size_on_generated_connections(self):
+        page_size = settings.GRAPHQL_API['DEFAULT_PAGE_SIZE']
+        author = make_user('author')
+        tag = Tag.objects.create(name='tag')
+        for i in range(page_size + 5):
+            make_user('user%d' % i)
+            Article.objects.create(
+                user_article=author, title='a%d' % i).tags.add(tag)
+
+        data = execute("""
+        { allTags { edges { node {
+            tagArticle { edges { node { id } } pageInfo { hasNextPage } }
+        } } } }
+        """)
+        tag_article = data['allTags']['edges'][0]['node']['tagArticle']
+        self.assertEqual(len(tag_article['edges']), page_size)
+        self.assertTrue(tag_article['pageInfo']['hasNextPage'])
+
+        data = execute("""
+        { users { edges { node {
+            userArticle { edges { node { id } } }
+        } } } }
+        """)
+        self.assertEqual(len(data['users']['edges']), page_size)
+        self.assertEqual(
+            len(data['users']['edges'][0]['node']['userArticle']['edges']),
+            page_size)
+
+
+COMMENT_CHANGED = """
+subscription($id: ID!) {
+  commentChanged(articleId: $id) { action comment { text } }
+}
+"""
+
+
+class RecordingWebSocket(GraphQLWebSocket):
+    """送信キューの代わりに送ったメッセージを記録する"""
+
+    def __init__(self, user):
+        self.context = SubscriptionContext(user)
+        self.operations = {}
+        self.messages = []
+
+    def post(self, type, id=None, payload=None):
+        self.messages.append((type, id, payload))
+
+
+class WebSocketTests(TestCase):
+    """/graphql の WebSocket のプロトコルとコメントの発行を確認する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('author')
+        cls.article = Article.objects.create(
+            user_article=cls.user, title='t', is_release=True)
+
+    def setUp(self):
+        # 発行をその場で配信し、ワーカースレッドの接続管理は呼び出しだけを
+        # 記録する (テストのトランザクションを閉じないため)
+        patches = [
+            mock.patch.object(pubsub, '_pubsub', pubsub.InMemoryPubSub()),
+            mock.patch.object(pubsub, '_scheduler', immediate_scheduler),
+            mock.patch.object(
+                persisted, '_store', persisted.DatabaseQueryStore()),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        patch = mock.patch('blog.pubsub.close_old_connections')
+        self.close_old_connections = patch.start()
+        self.addCleanup(patch.stop)
+
+    def connect(self, messages, subprotocols=('graphql-ws',)):
+        from .asgi import application
+
+        scope = {
+            'type': 'websocket',
+            'path': '/graphql',
+            'headers': [],
+            'subprotocols': list(subprotocols),
+        }
+        incoming = [{'type': 'websocket.connect'}] + [
+            {'type': 'websocket.receive', 'text': text}
+            for text in messages]
+        sent = []
+
+        async def receive():
+            # 送信キューを書き出す間を空ける
+            await asyncio.sleep(0.05)
+            if incoming:
+                return incoming.pop(0)
+            return {'type': 'websocket.disconnect', 'code': 1000}
+
+        async def send(message):
+            sent.append(message)
+
+        async_to_sync(application)(scope, receive, send)
+        return sent
+
+    def start(self, query, operation_id='1', **payload):
+        ws = RecordingWebSocket(self.user)
+        payload.setdefault('variables', {'id': global_id(self.article)})
+        ws.start(operation_id, dict(payload, query=query))
+        return ws
+
+    def test_handshake(self):
+        self.assertEqual(self.connect([], subprotocols=()), [
+            {'type': 'websocket.close', 'code': 1002}])
+        sent = self.connect([
+            json.dumps({'type': 'connection_init', 'payload': {}}),
+            'not json',
+            json.dumps({'type': 'connection_terminate'}),
+        ])
+        self.assertEqual(sent[0], {
+            'type': 'websocket.accept', 'subprotocol': 'graphql-ws'})
+        self.assertEqual(
+            [json.loads(m['text']) for m in sent[1:-1]],
+            [{'type': 'connection_ack'},
+             {'type': 'error', 'payload': {'message': 'Invalid message.'}}])
+        self.assertEqual(sent[-1], {'type': 'websocket.close', 'code': 1000})
+
+    def test_rejects_queries_and_mutations(self):
+        mutation = 'mutation { createTag(input: {name: "x"}) { tag { id } } }'
+        for query in (TAGS_QUERY, mutation):
+            with self.subTest(query):
+                ws = self.start(query, variables={})
+                self.assertEqual(ws.messages, [('error', '1', {
+                    'message': 'Only subscription operations are supported '
+                               'over WebSocket.'})])
+                self.assertEqual(ws.operations, {})
+        self.assertFalse(Tag.objects.exists())
+
+    @override_settings(GRAPHQL_API=dict(
+        settings.GRAPHQL_API, PERSISTED_QUERIES_STRICT=True))
+    def test_strict_persisted_queries(self):
+        ws = self.start(COMMENT_CHANGED)
+        self.assertEqual(ws.messages, [
+            ('error', '1', {'message': 'PersistedQueryNotAllowed'})])
+
+        sha256_hash = document_hash(COMMENT_CHANGED)
+        ws = self.start(None, extensions={
+            'persistedQuery': {'version': 1, 'sha256Hash': sha256_hash}})
+        self.assertEqual(ws.messages, [
+            ('error', '1', {'message': 'PersistedQueryNotFound'})])
+
+        persisted.get_query_store().set(sha256_hash, COMMENT_CHANGED)
+        ws = self.start(None, extensions={
+            'persistedQuery': {'version': 1, 'sha256Hash': sha256_hash}})
+        self.assertEqual(ws.messages, [])
+        self.assertEqual(list(ws.operations), ['1'])
+        ws.stop('1')
+
+    def test_publish(self):
+        ws = self.start(COMMENT_CHANGED)
+        self.assertEqual(ws.messages, [])
+        comment = Comment.objects.create(
+            user_comment=self.user, article_comment=self.article, text='hi')
+        with self.captureOnCommitCallbacks(execute=True):
+            pubsub.publish_comment(pubsub.COMMENT_CREATED, comment)
+        self.assertEqual(ws.messages, [('data', '1', {'data': {
+            'commentChanged': {'action': 'CREATED', 'comment': {'text': 'hi'}},
+        }})])
+        # 購読ごとのクエリの前後で古い接続を閉じる
+        self.assertEqual(self.close_old_connections.call_count, 2)
+
+        # 他の記事と購読をやめた後の発行は届かない
+        other = Article.objects.create(user_article=self.user, title='o')
+        with self.captureOnCommitCallbacks(execute=True):
+            pubsub.publish_comment(pubsub.COMMENT_DELETED, Comment(
+                pk=1, article_comment=other))
+        ws.stop('1')
+        with self.captureOnCommitCallbacks(execute=True):
+            pubsub.publish_comment(pubsub.COMMENT_UPDATED, comment)
+        self.assertEqual(len(ws.messages), 1)
+
+
+LIKE_MUTATION = """
+mutation($id: ID!) { %s(input: {id: $id}) {
+  article { liked { edges { node { username } } } }
+} }
+"""
+
+
+class BatchTests(TestCase):
+    """JSON 配列のバッチ (件数の上限・1 件ごとのエラー・ローダーの破棄)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('author')
+        cls.article = Article.objects.create(
+            user_article=cls.user, title='t', is_release=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def post(self, body, **headers):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        return self.client.post(
+            '/graphql', body, content_type='application/json', **headers)
+
+    def test_batch(self):
+        response = self.post([
+            {'id': 'a', 'query': TAGS_QUERY},
+            {'id': 'b', 'query': '{ allTags { edges { node { missing } } } }'},
+            {'id': 'c', 'query': '{ allArticles { totalCount } }'},
+        ])
+        # 全体のステータスは graphene-django と同じく最も大きいもの
+        self.assertEqual(response.status_code, 400)
+        a, b, c = response.json()
+        self.assertEqual(
+            (a['id'], a['status'], a['data']), ('a', 200, {
+                'allTags': {'edges': []}}))
+        # 1 件のエラーで他のオペレーションは失敗しない
+        self.assertEqual((b['id'], b['status']), ('b', 400))
+        self.assertTrue(b['errors'])
+        self.assertEqual(c['data'], {'allArticles': {'totalCount': 1}})
+
+    def test_malformed_batches(self):
+        max_batch_size = settings.GRAPHQL_API['MAX_BATCH_SIZE']
+        for body in ([{'query': TAGS_QUERY}] * (max_batch_size + 1),
+                     [1, 2], [{'query': TAGS_QUERY}, None], [], '[1,'):
+            with self.subTest(body):
+                self.assertEqual(self.post(body).status_code, 400)
+
+    def test_loaders_are_cleared_after_mutation(self):
+        # ルートのクエリは prefetch するため、ローダーはミューテーションの
+        # 結果で使われる
+        variables = {'id': global_id(self.article)}
+        response = self.post([
+            {'query': LIKE_MUTATION % 'likeArticle', 'variables': variables},
+            {'query': LIKE_MUTATION % 'unlikeArticle', 'variables': variables},
+        ], HTTP_AUTHORIZATION='JWT %s' % get_token(self.user))
+
+        def liked(result):
+            [payload] = result['data'].values()
+            return [edge['node']['username']
+                    for edge in payload['article']['liked']['edges']]
+        like, unlike = response.json()
+        self.assertEqual(liked(like), ['author'])
+        self.assertEqual(liked(unlike), [])
+
+
+class TokenCacheTests(TestCase):
+    """検証済みトークンの LRU (ヒット・有効期限・不正なトークン)"""
+
+    def setUp(self):
+        authentication.token_cache.cache_clear()
+        self.addCleanup(authentication.token_cache.cache_clear)
+        patch = mock.patch.object(
+            jwt_utils, 'jwt_decode', wraps=jwt_utils.jwt_decode)
+        self.decode = patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_hits(self):
+        token = get_token(make_user('member'))
+        first = authentication.jwt_decode(token)
+        self.assertEqual(authentication.jwt_decode(token), first)
+        self.assertEqual(self.decode.call_count, 1)
+        info = authentication.token_cache.cache_info()
+        self.assertEqual((info['hits'], info['misses']), (1, 1))
+
+    def test_reuse_ends_at_expiry(self):
+        token = get_token(make_user('member'))
+        payload = authentication.jwt_decode(token)
+        # 有効期限を過ぎたエントリは使わず、改めて検証する
+        with mock.patch.object(
+                authentication.time, 'time',
+                return_value=payload['exp'] + 3600):
+            authentication.jwt_decode(token)
+        self.assertEqual(self.decode.call_count, 2)
+
+    def test_invalid_tokens_are_not_cached(self):
+        expired = jwt_utils.jwt_encode(
+            {'username': 'member', 'exp': int(time.time()) - 3600})
+        for token in ('not-a-token', expired):
+            with self.subTest(token):
+                for _ in range(2):
+                    with self.assertRaises(jwt.InvalidTokenError):
+                        authentication.jwt_decode(token)
+        self.assertEqual(self.decode.call_count, 4)
+        self.assertEqual(
+            authentication.token_cache.cache_info()['currsize'], 0)
+
+    def test_eviction(self):
+        lru = authentication.TokenCache(maxsize=2)
+        lru.set('a', {'n': 1}, None)
+        lru.set('b', {'n': 2}, None)
+        lru.get('a')
+        lru.set('c', {'n': 3}, None)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), {'n': 1})
+        self.assertEqual(lru.get('c'), {'n': 3})
+        lru.set('d', {'n': 4}, time.time() - 1)
+        self.assertIsNone(lru.get('d'))
+
+
+class DocumentCacheTests(TestCase):
+    """パース・検証済みドキュメントの LRU (ヒット・ミス・追い出し)"""
+
+    def test_hits_misses_and_eviction(self):
+        backend = LRUCachedBackend(maxsize=2)
+        queries = [TAGS_QUERY, '{ allTags { totalCount } }',
+                   '{ allArticles { totalCount } }']
+        first = backend.document_from_string(schema, queries[0])
+        self.assertIs(backend.document_from_string(schema, queries[0]), first)
+        self.assertEqual(backend.cache_info(), {
+            'hits': 1, 'misses': 1, 'maxsize': 2, 'currsize': 1})
+
+        backend.document_from_string(schema, queries[1])
+        # queries[0] を使ったので、追い出されるのは queries[1]
+        backend.document_from_string(schema, queries[0])
+        backend.document_from_string(schema, queries[2])
+        self.assertEqual(backend.cache_info()['currsize'], 2)
+        self.assertIs(backend.document_from_string(schema, queries[0]), first)
+        misses = backend.cache_info()['misses']
+        backend.document_from_string(schema, queries[1])
+        self.assertEqual(backend.cache_info()['misses'], misses + 1)
+
+        backend.cache_clear()
+        self.assertEqual(backend.cache_info(), {
+            'hits': 0, 'misses': 0, 'maxsize': 2, 'currsize': 0})
+
+    def test_invalid_documents_are_cached(self):
+        backend = LRUCachedBackend(maxsize=2)
+        query = '{ allTags { edges { node { missing } } } }'
+        with mock.patch(
+                'graphql_api.backend.validate',
+                wraps=validate) as validate_mock:
+            for _ in range(2):
+                result = backend.document_from_string(
+                    schema, query).execute()
+                self.assertTrue(result.invalid)
+        validate_mock.assert_called_once()
+
+
+@override_settings(GRAPHQL_API=dict(
+    settings.GRAPHQL_API, RESPONSE_CACHE_TIMEOUT=60))
+class ResponseCacheTests(TestCase):
+    """匿名の読み取りクエリのレスポンスキャッシュと書き込みでの無効化"""
+
+    def setUp(self):
+        Tag.objects.create(name='python')
+        cache.clear()
+
+    def post(self, query=TAGS_QUERY, **headers):
+        return self.client.post(
+            '/graphql', {'query': query}, content_type='application/json',
+            **headers)
+
+    def test_cached_until_write(self):
+        first = self.post()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.post().content, first.content)
+
+        for write in (lambda: Tag.objects.create(name='django'),
+                      lambda: Tag.objects.filter(name='django').delete()):
+            write()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post()
+            self.assertTrue(queries)
+            self.assertEqual(
+                b'django' in response.content, Tag.objects.filter(
+                    name='django').exists())
+
+    def test_unrelated_writes_keep_the_cache(self):
+        self.post()
+        Comment.objects.create(
+            user_comment=make_user('author'), text='x',
+            article_comment=Article.objects.create(
+                user_article=make_user('other'), title='t'))
+        with self.assertNumQueries(0):
+            self.post()
+
+    def test_only_anonymous_reads_are_cached(self):
+        user = make_user('member')
+        headers = {'HTTP_AUTHORIZATION': 'JWT %s' % get_token(user)}
+        with mock.patch.object(
+                response_cache, 'set_response') as set_response:
+            self.post(**headers)
+            self.post(
+                'mutation { createTag(input: {name: "x"}) { tag { id } } }')
+        set_response.assert_not_called()
+
+
+class AsyncViewTests(TransactionTestCase):
+    """ASGI 用のビューがトップレベルのフィールドを並行に実行する
+
+    フィールドは別スレッドの接続で読むため、コミット済みのデータを使う。
+    """
+
+    def test_split_root_fields(self):
+        Tag.objects.create(name='python')
+        Article.objects.create(
+            user_article=make_user('author'), title='t', is_release=True)
+        view = AsyncBlogGraphQLView.as_view(backend=document_backend)
+        request = RequestFactory().post(
+            '/graphql', json.dumps({'query': """
+            { allTags { edges { node { name } } }
+              allArticles { edges { node { title } } } }
+            """}), content_type='application/json')
+
+        with mock.patch(
+                'graphql_api.views.submit', wraps=submit) as submit_mock:
+            response = async_to_sync(view)(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'data': {
+            'allTags': {'edges': [{'node': {'name': 'python'}}]},
+            'allArticles': {'edges': [{'node': {'title': 't'}}]},
+        }})
+        self.assertEqual(
+            [call.args[0] for call in submit_mock.call_args_list],
+            ['field', 'field'])
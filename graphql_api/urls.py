@@ -13,14 +13,34 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
 
-from graphene_django.views import GraphQLView
 from decouple import config
 
+from blog.views import export_view, feed_view, sitemap_view
+
+from .backend import document_backend
+from .views import AsyncBlogGraphQLView, BlogGraphQLView, metrics_view
+
+if settings.GRAPHQL_API['ASYNC_VIEW']:
+    graphql_view = AsyncBlogGraphQLView.as_view(
+        graphiql=True, backend=document_backend)
+    # csrf_exempt は同期関数で包んでしまうため属性を直接設定する
+    graphql_view.csrf_exempt = True
+else:
+    graphql_view = csrf_exempt(BlogGraphQLView.as_view(
+        graphiql=True, backend=document_backend))
+
 urlpatterns = [
     path(str(config('ADMIN_SITE_URL', default='admin/')), admin.site.urls),
-    path("graphql", csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path("graphql", graphql_view),
+    path("metrics", metrics_view),
+    path("export.ndjson", export_view),
+    path("feeds/articles.<str:fmt>", feed_view),
+    path("feeds/tags/<int:tag_id>.<str:fmt>", feed_view),
+    path("sitemap.xml", sitemap_view),
+    path("sitemap-<int:page>.xml", sitemap_view),
 ]
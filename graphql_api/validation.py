@@ -0,0 +1,132 @@
+from django.conf import settings
+from graphene.relay import Connection
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError
+from graphql.language import ast
+from graphql.type.definition import GraphQLList, GraphQLNonNull
+from graphql.validation.rules import specified_rules
+from graphql.validation.rules.base import ValidationRule
+
+PAGE_ARGUMENTS = ('first', 'last')
+
+
+def _unwrap(_type):
+    while isinstance(_type, (GraphQLList, GraphQLNonNull)):
+        _type = _type.of_type
+    return _type
+
+
+def _is_connection(_type):
+    graphene_type = getattr(_type, 'graphene_type', None)
+    return isinstance(graphene_type, type) and issubclass(
+        graphene_type, Connection)
+
+
+class QueryComplexityRule(ValidationRule):
+    """実行前にクエリの深さと推定コストを計算し、上限を超えるドキュメントを拒否する
+
+    コネクションのコストは「重み + ページサイズ × 子のコスト」とする。
+    ページサイズは first / last のリテラル値、未指定の場合は既定のページ
+    サイズを使う。検証結果は変数なしでキャッシュされ、変数の既定値は実行時に
+    上書きできるため、変数の場合は常に最大ページサイズとする。
+    """
+
+    def __init__(self, context):
+        super(QueryComplexityRule, self).__init__(context)
+        options = settings.GRAPHQL_API
+        self.max_depth = options['MAX_QUERY_DEPTH']
+        self.max_cost = options['MAX_QUERY_COST']
+        self.weights = options['QUERY_COST_WEIGHTS']
+        self.max_page_size = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        self.default_page_size = options['DEFAULT_PAGE_SIZE']
+        if self.max_page_size:
+            self.default_page_size = min(
+                self.default_page_size, self.max_page_size)
+
+    def enter_OperationDefinition(self, node, key, parent, path, ancestors):
+        schema = self.context.get_schema()
+        root_type = {
+            'query': schema.get_query_type,
+            'mutation': schema.get_mutation_type,
+            'subscription': schema.get_subscription_type,
+        }[node.operation]()
+        if root_type is None:
+            return
+        depth, cost = self.measure(root_type, node.selection_set, set())
+        name = node.name.value if node.name else 'anonymous'
+        if self.max_depth and depth > self.max_depth:
+            self.context.report_error(GraphQLError(
+                'Operation "%s" has depth %d, which exceeds the maximum '
+                'depth of %d.' % (name, depth, self.max_depth), [node]))
+        if self.max_cost and cost > self.max_cost:
+            self.context.report_error(GraphQLError(
+                'Operation "%s" has an estimated cost of %d, which exceeds '
+                'the maximum cost of %d.' % (name, cost, self.max_cost),
+                [node]))
+
+    def page_size(self, field):
+        sizes = []
+        for argument in field.arguments or []:
+            if argument.name.value not in PAGE_ARGUMENTS:
+                continue
+            value = argument.value
+            if isinstance(value, ast.Variable):
+                sizes.append(self.max_page_size or self.default_page_size)
+            elif isinstance(value, ast.IntValue):
+                size = int(value.value)
+                if self.max_page_size and size > self.max_page_size:
+                    self.context.report_error(GraphQLError(
+                        'Requesting %d records on the `%s` connection exceeds '
+                        'the `%s` limit of %d records.' % (
+                            size, field.name.value, argument.name.value,
+                            self.max_page_size), [argument]))
+                    size = self.max_page_size
+                sizes.append(size)
+        return max(sizes) if sizes else self.default_page_size
+
+    def measure(self, parent_type, selection_set, fragments):
+        """選択セットの (深さ, コスト) を返す"""
+        depth = cost = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                name = selection.name.value
+                field = getattr(parent_type, 'fields', {}).get(name)
+                if field is None or name.startswith('__'):
+                    continue
+                field_type = _unwrap(field.type)
+                if selection.selection_set is None:
+                    cost += self.weights.get('%s.%s' % (parent_type, name), 0)
+                    depth = max(depth, 1)
+                    continue
+                weight = self.weights.get('%s.%s' % (parent_type, name), 1)
+                child_depth, child_cost = self.measure(
+                    field_type, selection.selection_set, fragments)
+                if _is_connection(field_type):
+                    child_cost *= self.page_size(selection)
+                depth = max(depth, child_depth + 1)
+                cost += weight + child_cost
+            else:
+                spread_fragments = fragments
+                if isinstance(selection, ast.FragmentSpread):
+                    name = selection.name.value
+                    # 循環は NoFragmentCycles が報告する
+                    if name in fragments:
+                        continue
+                    selection = self.context.get_fragment(name)
+                    if selection is None:
+                        continue
+                    spread_fragments = fragments | {name}
+                type_condition = selection.type_condition
+                fragment_type = parent_type
+                if type_condition:
+                    fragment_type = self.context.get_schema().get_type(
+                        type_condition.name.value)
+                child_depth, child_cost = self.measure(
+                    fragment_type or parent_type, selection.selection_set,
+                    spread_fragments)
+                depth = max(depth, child_depth)
+                cost += child_cost
+        return depth, cost
+
+
+validation_rules = list(specified_rules) + [QueryComplexityRule]
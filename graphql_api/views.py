@@ -0,0 +1,406 @@
+import copy
+import hashlib
+import hmac
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.http.response import HttpResponseBadRequest
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql.execution import ExecutionResult, execute
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.utils import get_http_authorization
+
+from blog.loaders import clear_loaders
+from blog.versions import get_versions
+
+from . import metrics, response_cache, routers
+from .authentication import authenticate_request
+from .backend import document_hash
+from .concurrency import run_in_pool, split_root_fields, submit
+from .instrumentation import instrument, track_sql
+from .persisted import get_query_store
+
+
+class BlogGraphQLView(GraphQLView):
+    """永続化クエリ・バッチ・レスポンスキャッシュ・ETag に対応した GraphQLView"""
+
+    def parse_body(self, request):
+        # JSON 配列はバッチとして扱い、同じリクエスト (認証・ローダー・DB 接続)
+        # の中で順に実行する
+        if (self.get_content_type(request) == 'application/json'
+                and request.body.lstrip()[:1] == b'['):
+            self.batch = True
+        data = super(BlogGraphQLView, self).parse_body(request)
+        max_batch_size = settings.GRAPHQL_API['MAX_BATCH_SIZE']
+        if self.batch and len(data) > max_batch_size:
+            raise HttpError(HttpResponseBadRequest(
+                "Batch size exceeds the maximum of %d." % max_batch_size))
+        if self.batch and not all(isinstance(entry, dict) for entry in data):
+            raise HttpError(HttpResponseBadRequest(
+                "Each operation in a batch must be a JSON object."))
+        return data
+
+    def get_persisted_query(self, request, data):
+        extensions = request.GET.get('extensions') or data.get('extensions')
+        if not extensions:
+            return None
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest(
+                    "Extensions are invalid JSON."))
+        persisted_query = extensions.get('persistedQuery')
+        if not persisted_query:
+            return None
+        if persisted_query.get('version') != 1:
+            raise HttpError(HttpResponseBadRequest(
+                "Unsupported persisted query version."))
+        return persisted_query.get('sha256Hash')
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super(
+            BlogGraphQLView, self).get_graphql_params(request, data)
+        strict = settings.GRAPHQL_API['PERSISTED_QUERIES_STRICT']
+        sha256_hash = self.get_persisted_query(request, data)
+        store = get_query_store()
+
+        if sha256_hash is None:
+            if strict and query and store.get(document_hash(query)) is None:
+                raise HttpError(HttpResponse(status=200),
+                                "PersistedQueryNotAllowed")
+            return query, variables, operation_name, id
+
+        if not query:
+            query = store.get(sha256_hash)
+            if query is None:
+                raise HttpError(HttpResponse(status=200),
+                                "PersistedQueryNotFound")
+        elif document_hash(query) != sha256_hash:
+            raise HttpError(HttpResponseBadRequest(
+                "Provided sha256Hash does not match query."))
+        elif store.get(sha256_hash) is None:
+            if strict:
+                raise HttpError(HttpResponse(status=200),
+                                "PersistedQueryNotAllowed")
+            if self.can_register_query(request):
+                store.set(sha256_hash, query)
+
+        return query, variables, operation_name, id
+
+    def can_register_query(self, request):
+        """未登録のクエリを自動登録できるクライアントか
+
+        任意のクライアントに登録させると、ストアとプロセスのメモリが際限なく
+        増えるため、PERSISTED_QUERIES_AUTO_REGISTER で対象を絞る。
+        """
+        policy = settings.GRAPHQL_API['PERSISTED_QUERIES_AUTO_REGISTER']
+        if policy in ('all', 'none'):
+            return policy == 'all'
+        try:
+            authenticate_request(request)
+        except JSONWebTokenError:
+            return False
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return False
+        return policy == 'authenticated' or user.is_staff
+
+    def get_auth_scope(self, request):
+        """キャッシュを共有できる認証スコープ (現状は匿名ユーザーのみ)"""
+        if get_http_authorization(request) is not None:
+            return None
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return None
+        return 'anonymous'
+
+    def get_cacheable_document(self, request, query, operation_name,
+                               show_graphiql):
+        """匿名の読み取りクエリなら (ドキュメント, スコープ, 依存モデル) を返す"""
+        if show_graphiql or self.batch or not query:
+            return None
+        scope = self.get_auth_scope(request)
+        if scope is None:
+            return None
+        try:
+            document = self.get_backend(request).document_from_string(
+                self.schema, query)
+        except Exception:
+            return None
+        if document.get_operation_type(operation_name) != 'query':
+            return None
+        dependencies = response_cache.document_dependencies(document)
+        if not dependencies:
+            return None
+        return document, [scope, bool(request.GET.get('pretty'))], dependencies
+
+    def get_etag(self, key, versions):
+        payload = json.dumps([key, versions], sort_keys=True)
+        return '"v-%s"' % hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def set_conditional_headers(self, request, etag, public):
+        request.graphql_etag = etag
+        request.graphql_cache_control = (
+            settings.GRAPHQL_API['PUBLIC_CACHE_CONTROL'] if public
+            else 'private, no-cache')
+
+    def is_not_modified(self, request, etag):
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        return etag in if_none_match or '*' in if_none_match
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super(BlogGraphQLView, self).dispatch(
+            request, *args, **kwargs)
+        routers.set_pin_cookie(request, response)
+        etag = getattr(request, 'graphql_etag', None)
+        if etag is not None and response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Cache-Control'] = request.graphql_cache_control
+            patch_vary_headers(response, ('Authorization', 'Cookie'))
+        return response
+
+    def get_response(self, request, data, show_graphiql=False):
+        if not self.batch:
+            return self.get_operation_response(request, data, show_graphiql)
+        # バッチ内の 1 件の失敗で全体を失敗させない
+        try:
+            return self.get_operation_response(request, data, show_graphiql)
+        except HttpError as e:
+            status_code = e.response.status_code
+            return self.json_encode(request, {
+                "errors": [self.format_error(e)],
+                "id": data.get('id'),
+                "status": status_code,
+            }), status_code
+
+    def get_operation_type(self, request, query, operation_name):
+        try:
+            document = self.get_backend(request).document_from_string(
+                self.schema, query)
+        except Exception:
+            return None
+        return document.get_operation_type(operation_name)
+
+    def get_read_alias(self, request, operation_type):
+        """クエリはレプリカ、それ以外と書き込み直後のクライアントはプライマリ
+        (None) から読む"""
+        if operation_type != 'query' or not routers.replica_aliases():
+            return None
+        # トークンのクライアントもユーザーで固定を判定できるよう先に認証する
+        try:
+            authenticate_request(request)
+        except JSONWebTokenError:
+            pass
+        if routers.is_pinned(request):
+            return None
+        alias = routers.choose_replica()
+        request.graphql_read_alias = alias
+        return alias
+
+    def execute_graphql_request(self, request, data, query, variables,
+                                operation_name, show_graphiql=False):
+        operation_type = self.get_operation_type(
+            request, query, operation_name)
+        with routers.read_from(self.get_read_alias(request, operation_type)):
+            result = super(BlogGraphQLView, self).execute_graphql_request(
+                request, data, query, variables, operation_name,
+                show_graphiql)
+        if operation_type == 'mutation':
+            if routers.replica_aliases():
+                routers.pin_to_primary(request)
+            if self.batch:
+                # 後続のオペレーションが書き込み前のキャッシュを読まないようにする
+                clear_loaders(self.get_context(request))
+        return result
+
+    def get_operation_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(
+            request, data)
+
+        is_get = request.method.lower() == 'get' and not self.batch
+        cacheable = self.get_cacheable_document(
+            request, query, operation_name, show_graphiql)
+        if cacheable is not None:
+            document, scope, dependencies = cacheable
+            key = response_cache.cache_key(
+                document, variables, operation_name, scope)
+            versions = get_versions(dependencies)
+            if is_get:
+                etag = self.get_etag(key, versions)
+                self.set_conditional_headers(request, etag, public=True)
+                if self.is_not_modified(request, etag):
+                    return '', 304
+            if settings.GRAPHQL_API['RESPONSE_CACHE_TIMEOUT']:
+                cached = response_cache.get_response(key)
+                if cached is not None:
+                    return cached
+
+        request.graphql_read_alias = None
+        with instrument(request, operation_name) as trace:
+            execution_result = self.execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+        tracing = trace is not None and trace.tracing
+        # レプリカの結果は遅延で書き込み前の内容のことがあるため、バージョン
+        # (書き込み時に進む) に結び付けてキャッシュ・ETag にしない
+        if request.graphql_read_alias is not None:
+            cacheable = None
+            request.graphql_etag = None
+
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if execution_result:
+            response = {}
+
+            if execution_result.errors:
+                set_rollback()
+                request.graphql_etag = None
+                response["errors"] = [
+                    self.format_error(e) for e in execution_result.errors
+                ]
+
+            if execution_result.invalid:
+                status_code = 400
+            else:
+                response["data"] = execution_result.data
+
+            if tracing:
+                response["extensions"] = {"tracing": trace.as_tracing()}
+
+            if self.batch:
+                response["id"] = id
+                response["status"] = status_code
+
+            result = self.json_encode(request, response, pretty=show_graphiql)
+
+            if (cacheable is not None and not execution_result.errors
+                    and not tracing
+                    and settings.GRAPHQL_API['RESPONSE_CACHE_TIMEOUT']):
+                response_cache.set_response(key, versions, result, status_code)
+
+            if (is_get and cacheable is None and status_code == 200
+                    and not tracing):
+                etag = '"%s"' % hashlib.sha256(
+                    result.encode('utf-8')).hexdigest()
+                self.set_conditional_headers(request, etag, public=False)
+                if self.is_not_modified(request, etag):
+                    return '', 304
+        else:
+            result = None
+
+        return result, status_code
+
+
+class AsyncBlogGraphQLView(BlogGraphQLView):
+    """ASGI 用の非同期ビュー
+
+    リクエストの処理全体をスレッドプールで実行してイベントループを塞がず、
+    クエリのトップレベルのフィールドは別のプールで並行に実行する。
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super(AsyncBlogGraphQLView, cls).as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            return await run_in_pool('request', view, request, *args, **kwargs)
+
+        async_view.view_class = view.view_class
+        async_view.view_initkwargs = view.view_initkwargs
+        return async_view
+
+    def get_field_context(self, request):
+        """フィールドごとに別スレッドで使うため、ローダーを共有しないコンテキスト"""
+        context = copy.copy(request)
+        context.loaders = None
+        context.graphql_trace = None
+        return context
+
+    def execute_graphql_request(self, request, data, query, variables,
+                                operation_name, show_graphiql=False):
+        fields = None
+        if query and not show_graphiql:
+            try:
+                document = self.get_backend(request).document_from_string(
+                    self.schema, query)
+            except Exception:
+                document = None
+            if document is not None and not getattr(document, 'errors', True):
+                fields = split_root_fields(
+                    document.document_ast, operation_name)
+        if not fields:
+            return super(AsyncBlogGraphQLView, self).execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql)
+
+        # 分割したフィールドごとに認証しないよう、先にリクエストで 1 回行う。
+        # 失敗した場合は各フィールドのミドルウェアがエラーを返す
+        try:
+            authenticate_request(request)
+        except JSONWebTokenError:
+            pass
+        trace = getattr(request, 'graphql_trace', None)
+        alias = self.get_read_alias(request, 'query')
+        futures = [
+            submit('field', self.execute_root_field, document_ast,
+                   self.get_field_context(request), variables,
+                   operation_name, trace, alias)
+            for document_ast in fields
+        ]
+        data, errors, invalid = {}, [], False
+        for future in futures:
+            result = future.result()
+            errors.extend(result.errors or [])
+            invalid = invalid or result.invalid
+            if result.data is None:
+                data = None
+            elif data is not None:
+                data.update(result.data)
+        return ExecutionResult(
+            data=data, errors=errors or None, invalid=invalid)
+
+    def execute_root_field(self, document_ast, context, variables,
+                           operation_name, trace, alias=None):
+        try:
+            with routers.read_from(alias), track_sql(trace):
+                return execute(
+                    self.schema,
+                    document_ast,
+                    root_value=self.get_root_value(context),
+                    context_value=context,
+                    variable_values=variables,
+                    operation_name=operation_name,
+                    middleware=self.get_middleware(context),
+                )
+        except Exception as e:
+            return ExecutionResult(errors=[e], invalid=True)
+
+
+def can_read_metrics(request):
+    """METRICS_TOKEN を設定した場合はそのトークン、未設定ならスタッフのみ"""
+    token = settings.GRAPHQL_API['METRICS_TOKEN']
+    if token:
+        return hmac.compare_digest(
+            request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token)
+    try:
+        authenticate_request(request)
+    except JSONWebTokenError:
+        return False
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
+
+
+def metrics_view(request):
+    """Prometheus のテキスト形式でプロセス内の集計を返す"""
+    if not can_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        metrics.registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
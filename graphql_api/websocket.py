@@ -0,0 +1,220 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from graphql import GraphQLError
+from graphql.error import format_error
+from graphql.execution import ExecutionResult
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.utils import get_payload, get_user_by_payload
+from promise import Promise
+from rx import Observable
+
+from .backend import document_backend, document_hash
+from .concurrency import run_in_pool
+from .persisted import get_query_store
+from .schema import schema
+
+# Apollo の subscriptions-transport-ws のプロトコル
+GRAPHQL_WS = 'graphql-ws'
+GQL_CONNECTION_INIT = 'connection_init'
+GQL_CONNECTION_ACK = 'connection_ack'
+GQL_CONNECTION_ERROR = 'connection_error'
+GQL_CONNECTION_TERMINATE = 'connection_terminate'
+GQL_START = 'start'
+GQL_STOP = 'stop'
+GQL_DATA = 'data'
+GQL_ERROR = 'error'
+GQL_COMPLETE = 'complete'
+
+
+class SubscriptionContext:
+    """WebSocket 接続ごとのコンテキスト (HTTP の request の代わり)"""
+
+    def __init__(self, user):
+        self.user = user
+        self.loaders = None
+        self.graphql_trace = None
+
+
+def authenticate(payload):
+    """connection_init の authToken / Authorization から JWT を検証する"""
+    token = payload.get('authToken') or payload.get('Authorization') or ''
+    prefix = jwt_settings.JWT_AUTH_HEADER_PREFIX + ' '
+    if token.startswith(prefix):
+        token = token[len(prefix):]
+    if not token:
+        return AnonymousUser()
+    return get_user_by_payload(get_payload(token))
+
+
+def get_query(payload):
+    """start のペイロードのクエリを HTTP と同じく永続化クエリで検査して返す
+
+    WebSocket からは自動登録しない。
+    """
+    query = payload.get('query')
+    persisted_query = (payload.get('extensions') or {}).get('persistedQuery')
+    sha256_hash = (persisted_query or {}).get('sha256Hash')
+    store = get_query_store()
+    if sha256_hash is not None:
+        if not query:
+            query = store.get(sha256_hash)
+            if query is None:
+                raise GraphQLError('PersistedQueryNotFound')
+            return query
+        if document_hash(query) != sha256_hash:
+            raise GraphQLError('Provided sha256Hash does not match query.')
+    if (settings.GRAPHQL_API['PERSISTED_QUERIES_STRICT'] and query
+            and store.get(document_hash(query)) is None):
+        raise GraphQLError('PersistedQueryNotAllowed')
+    return query or ''
+
+
+def format_result(result):
+    data = result.data
+    if isinstance(data, dict):
+        # サブスクリプションの実行結果には DataLoader の Promise が残る
+        data = Promise.for_dict(data).get()
+    payload = {'data': data}
+    if result.errors:
+        payload['errors'] = [format_error(e) for e in result.errors]
+    return payload
+
+
+class GraphQLWebSocket:
+    """/graphql の WebSocket でサブスクリプションを提供する ASGI アプリケーション"""
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.context = None
+        self.operations = {}
+        self.outbox = asyncio.Queue()
+        self.loop = asyncio.get_event_loop()
+
+    async def __call__(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        if GRAPHQL_WS not in self.scope.get('subprotocols', []):
+            await self.send({'type': 'websocket.close', 'code': 1002})
+            return
+        await self.send({
+            'type': 'websocket.accept', 'subprotocol': GRAPHQL_WS})
+
+        writer = self.loop.create_task(self.write())
+        try:
+            while True:
+                message = await self.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if not await self.handle(message.get('text') or ''):
+                    await self.send({'type': 'websocket.close', 'code': 1000})
+                    break
+        finally:
+            for operation_id in list(self.operations):
+                self.stop(operation_id)
+            writer.cancel()
+
+    async def write(self):
+        while True:
+            text = await self.outbox.get()
+            await self.send({'type': 'websocket.send', 'text': text})
+
+    def post(self, type, id=None, payload=None):
+        """任意のスレッドから送信キューに積む"""
+        message = {'type': type}
+        if id is not None:
+            message['id'] = id
+        if payload is not None:
+            message['payload'] = payload
+        self.loop.call_soon_threadsafe(
+            self.outbox.put_nowait, json.dumps(message))
+
+    async def handle(self, text):
+        try:
+            message = json.loads(text)
+            type = message['type']
+        except (ValueError, KeyError, TypeError):
+            self.post(GQL_ERROR, payload={'message': 'Invalid message.'})
+            return True
+
+        if type == GQL_CONNECTION_INIT:
+            try:
+                user = await run_in_pool(
+                    'request', authenticate, message.get('payload') or {})
+            except JSONWebTokenError as e:
+                self.post(GQL_CONNECTION_ERROR, payload={'message': str(e)})
+                return False
+            self.context = SubscriptionContext(user)
+            self.post(GQL_CONNECTION_ACK)
+        elif type == GQL_CONNECTION_TERMINATE:
+            return False
+        elif type == GQL_START:
+            operation_id = message.get('id')
+            if self.context is None or operation_id in self.operations:
+                self.post(GQL_ERROR, operation_id, {
+                    'message': 'Connection not initialised or duplicate id.'})
+                return True
+            await run_in_pool(
+                'request', self.start, operation_id,
+                message.get('payload') or {})
+        elif type == GQL_STOP:
+            self.stop(message.get('id'))
+        return True
+
+    def start(self, operation_id, payload):
+        # クエリとミューテーションは HTTP で実行する (レスポンスキャッシュ・
+        # メトリクス・レプリカの振り分けを経由させるため)
+        try:
+            document = document_backend.document_from_string(
+                schema, get_query(payload))
+            operation_type = document.get_operation_type(
+                payload.get('operationName'))
+            if operation_type != 'subscription':
+                raise GraphQLError(
+                    'Only subscription operations are supported over '
+                    'WebSocket.')
+        except GraphQLError as e:
+            self.post(GQL_ERROR, operation_id, {'message': str(e)})
+            return
+
+        try:
+            result = document.execute(
+                context_value=self.context,
+                variable_values=payload.get('variables'),
+                operation_name=payload.get('operationName'),
+                allow_subscriptions=True,
+            )
+        except Exception as e:
+            result = ExecutionResult(errors=[GraphQLError(str(e))])
+
+        if not isinstance(result, Observable):
+            self.post(GQL_DATA, operation_id, format_result(result))
+            self.post(GQL_COMPLETE, operation_id)
+            return
+
+        def on_error(error):
+            self.post(GQL_ERROR, operation_id, {'message': str(error)})
+
+        def on_next(result):
+            self.post(GQL_DATA, operation_id, format_result(result))
+
+        self.operations[operation_id] = result.subscribe(
+            on_next=on_next,
+            on_error=on_error,
+            on_completed=lambda: self.post(GQL_COMPLETE, operation_id),
+        )
+
+    def stop(self, operation_id):
+        disposable = self.operations.pop(operation_id, None)
+        if disposable is not None:
+            disposable.dispose()
+
+
+async def websocket_application(scope, receive, send):
+    await GraphQLWebSocket(scope, receive, send)()
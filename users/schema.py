@@ -1,7 +1,9 @@
 import graphene
-from graphql_auth.schema import UserQuery, MeQuery
+from graphql_auth.schema import UserNode, UserQuery, MeQuery
 from graphql_auth import relay
 
+from blog.fields import CountOnDemandConnectionField
+
 
 class AuthMutation(graphene.ObjectType):
     register = relay.Register.Field()
@@ -22,7 +24,8 @@ class AuthMutation(graphene.ObjectType):
 
 
 class Query(UserQuery, MeQuery, graphene.ObjectType):
-    pass
+    # 既定のページサイズを適用するため、graphql_auth の users を置き換える
+    users = CountOnDemandConnectionField(UserNode)
 
 
 class Mutation(AuthMutation, graphene.ObjectType):